@@ -0,0 +1,113 @@
+"""
+Ride acceptance stress test.
+
+  DATABASE_URL=postgresql+psycopg2://... python benchmarks/bench_accept.py [--drivers 500] [--rounds 5]
+
+Every round books one ride, offers it to every driver and fires all the
+accepts at once. Exactly one driver must win each ride; the rest must get an
+immediate "taken". Prints the latency spread per round so it is easy to see
+that losers do not queue up behind the winner. Latencies include waiting for
+a worker thread and a pooled connection, so they track concurrency / pool
+size rather than lock waits.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent ride acceptance stress test")
+    parser.add_argument("--drivers", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault("RETENTION_INTERVAL_SECONDS", "0")
+    sys.path.insert(0, SERVER_DIR)
+
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import insert
+
+    from db import SessionLocal
+    from migrate import migrate
+    import bulk_import
+    import main as api
+    import models
+
+    migrate()
+    tag = uuid.uuid4().hex[:8]
+    driver_ids = bulk_import.load_rows("drivers", [
+        {"name": f"Bench {i}", "email": f"bench-{tag}-{i}@test.com", "location": "Bench",
+         "latitude": 12.97, "longitude": 77.59, "status": "online"}
+        for i in range(args.drivers)
+    ])["ids"]
+    user_id = bulk_import.load_rows("users", [{"name": "Bench Rider", "email": f"bench-{tag}@test.com"}])["ids"][0]
+
+    def offer_ride():
+        db = SessionLocal()
+        try:
+            ride_id = db.scalar(insert(models.RideQueue).values(
+                user_id=user_id, start="Bench A", destination="Bench B", status="searching",
+                fare=100.0, discount=0.0, final_fare=100.0, created_at=datetime.utcnow(),
+            ).returning(models.RideQueue.id))
+            request_ids = db.scalars(
+                insert(models.RideRequest).returning(models.RideRequest.id, sort_by_parameter_order=True),
+                [{"ride_id": ride_id, "driver_id": driver_id, "status": "pending"} for driver_id in driver_ids],
+            ).all()
+            db.commit()
+            return ride_id, list(zip(driver_ids, request_ids))
+        finally:
+            db.close()
+
+    async def accept(client, driver_id, request_id):
+        started = time.perf_counter()
+        response = await client.post(f"/accept-ride-request/{request_id}?driver_id={driver_id}")
+        return (time.perf_counter() - started) * 1000, response.json()
+
+    async def run():
+        transport = ASGITransport(app=api.app)
+        async with AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            print(f"🏁 {args.drivers} concurrent accepts per ride, {args.rounds} rounds")
+            failures = 0
+            for round_number in range(1, args.rounds + 1):
+                ride_id, offers = offer_ride()
+                started = time.perf_counter()
+                results = await asyncio.gather(*[accept(client, d, r) for d, r in offers])
+                wall_ms = (time.perf_counter() - started) * 1000
+                winners = [body for _, body in results if body.get("message") == "Ride accepted"]
+                taken = sum(1 for _, body in results if body.get("status") == "taken")
+                latencies = [ms for ms, _ in results]
+                ok = len(winners) == 1 and taken == len(offers) - 1
+                failures += not ok
+                print(f"   ride {ride_id}: winners={len(winners)} taken={taken} "
+                      f"p50={statistics.median(latencies):.0f}ms p99={percentile(latencies, 0.99):.0f}ms "
+                      f"max={max(latencies):.0f}ms wall={wall_ms:.0f}ms {'✅' if ok else '❌'}")
+                # Free the drivers for the next round
+                db = SessionLocal()
+                try:
+                    db.query(models.Driver).filter(models.Driver.id.in_(driver_ids)).update(
+                        {"status": "online"}, synchronize_session=False)
+                    db.commit()
+                finally:
+                    db.close()
+            return failures
+
+    failures = asyncio.run(run())
+    api.trip_scheduler.stop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Zone-sharded dispatch benchmark.
+
+  python benchmarks/bench_dispatch.py [--size 120] [--drivers 4000] [--rides 2000] [--workers 1 2 4 8]
+
+Builds a synthetic street grid (see bench_road_network.py), spreads drivers
+over it and dispatches a burst of pickups through a DispatchPool of 1, 2,
+4 and 8 worker processes, with the city split into a 2x4 zone grid. Each
+dispatch finds the nearest drivers in the pickup's zone and ranks them by
+road ETA in the owning worker. Reports dispatches per second and speedup
+over one worker; speedup is capped by the number of cores.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(os.path.dirname(BENCH_DIR), "server")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Zone-sharded dispatch benchmark")
+    parser.add_argument("--size", type=int, default=120, help="streets per side of the synthetic grid")
+    parser.add_argument("--drivers", type=int, default=4000)
+    parser.add_argument("--rides", type=int, default=2000)
+    parser.add_argument("--candidates", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent booking threads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    sys.path.insert(0, SERVER_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    from bench_road_network import SPACING, write_grid
+    import dispatch_pool
+    import road_network
+    import zones
+
+    workdir = tempfile.mkdtemp(prefix="bench-dispatch-")
+    osm_path = os.path.join(workdir, "grid.osm")
+    write_grid(osm_path, args.size)
+    started = time.perf_counter()
+    road_network.RoadNetwork.load(osm_path)  # compiles and caches the network once for every worker
+    print(f"🗺️  {args.size}x{args.size} grid compiled in {time.perf_counter() - started:.1f}s")
+
+    south, west = 12.9, 77.5
+    north, east = south + (args.size - 1) * SPACING, west + (args.size - 1) * SPACING
+    grid = zones.ZoneGrid([south, west, north, east], rows=2, cols=4, border_km=1)
+    rng = random.Random(7)
+
+    def point():
+        return south + rng.random() * (north - south), west + rng.random() * (east - west)
+
+    drivers = [(driver_id, *point(), "online") for driver_id in range(1, args.drivers + 1)]
+    pickups = [point() for _ in range(args.rides)]
+
+    print(f"🏁 {args.drivers} drivers, {args.rides} pickups, {len(grid)} zones, {os.cpu_count()} cores")
+    baseline = None
+    for workers in args.workers:
+        pool = dispatch_pool.DispatchPool(workers=workers, zones=grid, network_path=osm_path, timeout=120)
+        pool.start()
+        try:
+            pool.update_drivers(drivers)
+            # Every worker has loaded its network and index once it answers
+            for lat, lng in pickups[:workers * 4]:
+                pool.dispatch(lat, lng, args.candidates, 5)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(args.clients) as clients:
+                found = list(clients.map(lambda p: len(pool.dispatch(p[0], p[1], args.candidates, 5)), pickups))
+            took = time.perf_counter() - started
+        finally:
+            pool.stop()
+        rate = len(pickups) / took
+        baseline = baseline or rate
+        print(f"   {workers} worker{'s' if workers > 1 else ' '}: {rate:8,.0f} dispatches/s  "
+              f"x{rate / baseline:.2f}  ({sum(found) / len(found):.1f} candidates each)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Batch heartbeat ingestion benchmark.
+
+  DATABASE_URL=postgresql+psycopg2://... python benchmarks/bench_heartbeats.py [--drivers 20000] [--batch 5000]
+
+Registers a fleet, then relays rounds of position fixes for every driver
+through POST /heartbeats as binary frames, a few batches in flight at once,
+and reports sustained fixes per second. The target is 50k/s on one node.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import struct
+import sys
+import time
+import uuid
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+FRAME = struct.Struct("<Iddd")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch heartbeat ingestion benchmark")
+    parser.add_argument("--drivers", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--json", action="store_true", help="send JSON arrays instead of binary frames")
+    args = parser.parse_args()
+
+    os.environ.setdefault("RETENTION_INTERVAL_SECONDS", "0")
+    sys.path.insert(0, SERVER_DIR)
+
+    import orjson
+    from httpx import ASGITransport, AsyncClient
+
+    from migrate import migrate
+    import bulk_import
+    import main as api
+
+    migrate()
+    tag = uuid.uuid4().hex[:8]
+    driver_ids = bulk_import.load_rows("drivers", [
+        {"name": f"Fleet {i}", "email": f"fleet-{tag}-{i}@test.com", "location": "Fleet", "status": "online"}
+        for i in range(args.drivers)
+    ])["ids"]
+
+    rng = random.Random(42)
+    started_at = time.time()
+
+    def payload(batch, stamp):
+        fixes = [(driver_id, 12.9 + rng.random() * 0.2, 77.5 + rng.random() * 0.2, stamp) for driver_id in batch]
+        if args.json:
+            return orjson.dumps(fixes), "application/json"
+        return b"".join(FRAME.pack(*fix) for fix in fixes), "application/octet-stream"
+
+    async def run():
+        limit = asyncio.Semaphore(args.in_flight)
+        transport = ASGITransport(app=api.app)
+        async with AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def send(body, content_type):
+                async with limit:
+                    reply = await client.post("/heartbeats", content=body, headers={"content-type": content_type})
+                return reply.json()["applied"]
+
+            total = applied = 0
+            elapsed = 0.0
+            for round_number in range(args.rounds):
+                stamp = started_at + round_number
+                # Encode up front so only the server side is timed
+                payloads = [payload(driver_ids[i:i + args.batch], stamp) for i in range(0, len(driver_ids), args.batch)]
+                started = time.perf_counter()
+                counts = await asyncio.gather(*[send(*p) for p in payloads])
+                took = time.perf_counter() - started
+                elapsed += took
+                total += len(driver_ids)
+                applied += sum(counts)
+                print(f"   round {round_number + 1}: {len(driver_ids) / took:,.0f} fixes/s ({took * 1000:.0f}ms)")
+            return total, applied, elapsed
+
+    print(f"🏁 {args.drivers} drivers, {args.batch} fixes per request, {args.in_flight} in flight, "
+          f"{'JSON' if args.json else 'binary frames'}")
+    total, applied, elapsed = asyncio.run(run())
+    print(f"   {total / elapsed:,.0f} fixes/s sustained, {applied}/{total} applied")
+    api.trip_scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Shared ride page benchmark.
+
+  DATABASE_URL=postgresql+psycopg2://... python benchmarks/bench_ride_pages.py [--rides 5000] [--concurrency 200]
+
+Creates a batch of assigned rides, far more than a per-ride container setup
+could keep running, and fetches every rider's /ride/{id}/view page
+concurrently. Each page must embed its own ride. No ports or containers are
+involved, so the number of active rides is bounded by the database alone.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared ride page benchmark")
+    parser.add_argument("--rides", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ.setdefault("RETENTION_INTERVAL_SECONDS", "0")
+    os.environ["RIDE_PAGE_MODE"] = "shared"
+    sys.path.insert(0, SERVER_DIR)
+
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import delete, insert
+
+    from db import SessionLocal
+    from migrate import migrate
+    import bulk_import
+    import main as api
+    import models
+
+    migrate()
+    tag = uuid.uuid4().hex[:8]
+    driver_id = bulk_import.load_rows("drivers", [
+        {"name": "Page Bench", "email": f"pages-{tag}@test.com", "location": "Bench", "status": "on_trip"}
+    ])["ids"][0]
+    user_id = bulk_import.load_rows("users", [{"name": "Page Rider", "email": f"pages-{tag}@test.com"}])["ids"][0]
+
+    db = SessionLocal()
+    try:
+        ride_ids = db.scalars(
+            insert(models.RideQueue).returning(models.RideQueue.id, sort_by_parameter_order=True),
+            [{"user_id": user_id, "driver_id": driver_id, "start": f"Bench {i}", "destination": "Bench End",
+              "status": "assigned", "fare": 100.0, "discount": 0.0, "final_fare": 100.0,
+              "created_at": datetime.utcnow()} for i in range(args.rides)],
+        ).all()
+        db.commit()
+    finally:
+        db.close()
+
+    async def run():
+        limit = asyncio.Semaphore(args.concurrency)
+        transport = ASGITransport(app=api.app)
+        async with AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def view(ride_id):
+                async with limit:
+                    started = time.perf_counter()
+                    response = await client.get(f"/ride/{ride_id}/view")
+                    elapsed = (time.perf_counter() - started) * 1000
+                embedded = json.loads(response.text.split("window.RIDE = ", 1)[1].split(";</script>", 1)[0])
+                return elapsed, embedded["ride_id"] == ride_id
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*[view(ride_id) for ride_id in ride_ids])
+            return time.perf_counter() - started, results
+
+    print(f"🏁 {args.rides} active rides, {args.concurrency} page loads in flight")
+    wall, results = asyncio.run(run())
+    latencies = [ms for ms, _ in results]
+    correct = sum(ok for _, ok in results)
+    print(f"   {len(results) / wall:.0f} pages/s, p50={statistics.median(latencies):.0f}ms "
+          f"p99={percentile(latencies, 0.99):.0f}ms, {correct}/{len(results)} embedded the right ride "
+          f"{'✅' if correct == len(results) else '❌'}")
+
+    db = SessionLocal()
+    try:
+        db.execute(delete(models.RideQueue).where(models.RideQueue.id.in_(ride_ids)))
+        db.commit()
+    finally:
+        db.close()
+    api.trip_scheduler.stop()
+    sys.exit(0 if correct == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Road network ETA benchmark.
+
+  python benchmarks/bench_road_network.py [--osm city.osm] [--size 150] [--drivers 200]
+
+Without --osm a synthetic city is generated: a size x size street grid
+with a faster avenue every tenth street. Reports build/cache-load time,
+point-to-point A* latency and one-to-many dispatch latency against a
+batch of random driver positions.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+SPACING = 0.001  # about 110m between intersections
+
+
+def write_grid(path, size):
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for row in range(size):
+            for col in range(size):
+                f.write(f'<node id="{row * size + col + 1}" lat="{12.9 + row * SPACING:.6f}" '
+                        f'lon="{77.5 + col * SPACING:.6f}"/>\n')
+        way_id = 1
+        for line in range(size):
+            highway = "primary" if line % 10 == 0 else "residential"
+            for refs in ([line * size + col + 1 for col in range(size)],
+                         [row * size + line + 1 for row in range(size)]):
+                f.write(f'<way id="{way_id}">' + "".join(f'<nd ref="{r}"/>' for r in refs)
+                        + f'<tag k="highway" v="{highway}"/></way>\n')
+                way_id += 1
+        f.write("</osm>\n")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Road network ETA benchmark")
+    parser.add_argument("--osm")
+    parser.add_argument("--size", type=int, default=150)
+    parser.add_argument("--drivers", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    sys.path.insert(0, SERVER_DIR)
+    from road_network import RoadNetwork
+
+    with tempfile.TemporaryDirectory() as tmp:
+        osm = args.osm or os.path.join(tmp, "grid.osm")
+        if not args.osm:
+            write_grid(osm, args.size)
+
+        started = time.perf_counter()
+        network = RoadNetwork.load(osm)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        network = RoadNetwork.load(osm)
+        loaded = time.perf_counter() - started
+        print(f"🗺️  {network.node_count} nodes, {network.edge_count} edges, {len(network.landmarks)} landmarks")
+        print(f"   build {built:.1f}s, cached load {loaded * 1000:.0f}ms")
+
+        rng = random.Random(7)
+        lats = (min(network.lat), max(network.lat))
+        lons = (min(network.lon), max(network.lon))
+
+        def point():
+            return rng.uniform(*lats), rng.uniform(*lons)
+
+        latencies = []
+        for _ in range(args.queries):
+            a, b = point(), point()
+            started = time.perf_counter()
+            network.eta(*a, *b)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"   point-to-point: p50={statistics.median(latencies):.2f}ms p99={percentile(latencies, 0.99):.2f}ms")
+
+        latencies = []
+        for _ in range(max(1, args.queries // 10)):
+            pickup = point()
+            drivers = [point() for _ in range(args.drivers)]
+            started = time.perf_counter()
+            network.etas_to(*pickup, drivers)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"   one-to-{args.drivers}: p50={statistics.median(latencies):.1f}ms "
+              f"p99={percentile(latencies, 0.99):.1f}ms")
+
+        if not args.osm:
+            os.remove(f"{osm}.rnet")
+
+
+if __name__ == "__main__":
+    main()
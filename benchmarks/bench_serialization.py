@@ -0,0 +1,101 @@
+"""
+Serialization benchmark for the list endpoints.
+
+  python benchmarks/bench_serialization.py [--rows 10000] [--repeat 5]
+
+Seeds a throwaway SQLite database with ride rows and compares the old path
+(hydrate ORM objects, jsonable_encoder, json.dumps) with the current one
+(column select, plain dicts, orjson), then times GET /queue end to end.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare list endpoint serialization paths")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("RETENTION_INTERVAL_SECONDS", "0")
+    sys.path.insert(0, SERVER_DIR)
+
+    from fastapi.encoders import jsonable_encoder
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import insert
+
+    from db import SessionLocal, engine
+    from migrate import migrate
+    from responses import ORJSONResponse, columns
+    import models
+    import schemas
+
+    migrate()
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(models.RideQueue), [{
+            "user_id": 1, "start": f"Pickup {i}", "destination": f"Drop {i}",
+            "pickup_lat": 12.97, "pickup_lng": 77.59, "dest_lat": 12.3, "dest_lng": 76.6,
+            "status": "completed", "driver_id": 1, "fare": 100.0, "discount": 0.0,
+            "final_fare": 100.0, "created_at": now,
+        } for i in range(args.rows)])
+
+    def orm_path():
+        db = SessionLocal()
+        try:
+            rides = db.query(models.RideQueue).order_by(models.RideQueue.id).all()
+            return len(json.dumps(jsonable_encoder(rides)).encode())
+        finally:
+            db.close()
+
+    def column_path():
+        db = SessionLocal()
+        try:
+            query = db.query(*columns(models.RideQueue, schemas.QueueRide)).order_by(models.RideQueue.id)
+            return len(ORJSONResponse([row._asdict() for row in query]).body)
+        finally:
+            db.close()
+
+    import main as api
+
+    async def endpoint():
+        transport = ASGITransport(app=api.app)
+        async with AsyncClient(transport=transport, base_url="http://bench") as client:
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                response = await client.get("/queue")
+                samples.append((time.perf_counter() - started) * 1000)
+            return statistics.median(samples), len(response.content)
+
+    print(f"📊 {args.rows} rides, median of {args.repeat} runs")
+    for name, fn in (("ORM + jsonable_encoder + json", orm_path), ("columns + orjson", column_path)):
+        ms, size = timed(fn, args.repeat)
+        print(f"   {name:<32} {ms:8.1f} ms  {size / 1024:8.0f} KiB")
+    ms, size = asyncio.run(endpoint())
+    print(f"   {'GET /queue end to end':<32} {ms:8.1f} ms  {size / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Cold start benchmark for the API process.
+
+  python benchmarks/bench_startup.py [--runs 5] [--budget-ms 300]
+
+Each run starts a fresh interpreter, imports the framework packages, then
+imports `main` and runs its startup hooks, pointed at a database that does
+not exist. Startup must not wait for the database, so the time spent in our
+own code (import + hooks, framework imports excluded) has to stay under the
+budget. Total interpreter time is reported alongside it.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server")
+UNREACHABLE_DATABASE_URL = "postgresql+psycopg2://mini_uber@127.0.0.1:9/mini_uber"
+
+CHILD = """
+import json, sys, time, warnings
+warnings.simplefilter("ignore")
+start = time.perf_counter()
+import fastapi, pydantic, sqlalchemy, sqlalchemy.orm, starlette.concurrency, psycopg2
+frameworks = time.perf_counter()
+import main
+for hook in main.app.router.on_startup:
+    hook()
+ready = time.perf_counter()
+sys.stderr.write(json.dumps({"frameworks_ms": (frameworks - start) * 1000, "app_ms": (ready - frameworks) * 1000}))
+"""
+
+
+def run_once(database_url: str):
+    env = dict(os.environ, DATABASE_URL=database_url, RETENTION_INTERVAL_SECONDS="0")
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD], cwd=SERVER_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    total_ms = (time.perf_counter() - started) * 1000
+    # stdout carries the app's own logging (e.g. the background database wait)
+    timings = json.loads(result.stderr.strip().splitlines()[-1])
+    timings["total_ms"] = total_ms
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API cold start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "300")))
+    parser.add_argument("--database-url", default=UNREACHABLE_DATABASE_URL)
+    args = parser.parse_args()
+
+    runs = [run_once(args.database_url) for _ in range(args.runs)]
+    medians = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    print(f"⏱️  {args.runs} cold starts (median)")
+    print(f"   interpreter total: {medians['total_ms']:.0f} ms")
+    print(f"   framework imports: {medians['frameworks_ms']:.0f} ms")
+    print(f"   app import + startup hooks: {medians['app_ms']:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if medians["app_ms"] > args.budget_ms:
+        print("❌ Cold start is over budget")
+        sys.exit(1)
+    print("✅ Cold start is within budget")
+
+
+if __name__ == "__main__":
+    main()
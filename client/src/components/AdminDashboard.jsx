@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import axios from "axios";
 import { API_BASE_URL } from "../config";
@@ -126,22 +126,14 @@ export default function AdminDashboard({ onLogout }) {
     }
   };
 
+  // Cursor into the server's event log; polls only fetch what changed since
+  const changesCursor = useRef(null);
+
   const fetchRides = async () => {
     try {
       const response = await axios.get(`${API_BASE_URL}/queue`);
       setRides(response.data);
-      
-      const totalRevenue = response.data.reduce((sum, ride) => sum + (ride.final_fare || 0), 0);
-      const totalDiscount = response.data.reduce((sum, ride) => sum + (ride.discount || 0), 0);
-      const activeRides = response.data.filter(r => r.status === 'assigned' || r.status === 'pending').length;
-      
-      setStats(prev => ({
-        ...prev,
-        totalRides: response.data.length,
-        activeRides,
-        totalRevenue,
-        totalDiscount
-      }));
+      return response.headers["x-changes-cursor"];
     } catch (error) {
       console.error("Error fetching rides:", error);
     }
@@ -151,12 +143,79 @@ export default function AdminDashboard({ onLogout }) {
     try {
       const response = await axios.get(`${API_BASE_URL}/available-drivers`);
       setDrivers(response.data);
-      setStats(prev => ({ ...prev, onlineDrivers: response.data.length }));
     } catch (error) {
       console.error("Error fetching drivers:", error);
     }
   };
 
+  const fetchSnapshot = async () => {
+    // /queue reports the event cursor its rows are at least as new as
+    const [cursor] = await Promise.all([fetchRides(), fetchDrivers()]);
+    if (cursor !== undefined) changesCursor.current = Number(cursor);
+  };
+
+  const applyChanges = (events) => {
+    const rideEvents = events.filter(e => e.entity === "ride");
+    const driverEvents = events.filter(e => e.entity === "driver");
+
+    if (rideEvents.length) {
+      setRides(prev => {
+        const byId = new Map(prev.map(ride => [ride.id, ride]));
+        for (const event of rideEvents) {
+          byId.set(event.entity_id, { ...(byId.get(event.entity_id) || { id: event.entity_id }), ...event.payload });
+        }
+        return Array.from(byId.values()).sort((a, b) => a.id - b.id);
+      });
+    }
+    if (driverEvents.length) {
+      setDrivers(prev => {
+        const byId = new Map(prev.map(driver => [driver.id, driver]));
+        for (const event of driverEvents) {
+          const driver = { ...(byId.get(event.entity_id) || { id: event.entity_id }), ...event.payload };
+          if (driver.status === "online") byId.set(driver.id, driver);
+          else byId.delete(driver.id);
+        }
+        return Array.from(byId.values());
+      });
+    }
+  };
+
+  const syncChanges = async () => {
+    if (changesCursor.current === null) return fetchSnapshot();
+    try {
+      let page;
+      do {
+        const response = await axios.get(`${API_BASE_URL}/changes`, {
+          params: { since: changesCursor.current }
+        });
+        page = response.data;
+        if (page.reset) return fetchSnapshot();
+        applyChanges(page.events);
+        changesCursor.current = page.cursor;
+      } while (page.has_more);
+    } catch (error) {
+      console.error("Error syncing changes:", error);
+    }
+  };
+
+  // Totals come from the server's ride rollups rather than the loaded rows
+  const fetchStats = async () => {
+    try {
+      const response = await axios.get(`${API_BASE_URL}/admin/stats`, { params: { period: "all" } });
+      const data = response.data;
+      setStats(prev => ({
+        ...prev,
+        totalRides: data.booked,
+        activeRides: data.active_rides,
+        totalRevenue: data.revenue,
+        totalDiscount: data.discounts,
+        onlineDrivers: data.online_drivers
+      }));
+    } catch (error) {
+      console.error("Error fetching stats:", error);
+    }
+  };
+
   const createCoupon = async (e) => {
     e.preventDefault();
     
@@ -194,12 +253,12 @@ export default function AdminDashboard({ onLogout }) {
 
   useEffect(() => {
     fetchCoupons();
-    fetchRides();
-    fetchDrivers();
+    fetchSnapshot().catch(error => console.error("Error fetching snapshot:", error));
+    fetchStats();
     
     const interval = setInterval(() => {
-      fetchRides();
-      fetchDrivers();
+      syncChanges();
+      fetchStats();
     }, 5000);
     
     return () => clearInterval(interval);
@@ -425,14 +484,17 @@ export default function AdminDashboard({ onLogout }) {
                       const startTime = Date.now();
                       setStats(prev => ({...prev, isSimulating: true}));
                       
+                      const stamp = Date.now();
+                      const rows = [];
                       for (let i = 0; i < num; i++) {
-                        await axios.post(`${API_BASE_URL}/register-user`, null, {
-                          params: {
-                            name: `User${Date.now()}-${i}`,
-                            email: `user${Date.now()}-${i}@test.com`
-                          }
-                        });
+                        rows.push(JSON.stringify({
+                          name: `User${stamp}-${i}`,
+                          email: `user${stamp}-${i}@test.com`
+                        }));
                       }
+                      await axios.post(`${API_BASE_URL}/bulk-register-users`, rows.join('\n'), {
+                        headers: { 'Content-Type': 'application/x-ndjson' }
+                      });
                       
                       const duration = ((Date.now() - startTime) / 1000).toFixed(2);
                       alert(`✅ Created ${num} users in ${duration}s\n📈 Rate: ${(num/duration).toFixed(1)} users/sec`);
@@ -470,22 +532,22 @@ export default function AdminDashboard({ onLogout }) {
                       const startTime = Date.now();
                       setStats(prev => ({...prev, isSimulating: true}));
                       
+                      const stamp = Date.now();
+                      const rows = [];
                       for (let i = 0; i < num; i++) {
                         const loc = locations[i % locations.length];
-                        const response = await axios.post(`${API_BASE_URL}/register-driver`, null, {
-                          params: {
-                            name: `Driver${Date.now()}-${i}`,
-                            email: `driver${Date.now()}-${i}@test.com`,
-                            location: loc.name,
-                            latitude: loc.lat + (Math.random() - 0.5) * 0.1,
-                            longitude: loc.lng + (Math.random() - 0.5) * 0.1
-                          }
-                        });
-                        const driverId = response.data.driver_id;
-                        await axios.post(`${API_BASE_URL}/go-online`, null, {
-                          params: { driver_id: driverId }
-                        });
+                        rows.push(JSON.stringify({
+                          name: `Driver${stamp}-${i}`,
+                          email: `driver${stamp}-${i}@test.com`,
+                          location: loc.name,
+                          latitude: loc.lat + (Math.random() - 0.5) * 0.1,
+                          longitude: loc.lng + (Math.random() - 0.5) * 0.1,
+                          status: 'online'
+                        }));
                       }
+                      await axios.post(`${API_BASE_URL}/bulk-register-drivers`, rows.join('\n'), {
+                        headers: { 'Content-Type': 'application/x-ndjson' }
+                      });
                       
                       const duration = ((Date.now() - startTime) / 1000).toFixed(2);
                       alert(`✅ Created ${num} drivers in ${duration}s\n📈 Rate: ${(num/duration).toFixed(1)} drivers/sec`);
@@ -504,7 +566,7 @@ export default function AdminDashboard({ onLogout }) {
                     <input
                       type="number"
                       min="1"
-                      max="50"
+                      max="10000"
                       defaultValue="5"
                       id="numRides"
                       className="w-full px-4 py-2 bg-white/20 border border-white/30 rounded-lg text-white"
@@ -531,26 +593,21 @@ export default function AdminDashboard({ onLogout }) {
                       }
                       
                       try {
-                        // Create rides directly with unique drivers (bypasses request/accept flow)
-                        const ridePromises = [];
-                        for (let i = 0; i < Math.min(num, availableDrivers.length); i++) {
-                          const driver = availableDrivers[i];
-                          const promise = axios.post(`${API_BASE_URL}/simulate-ride-with-driver`, null, {
-                            params: {
-                              user_id: 1,
-                              driver_id: driver.id
-                            }
-                          });
-                          ridePromises.push(promise);
-                          // Small delay between each ride to prevent port conflicts
-                          await new Promise(resolve => setTimeout(resolve, 300));
+                        // Create all rides in one batch (bypasses request/accept flow);
+                        // trips are completed by the server's scheduler without containers.
+                        // Without user_ids the server books them as its simulator rider
+                        const response = await axios.post(`${API_BASE_URL}/simulate-rides-batch`, {
+                          driver_ids: availableDrivers.map(driver => driver.id),
+                          rides: num,
+                          use_containers: false
+                        });
+                        if (response.data.error) {
+                          throw new Error(response.data.error);
                         }
-                        
-                        const results = await Promise.all(ridePromises);
-                        const successCount = results.filter(r => !r.data.error).length;
+                        const successCount = response.data.count;
                         
                         const duration = ((Date.now() - startTime) / 1000).toFixed(2);
-                        alert(`✅ Created ${successCount} concurrent rides in ${duration}s\n🐳 Check Docker Desktop for ${successCount} ride containers!\n📊 Containers: ride-1, ride-2, ride-3...\n🌐 Access at: localhost:7000, 7001, 7002...`);
+                        alert(`✅ Created ${successCount} concurrent rides in ${duration}s\n⏱️ Trips complete in ${response.data.completes_in_seconds}s`);
                         setStats(prev => ({...prev, isSimulating: false}));
                         fetchRides();
                       } catch (error) {
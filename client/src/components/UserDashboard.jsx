@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import axios from "axios";
 import { API_BASE_URL } from "../config";
@@ -87,20 +87,25 @@ export default function UserDashboard({ user, onLogout }) {
   const [merchantCoupons, setMerchantCoupons] = useState([]);
   const [showMerchantCoupons, setShowMerchantCoupons] = useState(false);
 
-  const searchLocation = async (query, setSuggestions) => {
-    if (query.length < 3) {
+  const searchTimer = useRef(null);
+
+  const searchLocation = (query, setSuggestions) => {
+    clearTimeout(searchTimer.current);
+    if (query.length < 2) {
       setSuggestions([]);
       return;
     }
-    try {
-      const response = await fetch(
-        `https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(query)}&limit=5`
-      );
-      const data = await response.json();
-      setSuggestions(data);
-    } catch (error) {
-      console.error('Geocoding error:', error);
-    }
+    // Wait for a pause in typing; the server answers from its local gazetteer
+    searchTimer.current = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API_BASE_URL}/autocomplete`, {
+          params: { q: query, limit: 5 }
+        });
+        setSuggestions(response.data);
+      } catch (error) {
+        console.error('Geocoding error:', error);
+      }
+    }, 150);
   };
 
   const fetchCoupons = async () => {
@@ -439,12 +444,16 @@ export default function UserDashboard({ user, onLogout }) {
               <div className="bg-white rounded-xl p-4 overflow-hidden">
                 <p className="text-sm text-gray-600">Status</p>
                 <p className="font-semibold text-gray-900 mb-2">{currentRide.status === "pending" ? "🔍 Finding Driver" : "🚗 Driver Assigned"}</p>
-                {currentRide.status === "assigned" && currentRide.port && (
+                {currentRide.status === "assigned" && (
                   <div className="mt-3 p-3 bg-blue-50 rounded-lg overflow-hidden">
-                    <p className="text-sm font-semibold text-blue-800 mb-2">🐈 Your Ride Container:</p>
-                    <p className="text-sm text-blue-600 mb-3 break-all">Port: <code className="bg-blue-100 px-2 py-1 rounded">{currentRide.port}</code></p>
+                    {currentRide.port && (
+                      <>
+                        <p className="text-sm font-semibold text-blue-800 mb-2">🐈 Your Ride Container:</p>
+                        <p className="text-sm text-blue-600 mb-3 break-all">Port: <code className="bg-blue-100 px-2 py-1 rounded">{currentRide.port}</code></p>
+                      </>
+                    )}
                     <a 
-                      href={`http://localhost:${currentRide.port}`}
+                      href={currentRide.port ? `http://localhost:${currentRide.port}` : `${API_BASE_URL}/ride/${currentRide.id}/view`}
                       target="_blank"
                       rel="noopener noreferrer"
                       className="inline-block px-4 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-all duration-300 hover:scale-105 text-sm"
@@ -1,8 +1,26 @@
 // config.js
 
+import axios from "axios";
+
 // Just edit this ONE variable when backend URL changes
 export const API_BASE_URL = "http://localhost:8000";
 
+// Reads may be served by a lagging replica. After our own writes, echo the
+// server's X-Last-Write stamp for a few seconds so those reads see them.
+const READ_YOUR_WRITES_MS = 5000;
+let lastWrite = null;
+axios.interceptors.response.use((response) => {
+  const stamp = response.headers["x-last-write"];
+  if (stamp) lastWrite = { stamp, at: Date.now() };
+  return response;
+});
+axios.interceptors.request.use((config) => {
+  if (lastWrite && Date.now() - lastWrite.at < READ_YOUR_WRITES_MS) {
+    config.headers["X-Last-Write"] = lastWrite.stamp;
+  }
+  return config;
+});
+
 ;
 // examples:
 // "http://192.168.1.5:8000"   (local network IP)
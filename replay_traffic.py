@@ -0,0 +1,327 @@
+"""
+Replay captured production traffic against a test instance.
+
+  python replay_traffic.py captures/ --target http://localhost:8001 [--speed 10] [--concurrency 64] [--report out.json]
+
+Reads the NDJSON files written by server/traffic_capture.py (a directory or
+individual files) and re-sends every request at its recorded offset from
+the first one, divided by --speed ("max" sends as fast as causality allows).
+
+Ids the server hands out differ between the capture and the replay, so a
+request is held back until the requests that produced the ids it refers to
+have been answered, and those ids are rewritten to the replay's values in
+the path, query string and JSON body. An id is "produced" by the first
+request whose response contains it under a `*_id` key (or in the "ids" list
+of a bulk register), e.g. a booking produces the ride_id that a later
+accept refers to. Path parameters are matched against the target's
+/openapi.json so /ride/88/path is recognised as /ride/{ride_id}/path.
+
+Prints recorded vs replayed p50/p95 latency per route, how many responses
+came back with a different status than they did in production, and how
+many carried an {"error": ...} body.
+"""
+
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+
+ID_KEY = re.compile(r"^(\w+)_id$")
+BULK_REGISTER = re.compile(r"^/bulk-register-(\w+?)s$")
+PARAM = re.compile(r"\{(\w+)\}")
+
+
+def load(paths):
+    """Captured records from files and directories, oldest first"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "traffic-*.ndjson"))))
+        else:
+            files.append(path)
+    records = []
+    for name in files:
+        with open(name, "rb") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: (r["ts"], r["seq"]))
+    return records
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else None
+
+
+class Routes:
+    """Path templates from an OpenAPI document"""
+
+    def __init__(self, openapi: dict):
+        self.routes = []
+        for template in (openapi or {}).get("paths", {}):
+            names = PARAM.findall(template)
+            pattern = re.escape(template)
+            for name in names:
+                pattern = pattern.replace(re.escape("{" + name + "}"), f"(?P<{name}>[^/]+)")
+            # Literal paths win over templated ones (/drivers/online before /drivers/{driver_id})
+            self.routes.append((len(names), re.compile(f"^{pattern}$"), template, names))
+        self.routes.sort(key=lambda route: route[0])
+
+    @classmethod
+    async def fetch(cls, client):
+        try:
+            response = await client.get("/openapi.json")
+            return cls(response.json() if response.status_code == 200 else None)
+        except (httpx.HTTPError, ValueError):
+            return cls(None)
+
+    def match(self, path: str):
+        """(template, {param: value}); unknown paths are their own template"""
+        for _, pattern, template, _ in self.routes:
+            found = pattern.match(path)
+            if found:
+                return template, found.groupdict()
+        return path, {}
+
+
+def _kind(key):
+    found = ID_KEY.match(key) if isinstance(key, str) else None
+    return found.group(1) if found else None
+
+
+def _as_id(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def json_ids(data, path: str = "", where=()):
+    """(location, kind, id) for every id in a JSON document"""
+    found = []
+    bulk = BULK_REGISTER.match(path)
+    if isinstance(data, dict):
+        for key, value in data.items():
+            kind = _kind(key)
+            if kind and _as_id(value) is not None:
+                found.append((where + (key,), kind, _as_id(value)))
+            elif key == "ids" and bulk and isinstance(value, list):
+                found.extend((where + (key, i), bulk.group(1), v) for i, v in enumerate(value) if _as_id(v) is not None)
+            elif isinstance(value, (dict, list)):
+                found.extend(json_ids(value, "", where + (key,)))
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            if isinstance(value, (dict, list)):
+                found.extend(json_ids(value, "", where + (i,)))
+    return found
+
+
+def _json(text):
+    if not isinstance(text, str) or not text:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+class Exchange:
+    """One captured request, with the ids it uses and the ids it produced"""
+
+    def __init__(self, record: dict, routes: Routes):
+        self.record = record
+        self.template, self.params = routes.match(record["path"])
+        self.query = parse_qsl(record.get("query") or "", keep_blank_values=True)
+        self.body = _json(record["body"]) if "json" in (record.get("content_type") or "") else None
+        self.response = _json(record.get("response"))
+        self.uses = []  # ("path" | "query" | "body", location, kind, id)
+        for name, value in self.params.items():
+            if _kind(name) and _as_id(value) is not None:
+                self.uses.append(("path", name, _kind(name), _as_id(value)))
+        for i, (key, value) in enumerate(self.query):
+            if _kind(key) and _as_id(value) is not None:
+                self.uses.append(("query", i, _kind(key), _as_id(value)))
+        if "ndjson" not in (record.get("content_type") or ""):
+            self.uses.extend(("body", where, kind, value) for where, kind, value in json_ids(self.body))
+        self.returns = json_ids(self.response, record["path"])
+
+    def request(self, ids: dict):
+        """(method, url, content, headers) with ids mapped to the replay's"""
+        def new(kind, old):
+            return ids.get((kind, old), old)
+
+        path = self.record["path"]
+        if self.params:
+            values = dict(self.params)
+            for where, location, kind, old in self.uses:
+                if where == "path":
+                    values[location] = str(new(kind, old))
+            path = PARAM.sub(lambda m: values.get(m.group(1), m.group(0)), self.template)
+        query = list(self.query)
+        body = self.body
+        for where, location, kind, old in self.uses:
+            if where == "query":
+                query[location] = (query[location][0], str(new(kind, old)))
+            elif where == "body":
+                body = _replace(body, location, new(kind, old))
+        url = path + ("?" + urlencode(query) if query else "")
+        content = self.record["body"]
+        if isinstance(content, dict):  # binary bodies are kept base64-encoded
+            content = base64.b64decode(content["b64"])
+        elif body is not self.body:
+            content = json.dumps(body)
+        headers = {"content-type": self.record["content_type"]} if self.record.get("content_type") else {}
+        return self.record["method"], url, content or None, headers
+
+
+def _replace(data, where, value):
+    """Copy of a JSON document with the value at `where` replaced"""
+    if not where:
+        return value
+    head, rest = where[0], where[1:]
+    copy = dict(data) if isinstance(data, dict) else list(data)
+    copy[head] = _replace(data[head], rest, value)
+    return copy
+
+
+def plan(exchanges):
+    """Which earlier exchange each one waits for, and who produced each id"""
+    producer = {}
+    waits = []
+    for i, exchange in enumerate(exchanges):
+        deps = set()
+        for _, _, kind, old in exchange.uses:
+            if (kind, old) in producer:
+                deps.add(producer[(kind, old)])
+        for _, kind, old in exchange.returns:
+            owner = producer.setdefault((kind, old), i)
+            if owner != i:
+                deps.add(owner)  # a listing can only show ids that already exist
+        waits.append(sorted(deps))
+    return producer, waits
+
+
+async def replay(records, client, speed: float = 1.0, concurrency: int = 64):
+    """Send every record through `client`; returns one result dict per record"""
+    routes = await Routes.fetch(client)
+    exchanges = [Exchange(record, routes) for record in records]
+    producer, waits = plan(exchanges)
+    ids = {}
+    done = [asyncio.Event() for _ in exchanges]
+    results = [None] * len(exchanges)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(i, exchange):
+        try:
+            for dep in waits[i]:
+                await done[dep].wait()
+            method, url, content, headers = exchange.request(ids)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, content=content, headers=headers)
+                status, text = response.status_code, response.text
+            except httpx.HTTPError as e:
+                status, text = None, str(e)
+            took = (time.perf_counter() - started) * 1000
+            parsed = _json(text)
+            replayed = {where: value for where, _, value in json_ids(parsed, exchange.record["path"])}
+            for where, kind, old in exchange.returns:
+                if producer.get((kind, old)) == i and where in replayed:
+                    ids[(kind, old)] = replayed[where]
+            results[i] = {"template": f"{exchange.record['method']} {exchange.template}", "url": url,
+                          "status": status, "recorded_status": exchange.record["status"],
+                          "error": parsed.get("error") if isinstance(parsed, dict) else None,
+                          "duration_ms": took, "recorded_ms": exchange.record["duration_ms"]}
+        finally:
+            done[i].set()
+            slots.release()
+
+    tasks = []
+    first = records[0]["ts"] if records else 0
+    started = time.monotonic()
+    for i, exchange in enumerate(exchanges):
+        if speed != float("inf"):
+            delay = (exchange.record["ts"] - first) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        # Dependencies are always earlier, so waiting on them while holding a slot cannot deadlock
+        await slots.acquire()
+        tasks.append(asyncio.create_task(send(i, exchange)))
+    await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(results):
+    """Per-route latency comparison and status mismatches"""
+    routes = {}
+    for result in results:
+        routes.setdefault(result["template"], []).append(result)
+    report = {}
+    for template, rows in sorted(routes.items()):
+        recorded = [r["recorded_ms"] for r in rows]
+        replayed = [r["duration_ms"] for r in rows]
+        report[template] = {
+            "count": len(rows),
+            "recorded_p50_ms": percentile(recorded, 0.5),
+            "recorded_p95_ms": percentile(recorded, 0.95),
+            "replayed_p50_ms": percentile(replayed, 0.5),
+            "replayed_p95_ms": percentile(replayed, 0.95),
+            "status_mismatches": sum(1 for r in rows if r["status"] != r["recorded_status"]),
+            "errors": sum(1 for r in rows if r["error"]),
+        }
+        p50 = report[template]["recorded_p50_ms"]
+        report[template]["p50_ratio"] = round(report[template]["replayed_p50_ms"] / p50, 2) if p50 else None
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a test instance")
+    parser.add_argument("captures", nargs="+", help="capture files or directories")
+    parser.add_argument("--target", default="http://localhost:8000")
+    parser.add_argument("--speed", default="1", help="time compression factor, or 'max'")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight at most")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--report", help="also write the report as JSON here")
+    args = parser.parse_args()
+
+    speed = float("inf") if args.speed in ("max", "0") else float(args.speed)
+    records = load(args.captures)
+    if not records:
+        print("❌ No captured requests found")
+        sys.exit(1)
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"▶️  Replaying {len(records)} requests ({span:.0f}s captured) against {args.target} at {args.speed}x")
+
+    async def run():
+        async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout) as client:
+            return await replay(records, client, speed, args.concurrency)
+
+    started = time.perf_counter()
+    results = asyncio.run(run())
+    report = summarize(results)
+    print(f"✅ Done in {time.perf_counter() - started:.1f}s\n")
+    print(f"{'route':<48} {'count':>6} {'rec p50':>8} {'rec p95':>8} {'p50':>8} {'p95':>8} {'ratio':>6} {'status≠':>7} {'errors':>6}")
+    for template, row in report.items():
+        print(f"{template[:48]:<48} {row['count']:>6} {row['recorded_p50_ms']:>8.1f} {row['recorded_p95_ms']:>8.1f} "
+              f"{row['replayed_p50_ms']:>8.1f} {row['replayed_p95_ms']:>8.1f} "
+              f"{row['p50_ratio'] if row['p50_ratio'] is not None else '-':>6} {row['status_mismatches']:>7} {row['errors']:>6}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
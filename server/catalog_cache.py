@@ -0,0 +1,105 @@
+"""
+Version counters and cached bodies for slowly changing catalog endpoints.
+
+Every write to a catalog table bumps that table's counter (optionally scoped,
+e.g. "merchant_coupons:7"). The ETag of a response is built from the process
+nonce and the counters it depends on, so it can be computed without touching
+the database: a matching If-None-Match is answered with 304 straight away and
+an unchanged resource is served from the cached bytes.
+
+Counters live in this process, which matches how the server is deployed
+(one uvicorn worker). The nonce keeps ETags from a previous process from
+ever matching after a restart.
+"""
+
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from fastapi import Response
+
+import metrics
+
+MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_ENTRIES", "1024"))
+
+_NONCE = uuid.uuid4().hex[:12]
+_lock = threading.Lock()
+_versions = {}
+_expiries = {}
+_bodies = OrderedDict()
+
+
+def bump(*resources: str):
+    """Record that the given resources changed"""
+    with _lock:
+        for resource in resources:
+            _versions[resource] = _versions.get(resource, 0) + 1
+            _expiries.pop(resource, None)
+
+
+def expire_at(resource: str, when: datetime):
+    """Bump `resource` once `when` has passed, e.g. the next coupon expiry"""
+    if when is None:
+        return
+    with _lock:
+        current = _expiries.get(resource)
+        if current is None or when < current:
+            _expiries[resource] = when
+
+
+def etag(*resources: str) -> str:
+    now = datetime.utcnow()
+    with _lock:
+        for resource in resources:
+            due = _expiries.get(resource)
+            if due is not None and due <= now:
+                _versions[resource] = _versions.get(resource, 0) + 1
+                del _expiries[resource]
+        versions = ".".join(str(_versions.get(resource, 0)) for resource in resources)
+    return f'W/"{_NONCE}-{versions}"'
+
+
+def _matches(if_none_match: str, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or tag in [t.strip() for t in if_none_match.split(",")]
+
+
+def cached(request, key: str, resources, build):
+    """Serve `key` from cache, answering 304 when the client's copy is current
+
+    `build` runs only on a miss and returns the response body as bytes.
+    """
+    tag = etag(*resources)
+    headers = {"ETag": tag, "Cache-Control": "no-cache"}
+    if _matches(request.headers.get("if-none-match"), tag):
+        metrics.incr("catalog_cache.not_modified")
+        return Response(status_code=304, headers=headers)
+
+    with _lock:
+        entry = _bodies.get(key)
+        if entry is not None and entry[0] == tag:
+            _bodies.move_to_end(key)
+            body = entry[1]
+        else:
+            body = None
+    if body is None:
+        metrics.incr("catalog_cache.misses")
+        # Built after reading the versions, so a concurrent bump can only make
+        # this entry look older than it is, never newer
+        body = build()
+        with _lock:
+            _bodies[key] = (tag, body)
+            _bodies.move_to_end(key)
+            while len(_bodies) > MAX_ENTRIES:
+                _bodies.popitem(last=False)
+    else:
+        metrics.incr("catalog_cache.hits")
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def clear():
+    with _lock:
+        _bodies.clear()
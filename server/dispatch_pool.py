@@ -0,0 +1,403 @@
+"""
+Zone-sharded dispatch in worker processes.
+
+Each zone of the ZoneGrid is owned by one of DISPATCH_WORKERS processes
+(zone i by worker i % workers). A worker holds, per zone it owns, a
+bucket-grid index of the dispatchable drivers in that zone (plus ghosts
+from across its borders), the road network for ETA ranking, and the rides
+it has dispatched that are still open. Finding and ranking candidates runs
+there, outside the API's GIL, so dispatch CPU spreads across cores. When
+the pickup's zone cannot vouch for its answer (too few candidates, or some
+further away than its ghosts reach), the other zones within range are
+asked as well, so the pool finds the same drivers as an inline search.
+
+The API process keeps a small mirror of every driver's position, status and
+zones. follow() brings it up to date from the ride event log (status
+changes) and move_many() from heartbeats (positions); whenever the set of
+zones holding a driver changes, the old owners are told to drop the driver
+and the new ones to add it, which is how drivers are handed off as they
+cross borders. Updates to a worker are batched into one queue message.
+
+  DISPATCH_WORKERS=4 DISPATCH_ZONES='{"rows": 2, "cols": 2}' uvicorn main:app
+
+Worker processes import this module, so it stays clear of the database
+layer; follow() imports it only when called in the API process.
+"""
+
+import itertools
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import metrics
+import road_network
+import zones as zone_grid
+
+WORKERS = int(os.getenv("DISPATCH_WORKERS", "0"))
+TIMEOUT_SECONDS = float(os.getenv("DISPATCH_TIMEOUT_SECONDS", "2"))
+CELL_DEGREES = 0.01  # about 1km buckets in the worker's driver index
+KM_PER_DEGREE = math.pi * zone_grid.EARTH_RADIUS_KM / 180
+
+
+class DispatchUnavailable(Exception):
+    pass
+
+
+# ------------------ WORKER PROCESS ------------------
+
+class DriverIndex:
+    """Drivers of one zone in ~1km buckets, for k-nearest queries"""
+
+    def __init__(self):
+        self.positions = {}  # driver_id -> (lat, lng)
+        self.buckets = {}  # (row, col) -> set of driver ids
+        self.extent = None  # (min row, min col, max row, max col) ever occupied
+
+    def __len__(self):
+        return len(self.positions)
+
+    @staticmethod
+    def _bucket(lat, lng):
+        return int(math.floor(lat / CELL_DEGREES)), int(math.floor(lng / CELL_DEGREES))
+
+    def put(self, driver_id, lat, lng):
+        self.drop(driver_id)
+        bucket = self._bucket(lat, lng)
+        self.positions[driver_id] = (lat, lng)
+        self.buckets.setdefault(bucket, set()).add(driver_id)
+        row, col = bucket
+        if self.extent is None:
+            self.extent = (row, col, row, col)
+        else:
+            lo_r, lo_c, hi_r, hi_c = self.extent
+            self.extent = (min(lo_r, row), min(lo_c, col), max(hi_r, row), max(hi_c, col))
+
+    def drop(self, driver_id):
+        position = self.positions.pop(driver_id, None)
+        if position is not None:
+            bucket = self._bucket(*position)
+            members = self.buckets[bucket]
+            members.discard(driver_id)
+            if not members:
+                del self.buckets[bucket]
+
+    def nearest(self, lat, lng, k, max_km):
+        """(driver_id, km) of the k nearest drivers within max_km, closest first"""
+        if not self.positions:
+            return []
+        row, col = self._bucket(lat, lng)
+        lo_r, lo_c, hi_r, hi_c = self.extent
+        # Rings beyond the occupied extent cannot hold anyone
+        last_ring = max(row - lo_r, hi_r - row, col - lo_c, hi_c - col, 0)
+        cell_km = CELL_DEGREES * KM_PER_DEGREE * min(1.0, math.cos(math.radians(min(89.0, abs(lat) + CELL_DEGREES))))
+        last_ring = min(last_ring, int(max_km / cell_km) + 1)
+        found = []
+        for ring in range(last_ring + 1):
+            for r in range(row - ring, row + ring + 1):
+                step = 1 if r in (row - ring, row + ring) else 2 * ring or 1
+                for c in range(col - ring, col + ring + 1, step):
+                    for driver_id in self.buckets.get((r, c), ()):
+                        d_lat, d_lng = self.positions[driver_id]
+                        distance = zone_grid._km(lat, lng, d_lat, d_lng)
+                        if distance <= max_km:
+                            found.append((distance, driver_id))
+            # Everything within `ring` whole cells of the pickup has been seen
+            if len(found) >= k and sum(1 for d, _ in found if d <= ring * cell_km) >= k:
+                break
+        found.sort()
+        return [(driver_id, distance) for distance, driver_id in found[:k]]
+
+
+def _rank(network, lat, lng, candidates, positions):
+    """Order candidates by road ETA when a network is loaded, else by distance"""
+    if network is None or not candidates:
+        return [(driver_id, distance, None) for driver_id, distance in candidates]
+    etas = network.etas_to(lat, lng, [positions[driver_id] for driver_id, _ in candidates])
+    ranked = [(driver_id, distance, eta) for (driver_id, distance), eta in zip(candidates, etas)]
+    ranked.sort(key=lambda x: (x[2] is None, x[2] or 0, x[1]))
+    return ranked
+
+
+def _work(inbox, outbox, network_path):
+    network = None
+    if network_path:
+        try:
+            network = road_network.RoadNetwork.load(network_path)
+        except Exception as e:
+            print(f"❌ Dispatch worker without road network: {e}")
+    indexes = {}  # zone -> DriverIndex
+    open_rides = {}  # ride_id -> (zone, lat, lng)
+    while True:
+        message = inbox.get()
+        kind = message[0]
+        if kind == "stop":
+            return
+        if kind == "drivers":
+            for op, zone, driver_id, lat, lng in message[1]:
+                index = indexes.setdefault(zone, DriverIndex())
+                if op == "put":
+                    index.put(driver_id, lat, lng)
+                else:
+                    index.drop(driver_id)
+        elif kind == "close":
+            for ride_id in message[1]:
+                open_rides.pop(ride_id, None)
+        elif kind == "dispatch":
+            _, request_id, zone, ride_id, lat, lng, k, max_km = message
+            try:
+                index = indexes.get(zone) or DriverIndex()
+                ranked = _rank(network, lat, lng, index.nearest(lat, lng, k, max_km), index.positions)
+                if ride_id is not None:
+                    open_rides[ride_id] = (zone, lat, lng)
+                outbox.put((request_id, ranked, None))
+            except Exception as e:
+                outbox.put((request_id, None, str(e)))
+        elif kind == "stats":
+            outbox.put((message[1], {
+                "zones": {zone: len(index) for zone, index in indexes.items()},
+                "open_rides": len(open_rides),
+                "road_network": network is not None,
+            }, None))
+
+
+# ------------------ API PROCESS ------------------
+
+class DispatchPool:
+    def __init__(self, workers: int = WORKERS, zones: zone_grid.ZoneGrid = None,
+                 network_path: str = None, timeout: float = TIMEOUT_SECONDS):
+        self.workers = workers
+        self.zones = zones or zone_grid.load_zones()
+        self.network_path = network_path if network_path is not None else road_network.ROAD_NETWORK_PATH
+        self.timeout = timeout
+        self.cursor = None  # last ride event applied; None until the first follow()
+        self._lock = threading.Lock()
+        self._drivers = {}  # driver_id -> [lat, lng, status, zones]
+        self._processes = []
+        self._inboxes = []
+        self._outbox = None
+        self._reader = None
+        self._pending = {}  # request id -> Future
+        self._ids = itertools.count()
+
+    @property
+    def running(self):
+        return bool(self._processes) and all(p.is_alive() for p in self._processes)
+
+    def owner(self, zone: int) -> int:
+        return zone % len(self._inboxes)
+
+    def start(self):
+        if self.workers <= 0 or self.running:
+            return
+        # spawn, not fork: the API process has threads and open connections
+        context = multiprocessing.get_context("spawn")
+        self._outbox = context.Queue()
+        self._inboxes = [context.Queue() for _ in range(self.workers)]
+        self._processes = [
+            context.Process(target=_work, args=(inbox, self._outbox, self.network_path),
+                            name=f"dispatch-{i}", daemon=True)
+            for i, inbox in enumerate(self._inboxes)
+        ]
+        for process in self._processes:
+            process.start()
+        self._reader = threading.Thread(target=self._read_results, name="dispatch-results", daemon=True)
+        self._reader.start()
+        # Workers start empty; replay the mirror into them
+        with self._lock:
+            drivers, self._drivers = self._drivers, {}
+            self._send(self._update({driver_id: (lat, lng, status) for driver_id, (lat, lng, status, _) in drivers.items()}))
+        print(f"✅ Dispatch pool: {self.workers} workers for {len(self.zones)} zones")
+
+    def stop(self, timeout: float = 5):
+        if not self._processes:
+            return
+        for inbox in self._inboxes:
+            inbox.put(("stop",))
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._outbox.put((None, None, None))
+        self._reader.join(timeout)
+        self._processes, self._inboxes = [], []
+        for future in self._pending.values():
+            future.set_exception(DispatchUnavailable("Dispatch pool stopped"))
+        self._pending.clear()
+
+    def _read_results(self):
+        while True:
+            request_id, result, error = self._outbox.get()
+            if request_id is None:
+                return
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue  # the caller gave up waiting
+            if error:
+                future.set_exception(DispatchUnavailable(error))
+            else:
+                future.set_result(result)
+
+    def _ask(self, worker: int, message):
+        return self._ask_many([(worker, message)])[0]
+
+    def _ask_many(self, asks):
+        """Send every (worker, message) at once, then wait for all the answers"""
+        sent = []
+        for worker, message in asks:
+            request_id = next(self._ids)
+            future = Future()
+            self._pending[request_id] = future
+            self._inboxes[worker].put((message[0], request_id, *message[1:]))
+            sent.append((worker, request_id, future))
+        results = []
+        for worker, request_id, future in sent:
+            try:
+                results.append(future.result(self.timeout))
+            except FutureTimeout:
+                for _, pending, _ in sent:
+                    self._pending.pop(pending, None)
+                raise DispatchUnavailable(f"Dispatch worker {worker} did not answer in {self.timeout}s")
+        return results
+
+    # ------------------ DRIVER MIRROR ------------------
+
+    def _update(self, changes):
+        """Apply {driver_id: (lat, lng, status)} to the mirror; per-worker ops for the difference"""
+        ops = {}
+        for driver_id, (lat, lng, status) in changes.items():
+            entry = self._drivers.get(driver_id)
+            old_zones = entry[3] if entry else ()
+            if lat is None and entry:
+                lat, lng = entry[0], entry[1]
+            if status is None:
+                status = entry[2] if entry else "offline"
+            dispatchable = status == "online" and lat is not None and lng is not None
+            new_zones = self.zones.covering(lat, lng) if dispatchable else ()
+            moved = entry is None or (lat, lng) != (entry[0], entry[1])
+            for zone in old_zones:
+                if zone not in new_zones:
+                    ops.setdefault(zone, []).append(("drop", zone, driver_id, None, None))
+            for zone in new_zones:
+                if moved or zone not in old_zones:
+                    ops.setdefault(zone, []).append(("put", zone, driver_id, lat, lng))
+            if entry and old_zones and new_zones and old_zones[0] != new_zones[0]:
+                metrics.incr("dispatch_pool.handoffs")
+            self._drivers[driver_id] = [lat, lng, status, new_zones]
+        return ops
+
+    def _send(self, ops):
+        if not self._inboxes:
+            return
+        by_worker = {}
+        for zone, zone_ops in ops.items():
+            by_worker.setdefault(self.owner(zone), []).extend(zone_ops)
+        for worker, worker_ops in by_worker.items():
+            self._inboxes[worker].put(("drivers", worker_ops))
+
+    def update_drivers(self, rows):
+        """(driver_id, lat, lng, status) rows; None keeps the mirrored value"""
+        with self._lock:
+            self._send(self._update({row[0]: tuple(row[1:4]) for row in rows}))
+
+    def move_many(self, fixes):
+        """(driver_id, lat, lng, ...) heartbeat fixes for drivers the mirror knows"""
+        with self._lock:
+            known = {fix[0]: (fix[1], fix[2], None) for fix in fixes if fix[0] in self._drivers}
+            self._send(self._update(known))
+
+    def close_rides(self, ride_ids):
+        if self._inboxes and ride_ids:
+            for inbox in self._inboxes:
+                inbox.put(("close", list(ride_ids)))
+
+    def apply_events(self, events):
+        """Fold ride-event-log entries into the mirror"""
+        changes, closed = {}, []
+        for event in events:
+            payload = event.get("payload") or {}
+            if event["entity"] == "driver":
+                lat, lng, status = changes.get(event["entity_id"], (None, None, None))
+                if payload.get("latitude") is not None and payload.get("longitude") is not None:
+                    lat, lng = payload["latitude"], payload["longitude"]
+                changes[event["entity_id"]] = (lat, lng, payload.get("status", status))
+            elif event["entity"] == "ride" and event["event_type"] in ("assigned", "completed", "no_drivers"):
+                closed.append(event["entity_id"])
+        self.update_drivers([(driver_id, *change) for driver_id, change in changes.items()])
+        self.close_rides(closed)
+
+    def load_drivers(self, db, ids=None):
+        """Mirror drivers straight from the table, e.g. after a bulk load that logs no events"""
+        import models
+
+        query = db.query(models.Driver.id, models.Driver.latitude, models.Driver.longitude, models.Driver.status)
+        if ids is not None:
+            query = query.filter(models.Driver.id.in_([driver_id for driver_id in ids if driver_id]))
+        self.update_drivers(query.all())
+
+    def follow(self, db, page_size: int = 5000):
+        """Catch the mirror up with the event log; loads every driver the first time"""
+        import events
+
+        with self._lock:
+            cursor = self.cursor
+        if cursor is None:
+            cursor = events.head(db)
+            self.load_drivers(db)
+        while True:
+            page = events.changes(db, cursor, limit=page_size)
+            if page["reset"]:
+                # Retention dropped events we never saw; start over from the table
+                with self._lock:
+                    self.cursor = None
+                return self.follow(db, page_size)
+            self.apply_events(page["events"])
+            cursor = page["cursor"]
+            if not page["has_more"]:
+                break
+        with self._lock:
+            self.cursor = cursor if self.cursor is None else max(self.cursor, cursor)
+
+    # ------------------ DISPATCH ------------------
+
+    def dispatch(self, lat: float, lng: float, k: int, max_km: float, ride_id: int = None):
+        """(driver_id, km, eta seconds or None) candidates, the same ones an inline search would find
+
+        The zone owning the pickup answers alone when its k candidates are all
+        within border_km: anyone it does not hold is further than that. Otherwise
+        every other zone within reach is asked too and the answers are merged.
+        """
+        if not self.running:
+            raise DispatchUnavailable("Dispatch pool is not running")
+        zone = self.zones.zone_of(lat, lng)
+        ranked = self._ask(self.owner(zone), ("dispatch", zone, ride_id, lat, lng, k, max_km))
+        metrics.incr("dispatch_pool.dispatched")
+        metrics.incr(f"dispatch_pool.zone.{zone}")
+        reach = max(distance for _, distance, _ in ranked) if len(ranked) >= k else max_km
+        if reach <= self.zones.border_km:
+            return ranked
+        others = self.zones.within(lat, lng, reach)
+        if not others:
+            return ranked
+        metrics.incr("dispatch_pool.widened")
+        answers = self._ask_many([
+            (self.owner(other), ("dispatch", other, None, lat, lng, k, reach)) for other in others
+        ])
+        candidates = {}
+        for answer in [ranked, *answers]:
+            for candidate in answer:
+                candidates.setdefault(candidate[0], candidate)  # ghosts answer from more than one zone
+        # The k nearest, then ordered like a single zone's answer
+        nearest = sorted(candidates.values(), key=lambda x: x[1])[:k]
+        nearest.sort(key=lambda x: (x[2] is None, x[2] or 0, x[1]))
+        return nearest
+
+    def stats(self):
+        workers = []
+        for worker in range(len(self._inboxes)):
+            try:
+                workers.append(self._ask(worker, ("stats",)))
+            except DispatchUnavailable as e:
+                workers.append({"error": str(e)})
+        return {"workers": workers, "zones": self.zones.config(), "drivers": len(self._drivers), "cursor": self.cursor}
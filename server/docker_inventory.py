@@ -0,0 +1,289 @@
+"""
+In-memory inventory of ride containers, kept current by Docker's event stream.
+
+Talks to the Docker Engine API over its unix socket with a small HTTP/1.1
+client, so nothing shells out to the docker CLI. A background thread runs an
+asyncio loop that lists the ride containers once and then follows
+/events, refreshing a container whenever Docker reports a change. If the
+stream drops it relists before resubscribing, so missed events cannot leave
+the inventory stale. /ride-containers reads the inventory from memory.
+
+Container create/remove calls are coroutines on the same loop; submit()
+hands them over from worker threads without blocking them.
+"""
+
+import asyncio
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from urllib.parse import quote
+
+import metrics
+
+DOCKER_SOCKET = os.getenv("DOCKER_SOCKET", "/var/run/docker.sock")
+DOCKER_API_VERSION = os.getenv("DOCKER_API_VERSION", "v1.41")
+DOCKER_NETWORK = os.getenv("DOCKER_NETWORK", "mini_uber_default")
+RIDE_IMAGE = "nginx:alpine"
+RECONNECT_SECONDS = 2
+
+
+class DockerError(Exception):
+    pass
+
+
+def _filters(**filters):
+    return quote(json.dumps(filters))
+
+
+def _ports(entry):
+    """Format published ports the way `docker ps` does"""
+    formatted = []
+    for port in entry.get("Ports") or []:
+        private = f"{port['PrivatePort']}/{port.get('Type', 'tcp')}"
+        formatted.append(f"{port.get('IP', '0.0.0.0')}:{port['PublicPort']}->{private}" if port.get("PublicPort") else private)
+    return ", ".join(formatted)
+
+
+class DockerInventory:
+    def __init__(self, socket_path: str = DOCKER_SOCKET, prefix: str = "ride-"):
+        self.socket_path = socket_path
+        self.prefix = prefix
+        self.synced = False
+        self.last_error = None
+        self._containers = {}  # container id -> summary
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop = None
+        self._stop = None
+        self._ready = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._run, name="docker-inventory", daemon=True)
+            self._thread.start()
+        self._ready.wait(5)
+
+    def stop(self, timeout: float = 5):
+        if self.running:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._thread.join(timeout)
+
+    def submit(self, coro):
+        """Run a coroutine on the inventory loop; returns a concurrent.futures.Future"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def containers(self):
+        with self._lock:
+            return [dict(c) for c in self._containers.values()]
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._ready.set()
+        watcher = asyncio.create_task(self._watch())
+        await self._stop.wait()
+        watcher.cancel()
+        self.synced = False
+
+    # ------------------ HTTP OVER THE UNIX SOCKET ------------------
+
+    async def _open(self, method, path, body=b"", content_type="application/json"):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        writer.write((
+            f"{method} /{DOCKER_API_VERSION}{path} HTTP/1.1\r\n"
+            f"Host: docker\r\nConnection: close\r\n"
+            f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n"
+        ).encode() + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        return reader, writer, status, headers
+
+    @staticmethod
+    async def _chunks(reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            yield await reader.readexactly(int(headers["content-length"]))
+        else:
+            while chunk := await reader.read(65536):
+                yield chunk
+
+    async def _request(self, method, path, payload=None, body=b"", content_type="application/json"):
+        """Status and decoded JSON body (None when empty) of one API call"""
+        if payload is not None:
+            body = json.dumps(payload).encode()
+        reader, writer, status, headers = await self._open(method, path, body, content_type)
+        try:
+            data = b"".join([chunk async for chunk in self._chunks(reader, headers)])
+        finally:
+            writer.close()
+        if not data.strip():
+            return status, None
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            # Progress streams (image pulls) are several JSON documents
+            return status, None
+
+    # ------------------ INVENTORY ------------------
+
+    def _summary(self, entry):
+        return {
+            "id": entry["Id"],
+            "name": entry["Names"][0].lstrip("/"),
+            "ports": _ports(entry),
+            "state": entry.get("State"),
+            "status": entry.get("Status"),
+        }
+
+    async def _list(self, **filters):
+        status, entries = await self._request("GET", f"/containers/json?all=1&filters={_filters(**filters)}")
+        if status != 200:
+            raise DockerError(f"Listing containers failed with {status}")
+        return [self._summary(e) for e in entries or [] if e["Names"][0].lstrip("/").startswith(self.prefix)]
+
+    async def _refresh(self, container_id):
+        current = await self._list(id=[container_id])
+        with self._lock:
+            if current:
+                self._containers[container_id] = current[0]
+            else:
+                self._containers.pop(container_id, None)
+
+    async def _watch(self):
+        while True:
+            try:
+                # Subscribe from just before the listing so nothing falls in between
+                since = int(time.time()) - 1
+                listed = await self._list(name=[self.prefix])
+                with self._lock:
+                    self._containers = {c["id"]: c for c in listed}
+                await self._follow(since)
+                raise DockerError("Event stream closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.synced = False
+                if str(e) != self.last_error:
+                    print(f"❌ Docker inventory out of sync: {e}")
+                self.last_error = str(e)
+                metrics.incr("docker_inventory.reconnects")
+                await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _follow(self, since):
+        path = f"/events?since={since}&filters={_filters(type=['container'])}"
+        reader, writer, status, headers = await self._open("GET", path)
+        try:
+            if status != 200:
+                raise DockerError(f"Event stream refused with {status}")
+            self.synced = True
+            self.last_error = None
+            print(f"✅ Docker inventory synced: {len(self._containers)} ride containers")
+            decoder = json.JSONDecoder()
+            buffer = ""
+            async for chunk in self._chunks(reader, headers):
+                buffer += chunk.decode()
+                while buffer.strip():
+                    try:
+                        event, end = decoder.raw_decode(buffer.lstrip())
+                    except ValueError:
+                        break  # wait for the rest of the event
+                    buffer = buffer.lstrip()[end:]
+                    await self._apply(event)
+        finally:
+            writer.close()
+
+    async def _apply(self, event):
+        actor = event.get("Actor") or {}
+        name = (actor.get("Attributes") or {}).get("name", "")
+        if not name.startswith(self.prefix):
+            return
+        metrics.incr("docker_inventory.events")
+        container_id = actor.get("ID") or event.get("id")
+        if event.get("Action") == "destroy":
+            with self._lock:
+                self._containers.pop(container_id, None)
+        else:
+            await self._refresh(container_id)
+
+    # ------------------ CONTAINERS ------------------
+
+    async def create_ride_container(self, ride_id: int, port: int, html_path: str):
+        """Start nginx for a ride on `port` serving `html_path`; False on failure"""
+        name = f"{self.prefix}{ride_id}"
+        try:
+            await self._request("DELETE", f"/containers/{name}?force=true")
+            config = {
+                "Image": RIDE_IMAGE,
+                "ExposedPorts": {"80/tcp": {}},
+                "HostConfig": {
+                    "PortBindings": {"80/tcp": [{"HostPort": str(port)}]},
+                    "NetworkMode": DOCKER_NETWORK,
+                },
+            }
+            status, created = await self._request("POST", f"/containers/create?name={name}", config)
+            if status == 404:
+                image, _, tag = RIDE_IMAGE.partition(":")
+                await self._request("POST", f"/images/create?fromImage={image}&tag={tag or 'latest'}")
+                status, created = await self._request("POST", f"/containers/create?name={name}", config)
+            if status != 201:
+                raise DockerError((created or {}).get("message", f"create returned {status}"))
+
+            archive = io.BytesIO()
+            with tarfile.open(fileobj=archive, mode="w") as tar:
+                tar.add(html_path, arcname="index.html")
+            status, reply = await self._request(
+                "PUT", f"/containers/{created['Id']}/archive?path=/usr/share/nginx/html",
+                body=archive.getvalue(), content_type="application/x-tar",
+            )
+            if status != 200:
+                raise DockerError((reply or {}).get("message", f"copying the page returned {status}"))
+            status, reply = await self._request("POST", f"/containers/{created['Id']}/start")
+            if status not in (204, 304):
+                raise DockerError((reply or {}).get("message", f"start returned {status}"))
+            print(f"✅ Created ride container {name} on port {port}")
+            return True
+        except Exception as e:
+            print(f"❌ Error creating container {name}: {e}")
+            try:
+                await self._request("DELETE", f"/containers/{name}?force=true")
+            except Exception:
+                pass
+            return False
+
+    async def remove_ride_container(self, ride_id: int):
+        name = f"{self.prefix}{ride_id}"
+        try:
+            status, reply = await self._request("DELETE", f"/containers/{name}?force=true")
+            if status not in (204, 404):
+                raise DockerError((reply or {}).get("message", f"remove returned {status}"))
+            return True
+        except Exception as e:
+            print(f"❌ Error removing container {name}: {e}")
+            return False
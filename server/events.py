@@ -0,0 +1,157 @@
+"""
+Ride event log.
+
+Every ride, ride request and driver state transition appends a row to
+ride_events inside the transaction that makes the change. The row id is the
+sequence clients sync from: /changes?since=<id> returns only what happened
+after their cursor, and replay() walks the log to rebuild derived state.
+
+  python events.py replay     # rebuild ride/driver state from the log
+
+Ids have to become visible in order, otherwise a reader could move its
+cursor past an id that commits a moment later. On Postgres writers take a
+transaction-level advisory lock right before appending, so ids are handed out
+in commit order; SQLite only ever has one writer. Record events just before
+committing to keep that lock short.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import func, insert, text
+
+from db import SessionLocal
+import metrics
+import models
+
+LOG_LOCK_KEY = 0x72696465  # "ride"
+MAX_PAGE_SIZE = 10000
+
+RIDE_FIELDS = (
+    "user_id", "driver_id", "start", "destination", "pickup_lat", "pickup_lng",
+    "dest_lat", "dest_lng", "status", "fare", "discount", "final_fare", "port", "coupon_id",
+)
+DRIVER_FIELDS = ("name", "email", "location", "latitude", "longitude", "status")
+
+_EVENT_COLUMNS = (
+    models.RideEvent.id,
+    models.RideEvent.entity,
+    models.RideEvent.entity_id,
+    models.RideEvent.event_type,
+    models.RideEvent.payload,
+    models.RideEvent.created_at,
+)
+
+
+def ride_fields(ride):
+    return {name: getattr(ride, name) for name in RIDE_FIELDS}
+
+
+def driver_fields(driver):
+    return {name: getattr(driver, name) for name in DRIVER_FIELDS}
+
+
+def _lock_log(db):
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": LOG_LOCK_KEY})
+
+
+def record(db, entity: str, entity_id: int, event_type: str, **payload):
+    """Append one event in `db`'s transaction; the caller commits"""
+    record_many(db, entity, event_type, [(entity_id, payload)])
+
+
+def record_many(db, entity: str, event_type: str, items):
+    """Append one event per (entity_id, payload) pair"""
+    if not items:
+        return
+    _lock_log(db)
+    now = datetime.utcnow()
+    db.execute(insert(models.RideEvent), [
+        {"entity": entity, "entity_id": entity_id, "event_type": event_type,
+         "payload": payload, "created_at": now}
+        for entity_id, payload in items
+    ])
+    metrics.incr("events.recorded", len(items))
+
+
+def head(db) -> int:
+    """Sequence number of the newest event, 0 for an empty log"""
+    return db.query(func.max(models.RideEvent.id)).scalar() or 0
+
+
+def _as_dict(row):
+    event = row._asdict()
+    event["seq"] = event.pop("id")
+    return event
+
+
+def changes(db, since: int, limit: int = 1000):
+    """Events after `since`, oldest first, with the cursor to ask for next"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    rows = db.query(*_EVENT_COLUMNS).filter(
+        models.RideEvent.id > since
+    ).order_by(models.RideEvent.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Retention may have purged events the client never saw
+    oldest = db.query(func.min(models.RideEvent.id)).scalar()
+    reset = since > 0 and oldest is not None and oldest > since + 1
+
+    return {
+        "events": [_as_dict(row) for row in rows],
+        "cursor": rows[-1].id if rows else since,
+        "has_more": has_more,
+        "reset": reset,
+    }
+
+
+def replay(handler, since: int = 0, batch_size: int = 1000, session_factory=SessionLocal):
+    """Call `handler(event)` for every event after `since`, in order"""
+    cursor = since
+    db = session_factory()
+    try:
+        while True:
+            rows = db.query(*_EVENT_COLUMNS).filter(
+                models.RideEvent.id > cursor
+            ).order_by(models.RideEvent.id).limit(batch_size).all()
+            if not rows:
+                return cursor
+            for row in rows:
+                handler(_as_dict(row))
+            cursor = rows[-1].id
+    finally:
+        db.close()
+
+
+def rebuild_state(since: int = 0, session_factory=SessionLocal):
+    """Latest known fields of every ride, request and driver, rebuilt from the log"""
+    state = {"ride": {}, "request": {}, "driver": {}}
+
+    def apply(event):
+        entity = state.setdefault(event["entity"], {})
+        entity.setdefault(event["entity_id"], {}).update(event["payload"] or {})
+
+    cursor = replay(apply, since, session_factory=session_factory)
+    return state, cursor
+
+
+def main():
+    import argparse
+    from collections import Counter
+
+    parser = argparse.ArgumentParser(description="Ride event log tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("replay", help="rebuild ride and driver state from the log")
+    parser.parse_args()
+
+    state, cursor = rebuild_state()
+    print(f"📜 Replayed events up to seq {cursor}")
+    for entity, rows in state.items():
+        statuses = Counter(fields.get("status") for fields in rows.values())
+        summary = ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str))
+        print(f"   {entity}: {len(rows)} ({summary})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Geohash cells for indexed proximity queries.
+
+Drivers and merchants carry a geohash of their position in an indexed
+string column, kept up to date on every write: ORM flushes through the
+mapper hooks below, and the bulk paths (bulk_import, batch heartbeats)
+through encode(). Every point inside a cell shares the cell's prefix, so
+"everything in this cell" is one B-tree range scan,
+
+  geohash >= 'tdr1w' AND geohash < 'tdr1x'
+
+which Postgres and SQLite both serve from a plain index; no PostGIS or
+earthdistance extension is needed, and tests on SQLite run the same SQL.
+
+nearest() scans the 3x3 block of cells around a point, starting with small
+cells and moving to coarser ones until it has k candidates that are provably
+closer than anything outside the block, then orders them by real distance.
+
+  python geo.py encode 12.9716 77.5946
+  python geo.py backfill
+"""
+
+import math
+import sys
+
+from sqlalchemy import and_, bindparam, event, or_, select, update
+
+import models
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9  # stored cells are about 5m across
+FINEST_SEARCH = 7  # nearest() starts with ~150m cells
+EARTH_RADIUS_KM = 6371.0
+BACKFILL_BATCH_SIZE = 5000
+
+
+def _spread(x):
+    """Put the bits of a 32-bit integer at every other position"""
+    x = (x | (x << 16)) & 0x0000FFFF0000FFFF
+    x = (x | (x << 8)) & 0x00FF00FF00FF00FF
+    x = (x | (x << 4)) & 0x0F0F0F0F0F0F0F0F
+    x = (x | (x << 2)) & 0x3333333333333333
+    return (x | (x << 1)) & 0x5555555555555555
+
+
+def _bits(precision):
+    """(longitude bits, latitude bits) of a geohash with `precision` characters"""
+    bits = precision * 5
+    return (bits + 1) // 2, bits // 2
+
+
+def encode(lat, lng, precision: int = PRECISION):
+    """Geohash of a point, or None without coordinates"""
+    if lat is None or lng is None:
+        return None
+    lng_bits, lat_bits = _bits(precision)
+    x = min(int((lng + 180.0) / 360.0 * (1 << lng_bits)), (1 << lng_bits) - 1)
+    y = min(int((lat + 90.0) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    # Longitude takes the first bit; with an odd bit count it also takes the last
+    odd = lng_bits > lat_bits
+    code = (_spread(x) << 1) | _spread(y << 1 if odd else y)
+    if odd:
+        code >>= 1
+    return "".join(BASE32[(code >> (5 * (precision - 1 - i))) & 31] for i in range(precision))
+
+
+def cell_size(precision: int):
+    """(height, width) of a cell in degrees"""
+    lng_bits, lat_bits = _bits(precision)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance (haversine)"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+def covered_km(lat: float, precision: int):
+    """Radius around a point that the 3x3 block of cells around it always contains"""
+    height, width = cell_size(precision)
+    km_per_degree = math.pi * EARTH_RADIUS_KM / 180
+    # Cells are narrowest on their side nearest the pole
+    widest_lat = min(90.0, abs(lat) + height)
+    return km_per_degree * min(height, width * math.cos(math.radians(widest_lat)))
+
+
+def block(lat: float, lng: float, precision: int):
+    """The cell containing a point and its (up to) eight neighbours"""
+    height, width = cell_size(precision)
+    cells = set()
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            y = min(90.0, max(-90.0, lat + dy * height))
+            x = (lng + dx * width + 180.0) % 360.0 - 180.0
+            cells.add(encode(y, x, precision))
+    return sorted(cells)
+
+
+def _successor(prefix: str):
+    """Smallest string greater than every string starting with `prefix`, or None"""
+    while prefix and prefix[-1] == BASE32[-1]:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + BASE32[BASE32.index(prefix[-1]) + 1]
+
+
+def in_cells(column, cells):
+    """Condition matching geohashes inside any of `cells`, as index range scans"""
+    ranges = []
+    for cell in cells:
+        upper = _successor(cell)
+        ranges.append(and_(column >= cell, column < upper) if upper else column >= cell)
+    return or_(*ranges)
+
+
+def _with_distances(rows, lat, lng, max_km):
+    found = []
+    for row in rows:
+        distance = distance_km(lat, lng, row.latitude, row.longitude)
+        if max_km is None or distance <= max_km:
+            found.append((row, distance))
+    found.sort(key=lambda item: item[1])
+    return found
+
+
+def nearest(query, model, lat: float, lng: float, k: int = None, max_km: float = None):
+    """(row, km) pairs from `query` nearest to a point, closest first
+
+    `model` must have latitude, longitude and geohash columns. With `k` the
+    search widens only until the k nearest are certain; without it every row
+    within `max_km` is returned.
+    """
+    if k is None and max_km is None:
+        raise ValueError("nearest() needs k or max_km")
+    # The coarsest cells worth scanning are the first whose block covers max_km
+    coarsest = next((p for p in range(FINEST_SEARCH, 0, -1)
+                     if max_km is not None and covered_km(lat, p) >= max_km), None)
+    last = coarsest or 1
+    for precision in range(FINEST_SEARCH if k is not None else last, last - 1, -1):
+        rows = query.filter(in_cells(model.geohash, block(lat, lng, precision))).all()
+        found = _with_distances(rows, lat, lng, max_km)
+        radius = covered_km(lat, precision)
+        if precision == coarsest or (k is not None and sum(1 for _, d in found if d <= radius) >= k):
+            return found[:k]
+    # Nothing as coarse as one cell covers the search; only a scan is exact
+    found = _with_distances(query.filter(model.geohash.isnot(None)).all(), lat, lng, max_km)
+    return found[:k]
+
+
+# ------------------ MAINTENANCE ON WRITE ------------------
+
+def _set_geohash(mapper, connection, target):
+    target.geohash = encode(target.latitude, target.longitude)
+
+
+for _model in (models.Driver, models.Merchant):
+    event.listen(_model, "before_insert", _set_geohash)
+    event.listen(_model, "before_update", _set_geohash)
+
+
+def backfill(bind, batch_size: int = BACKFILL_BATCH_SIZE):
+    """Fill in geohashes for rows written before the column existed"""
+    filled = 0
+    for model in (models.Driver, models.Merchant):
+        while True:
+            with bind.begin() as conn:
+                rows = conn.execute(
+                    select(model.id, model.latitude, model.longitude).where(
+                        model.geohash.is_(None), model.latitude.isnot(None), model.longitude.isnot(None)
+                    ).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                conn.execute(
+                    update(model.__table__).where(model.__table__.c.id == bindparam("row_id")),
+                    [{"row_id": row.id, "geohash": encode(row.latitude, row.longitude)} for row in rows],
+                )
+            filled += len(rows)
+    return filled
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "encode" and len(sys.argv) >= 4:
+        print(encode(float(sys.argv[2]), float(sys.argv[3])))
+    elif command == "backfill":
+        from db import engine
+
+        print(f"✅ Geohashed {backfill(engine)} rows")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,182 @@
+"""
+Offline geocoding from a local gazetteer.
+
+  python geocoder.py kora            # autocomplete from the command line
+
+GAZETTEER_PATH points at a tab separated file: name, lat, lon, kind, rank,
+region and optional |-separated aliases. Every name and alias is indexed
+under each of its word suffixes ("5th block" finds "Koramangala 5th
+Block"), all in one sorted list of keys. A prefix query bisects to the first
+key that could match and scans forward while keys still start with it.
+Keystrokes repeat a lot, so results per normalized query sit in an LRU cache.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+import metrics
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.tsv")
+)
+CACHE_SIZE = int(os.getenv("GEOCODER_CACHE_SIZE", "4096"))
+MAX_SCAN = 5000  # keys examined per prefix query; very short prefixes stop here
+MAX_RESULTS = 20
+MIN_GEOCODE_LENGTH = 3  # shorter text is never resolved to a place outright
+
+
+def normalize(text: str) -> str:
+    """Lowercase, accents stripped, punctuation collapsed to single spaces"""
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+
+class Gazetteer:
+    def __init__(self, places):
+        """`places` are (name, lat, lon, kind, rank, region, aliases) tuples"""
+        self.names, self.kinds, self.regions = [], [], []
+        self.lat, self.lon, self.rank = array("d"), array("d"), array("f")
+        entries = []
+        for index, (name, lat, lon, kind, rank, region, aliases) in enumerate(places):
+            self.names.append(name)
+            self.kinds.append(kind)
+            self.regions.append(region)
+            self.lat.append(lat)
+            self.lon.append(lon)
+            self.rank.append(rank)
+            for label in (name, *aliases):
+                words = normalize(label).split()
+                for start in range(len(words)):
+                    entries.append((" ".join(words[start:]), start == 0, index))
+        entries.sort(key=lambda e: e[0])
+        self.keys = [key for key, _, _ in entries]
+        self.leading = array("B", [whole for _, whole, _ in entries])
+        self.places = array("I", [index for _, _, index in entries])
+
+    @classmethod
+    def load(cls, path):
+        places = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                name, lat, lon, kind, rank, region = fields[:6]
+                aliases = [a for a in fields[6].split("|") if a] if len(fields) > 6 else []
+                places.append((name, float(lat), float(lon), kind, float(rank or 0), region, aliases))
+        return cls(places)
+
+    def __len__(self):
+        return len(self.names)
+
+    def complete(self, prefix: str, limit: int, whole_words: bool = False):
+        """Indexes of the best places whose names have a word starting with `prefix`
+
+        With `whole_words`, `prefix` must end on a word boundary of the name too.
+        """
+        if not prefix:
+            return ()
+        best = {}
+        position = bisect_left(self.keys, prefix)
+        end = min(len(self.keys), position + MAX_SCAN)
+        while position < end and self.keys[position].startswith(prefix):
+            if whole_words and self.keys[position] != prefix and self.keys[position][len(prefix)] != " ":
+                position += 1
+                continue
+            index = self.places[position]
+            # Exact names first, then names that start with the query, then the rest by rank
+            score = (self.keys[position] == prefix and self.leading[position], self.leading[position], self.rank[index])
+            if score > best.get(index, (False, 0, -1.0)):
+                best[index] = score
+            position += 1
+        ranked = sorted(best, key=lambda i: (best[i], -len(self.names[i])), reverse=True)
+        return tuple(ranked[:limit])
+
+    def place(self, index: int):
+        return {
+            "name": self.names[index],
+            "display_name": f"{self.names[index]}, {self.regions[index]}" if self.regions[index] else self.names[index],
+            "kind": self.kinds[index],
+            "lat": self.lat[index],
+            "lon": self.lon[index],
+        }
+
+
+_gazetteer = None
+_load_lock = threading.Lock()
+
+
+def get_gazetteer():
+    global _gazetteer
+    if _gazetteer is None:
+        with _load_lock:
+            if _gazetteer is None:
+                try:
+                    _gazetteer = Gazetteer.load(GAZETTEER_PATH)
+                    print(f"✅ Gazetteer loaded: {len(_gazetteer)} places")
+                except OSError as e:
+                    print(f"❌ Gazetteer unavailable, geocoding disabled: {e}")
+                    _gazetteer = Gazetteer([])
+    return _gazetteer
+
+
+def reload(path: str = GAZETTEER_PATH):
+    """Swap in a new gazetteer file and forget cached answers"""
+    global _gazetteer
+    gazetteer = Gazetteer.load(path)
+    with _load_lock:
+        _gazetteer = gazetteer
+        _complete.cache_clear()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _complete(prefix: str, limit: int, whole_words: bool = False):
+    metrics.incr("geocoder.cache_misses")
+    return get_gazetteer().complete(prefix, limit, whole_words)
+
+
+def autocomplete(query: str, limit: int = 5):
+    """Places matching what the user has typed so far, best first"""
+    metrics.incr("geocoder.lookups")
+    gazetteer = get_gazetteer()
+    return [gazetteer.place(i) for i in _complete(normalize(query), max(1, min(limit, MAX_RESULTS)))]
+
+
+def geocode(text: str):
+    """Best place for free text such as "Koramangala, Bangalore", or None
+
+    Tries the whole text, then each comma separated part, most specific first.
+    Unlike autocomplete, a part only matches whole words of a name or alias
+    ("Koramangala" or "5th Block", not "Ko"), so partial text is not placed.
+    """
+    metrics.incr("geocoder.lookups")
+    gazetteer = get_gazetteer()
+    candidates = [text] + [part for part in (text or "").split(",")]
+    for candidate in candidates:
+        candidate = normalize(candidate)
+        if len(candidate) < MIN_GEOCODE_LENGTH:
+            continue
+        found = _complete(candidate, 1, True)
+        if found:
+            return gazetteer.place(found[0])
+    return None
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the local gazetteer")
+    parser.add_argument("query")
+    parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+    for place in autocomplete(args.query, args.limit):
+        print(f"📍 {place['display_name']} ({place['lat']:.4f}, {place['lon']:.4f})")
+
+
+if __name__ == "__main__":
+    main()
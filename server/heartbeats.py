@@ -0,0 +1,192 @@
+"""
+Batch heartbeat ingestion.
+
+Fleet partners and the simulator relay positions for many drivers per
+request, either as JSON
+
+  [{"driver_id": 7, "lat": 12.97, "lng": 77.59, "ts": 1718000000.5}, ...]
+
+(or the same as [driver_id, lat, lng, ts] rows), or as binary frames:
+back-to-back little-endian records of driver_id (uint32) and lat, lng, ts
+(float64), 28 bytes each. `ts` is the fix time in Unix seconds; JSON items
+may leave it out to mean "now". A fix more than MAX_CLOCK_SKEW_SECONDS in
+the future is invalid: stored, it would make every correct fix after it
+look stale until the clock caught up.
+
+A batch is applied with one statement on Postgres. A fix no newer than the
+driver's stored one is dropped, so a delayed retry can never move a driver
+backwards, and every item gets its own status in the reply.
+"""
+
+import math
+import os
+import struct
+from datetime import datetime, timezone
+
+import orjson
+from sqlalchemy import select, text, update
+
+import events
+import geo
+import metrics
+import models
+
+FRAME = struct.Struct("<Iddd")
+MAX_BATCH = int(os.getenv("HEARTBEAT_MAX_BATCH", "50000"))
+MAX_CLOCK_SKEW_SECONDS = float(os.getenv("HEARTBEAT_MAX_CLOCK_SKEW_SECONDS", "5"))
+LOOKUP_BATCH_SIZE = 500  # keeps bound parameters well under SQLite's limit
+
+OK = "ok"
+STALE = "stale"
+UNKNOWN = "unknown_driver"
+INVALID = "invalid"
+
+_APPLY_POSTGRES = text("""
+    WITH fixes AS (
+        SELECT * FROM unnest(
+            CAST(:ids AS integer[]), CAST(:lats AS double precision[]),
+            CAST(:lngs AS double precision[]), CAST(:stamps AS timestamp[]),
+            CAST(:cells AS varchar[])
+        ) AS f(id, lat, lng, fix_at, geohash)
+    ), previous AS (
+        SELECT d.id, d.status FROM drivers d JOIN fixes f ON f.id = d.id
+        WHERE d.fix_at IS NULL OR d.fix_at < f.fix_at
+        ORDER BY d.id
+        FOR UPDATE OF d
+    )
+    UPDATE drivers d
+    SET latitude = f.lat, longitude = f.lng, geohash = f.geohash, fix_at = f.fix_at, last_seen = :now,
+        status = CASE WHEN d.status = 'offline' THEN 'online' ELSE d.status END
+    FROM fixes f JOIN previous p ON p.id = f.id
+    WHERE d.id = f.id AND (d.fix_at IS NULL OR d.fix_at < f.fix_at)
+    RETURNING d.id, p.status AS previous_status, d.name, d.email, d.location, d.latitude, d.longitude, d.status
+""")
+
+
+def _fix(driver_id, lat, lng, ts, now):
+    """(driver_id, lat, lng, fix time) or None when the item is unusable"""
+    try:
+        driver_id, lat, lng = int(driver_id), float(lat), float(lng)
+        stamp = now if ts is None else datetime.fromtimestamp(float(ts), timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if driver_id <= 0 or not (math.isfinite(lat) and math.isfinite(lng)):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    if (stamp - now).total_seconds() > MAX_CLOCK_SKEW_SECONDS:
+        return None
+    return driver_id, lat, lng, stamp
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+        yield ids[start:start + LOOKUP_BATCH_SIZE]
+
+
+def parse_json(body: bytes, now: datetime):
+    items = orjson.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array of heartbeats")
+    fixes = []
+    for item in items:
+        if isinstance(item, dict):
+            fixes.append(_fix(item.get("driver_id"), item.get("lat"), item.get("lng"), item.get("ts"), now))
+        elif isinstance(item, list) and len(item) in (3, 4):
+            fixes.append(_fix(*item, *([None] * (4 - len(item))), now))
+        else:
+            fixes.append(None)
+    return fixes
+
+
+def parse_frames(body: bytes, now: datetime):
+    if len(body) % FRAME.size:
+        raise ValueError(f"Binary heartbeats are {FRAME.size}-byte frames")
+    return [_fix(driver_id, lat, lng, ts, now) for driver_id, lat, lng, ts in FRAME.iter_unpack(body)]
+
+
+def _apply_postgres(db, fixes, now):
+    rows = db.execute(_APPLY_POSTGRES, {
+        "ids": [f[0] for f in fixes],
+        "lats": [f[1] for f in fixes],
+        "lngs": [f[2] for f in fixes],
+        "stamps": [f[3] for f in fixes],
+        "cells": [geo.encode(f[1], f[2]) for f in fixes],
+        "now": now,
+    }).all()
+    return {row.id: row._mapping for row in rows}
+
+
+def _apply_generic(db, fixes, now):
+    """Read current fixes, then bulk update by primary key; for SQLite and friends"""
+    by_id = {f[0]: f for f in fixes}
+    columns = (models.Driver.id, models.Driver.status, models.Driver.fix_at,
+               *[getattr(models.Driver, name) for name in events.DRIVER_FIELDS if name != "status"])
+    current = [row for chunk in _chunks(by_id) for row in db.execute(select(*columns).where(models.Driver.id.in_(chunk)))]
+    applied = {}
+    for row in current:
+        _, lat, lng, stamp = by_id[row.id]
+        if row.fix_at is not None and row.fix_at >= stamp:
+            continue
+        fields = row._asdict()
+        fields.update(previous_status=row.status, latitude=lat, longitude=lng, fix_at=stamp,
+                      status="online" if row.status == "offline" else row.status)
+        applied[row.id] = fields
+    if applied:
+        db.execute(update(models.Driver), [
+            {"id": driver_id, "latitude": f["latitude"], "longitude": f["longitude"],
+             "geohash": geo.encode(f["latitude"], f["longitude"]),
+             "fix_at": f["fix_at"], "last_seen": now, "status": f["status"]}
+            for driver_id, f in applied.items()
+        ])
+    return applied
+
+
+def apply(db, fixes, now: datetime):
+    """Apply parsed fixes in one transaction and report a status per item"""
+    results = [INVALID if fix is None else None for fix in fixes]
+    newest = {}  # driver_id -> index of its newest fix in this batch
+    for i, fix in enumerate(fixes):
+        if fix is None:
+            continue
+        j = newest.get(fix[0])
+        if j is not None and fixes[j][3] > fix[3]:
+            results[i] = STALE
+            continue
+        if j is not None:
+            results[j] = STALE
+        newest[fix[0]] = i
+    candidates = [fixes[i] for i in newest.values()]
+
+    applied = {}
+    if candidates:
+        if db.get_bind().dialect.name == "postgresql":
+            applied = _apply_postgres(db, candidates, now)
+        else:
+            applied = _apply_generic(db, candidates, now)
+        events.record_many(db, "driver", "online", [
+            (driver_id, {name: row[name] for name in events.DRIVER_FIELDS})
+            for driver_id, row in applied.items() if row["previous_status"] == "offline"
+        ])
+        db.commit()
+
+    missing = [driver_id for driver_id in newest if driver_id not in applied]
+    known = {driver_id for chunk in _chunks(missing)
+             for driver_id in db.scalars(select(models.Driver.id).where(models.Driver.id.in_(chunk)))}
+    for driver_id, i in newest.items():
+        results[i] = OK if driver_id in applied else STALE if driver_id in known else UNKNOWN
+
+    counts = {status: 0 for status in (OK, STALE, UNKNOWN, INVALID)}
+    for status in results:
+        counts[status] += 1
+    for status, count in counts.items():
+        if count:
+            metrics.incr(f"heartbeats.{status}", count)
+    return {
+        "applied": counts[OK],
+        "stale": counts[STALE],
+        "unknown": counts[UNKNOWN],
+        "invalid": counts[INVALID],
+        "results": results,
+    }
@@ -0,0 +1,118 @@
+"""
+Adaptive load shedding by priority class.
+
+Every request is classed by path prefix as critical (booking, acceptance,
+heartbeats), normal, or low (analytics, listings, the simulator). Before a
+request is admitted the shedder looks at three pressure signals:
+
+  in_flight   requests currently being handled by this process
+  waiting     requests queued for a worker thread (anyio's default limiter)
+  loop_lag    how late the event loop wakes up, in seconds
+
+If any signal is over the class's threshold the request is answered with
+503 straight away, so when Postgres slows down the dashboards back off
+first and bookings keep the thread pool. Critical requests are never shed.
+
+Thresholds and priorities are configured with SHED_THRESHOLDS and
+SHED_PRIORITIES (JSON), e.g.
+
+  SHED_THRESHOLDS='{"low": {"in_flight": 32, "waiting": 4, "loop_lag": 0.1}}'
+  SHED_PRIORITIES='{"/merchant-analytics": "low", "/coupons": "critical"}'
+"""
+
+import asyncio
+import json
+import os
+
+from anyio import to_thread
+
+import metrics
+
+LAG_SAMPLE_SECONDS = 0.1
+
+DEFAULT_THRESHOLDS = {
+    "low": {"in_flight": 64, "waiting": 8, "loop_lag": 0.2},
+    "normal": {"in_flight": 256, "waiting": 64, "loop_lag": 1.0},
+}
+
+DEFAULT_PRIORITIES = {
+    "/book-ride": "critical",
+    "/accept-ride-request": "critical",
+    "/reject-ride-request": "critical",
+    "/heartbeat": "critical",
+    "/go-online": "critical",
+    "/go-offline": "critical",
+    "/healthz": "critical",
+    "/readyz": "critical",
+    "/queue": "low",
+    "/available-drivers": "low",
+    "/all-merchants": "low",
+    "/ride-containers": "low",
+    "/changes": "low",
+    "/merchant-analytics": "low",
+    "/merchant-redemptions": "low",
+    "/simulate": "low",
+    "/bulk-register": "low",
+    "/cleanup": "low",
+}
+
+
+def _load(default, env):
+    merged = dict(default)
+    raw = os.getenv(env)
+    if raw:
+        merged.update(json.loads(raw))
+    return merged
+
+
+class LoadShedder:
+    def __init__(self, thresholds=None, priorities=None):
+        self.thresholds = _load(DEFAULT_THRESHOLDS, "SHED_THRESHOLDS") if thresholds is None else thresholds
+        priorities = _load(DEFAULT_PRIORITIES, "SHED_PRIORITIES") if priorities is None else priorities
+        # Longest prefix wins, so "/simulate-rides-batch" can override "/simulate"
+        self.priorities = sorted(priorities.items(), key=lambda item: len(item[0]), reverse=True)
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        self._watcher = None
+
+    def priority(self, path: str) -> str:
+        for prefix, priority in self.priorities:
+            if path.startswith(prefix):
+                return priority
+        return "normal"
+
+    @staticmethod
+    def waiting() -> int:
+        return to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+    def pressure(self):
+        return {"in_flight": self.in_flight, "waiting": self.waiting(), "loop_lag": self.loop_lag}
+
+    def should_shed(self, priority: str) -> bool:
+        self._watch_loop_lag()
+        limits = self.thresholds.get(priority)
+        if not limits:
+            return False
+        pressure = self.pressure()
+        metrics.set_gauge("load_shed.in_flight", pressure["in_flight"])
+        metrics.set_gauge("load_shed.waiting", pressure["waiting"])
+        metrics.set_gauge("load_shed.loop_lag_ms", round(pressure["loop_lag"] * 1000, 1))
+        if any(pressure[signal] > limit for signal, limit in limits.items()):
+            metrics.incr("load_shed.shed")
+            metrics.incr(f"load_shed.shed.{priority}")
+            return True
+        return False
+
+    def _watch_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        if self._watcher is None or self._watcher.done() or self._watcher.get_loop() is not loop:
+            self._watcher = loop.create_task(self._sample_loop_lag())
+
+    async def _sample_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LAG_SAMPLE_SECONDS)
+            late = max(0.0, loop.time() - started - LAG_SAMPLE_SECONDS)
+            # Jump up at once, decay slowly, so one quiet sample does not reopen the gates
+            self.loop_lag = max(late, self.loop_lag * 0.5)
@@ -0,0 +1,312 @@
+"""
+Per-driver location history.
+
+Driver rows only hold the latest position, so every heartbeat fix is also
+offered to a ring buffer of the driver's recent track. A fix is kept only if
+the driver moved at least MIN_DISTANCE_M from the last kept point or
+MAX_GAP_SECONDS went by, so a parked car costs one point a minute instead of
+one per heartbeat. Each ring is a flat array('d') of (lat, lng, ts) triples
+that grows up to CAPACITY points and then overwrites its oldest point.
+
+While a driver is on a ride, the points since the last flush are written
+every FLUSH_SECONDS to ride_path_segments as an encoded polyline (plus the
+encoded time offsets), so a ride's route survives the ring wrapping and a
+restart. /ride/{id}/path joins the stored segments with whatever is still
+in memory.
+
+  LOCATION_HISTORY_POINTS=128 LOCATION_MIN_DISTANCE_M=20 LOCATION_MAX_GAP_SECONDS=60
+
+History is per process; with several API workers each keeps the tracks of
+the heartbeats it received.
+"""
+
+import math
+import os
+import threading
+from array import array
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from db import SessionLocal
+import metrics
+import models
+
+CAPACITY = int(os.getenv("LOCATION_HISTORY_POINTS", "128"))
+MIN_DISTANCE_M = float(os.getenv("LOCATION_MIN_DISTANCE_M", "20"))
+MAX_GAP_SECONDS = float(os.getenv("LOCATION_MAX_GAP_SECONDS", "60"))
+FLUSH_SECONDS = float(os.getenv("LOCATION_FLUSH_SECONDS", "30"))
+
+EARTH_RADIUS_M = 6371000.0
+COORDINATE_SCALE = 1e5  # polyline precision, about a metre
+OFFSET_SCALE = 10  # time offsets to a tenth of a second
+
+
+def unix_seconds(stamp: datetime) -> float:
+    """Naive UTC datetime (how the models store time) to Unix seconds"""
+    return stamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_unix_seconds(ts: float) -> datetime:
+    return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Equirectangular approximation; plenty for the few metres between fixes"""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+# ------------------ POLYLINE ENCODING ------------------
+
+def encode(rows, scale: float) -> str:
+    """Google's encoded polyline format over tuples of numbers, delta by column"""
+    chunks = []
+    previous = None
+    for row in rows:
+        values = [round(v * scale) for v in row]
+        deltas = values if previous is None else [v - p for v, p in zip(values, previous)]
+        previous = values
+        for delta in deltas:
+            delta = ~(delta << 1) if delta < 0 else delta << 1
+            while delta >= 0x20:
+                chunks.append(chr((0x20 | (delta & 0x1f)) + 63))
+                delta >>= 5
+            chunks.append(chr(delta + 63))
+    return "".join(chunks)
+
+
+def decode(encoded: str, width: int, scale: float):
+    """Inverse of encode(): a list of `width`-tuples"""
+    rows = []
+    values = [0] * width
+    column = 0
+    shift = result = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        result |= (byte & 0x1f) << shift
+        shift += 5
+        if byte >= 0x20:
+            continue
+        values[column] += ~(result >> 1) if result & 1 else result >> 1
+        shift = result = 0
+        column += 1
+        if column == width:
+            rows.append(tuple(v / scale for v in values))
+            column = 0
+    return rows
+
+
+# ------------------ RING BUFFERS ------------------
+
+class Track:
+    """One driver's recent points: (lat, lng, ts) triples in a ring"""
+
+    __slots__ = ("points", "head")
+
+    def __init__(self):
+        self.points = array("d")
+        self.head = 0  # next triple to overwrite once the ring is full
+
+    def __len__(self):
+        return len(self.points) // 3
+
+    def append(self, lat, lng, ts, capacity):
+        if len(self.points) < capacity * 3:
+            self.points.extend((lat, lng, ts))
+            return False
+        i = self.head * 3
+        self.points[i], self.points[i + 1], self.points[i + 2] = lat, lng, ts
+        self.head = (self.head + 1) % capacity
+        return True
+
+    def last(self):
+        if not self.points:
+            return None
+        i = ((self.head - 1) % len(self)) * 3
+        return self.points[i], self.points[i + 1], self.points[i + 2]
+
+    def between(self, after: float, until: float = math.inf):
+        """Points with after < ts <= until, oldest first"""
+        count = len(self)
+        found = []
+        for k in range(count):
+            i = ((self.head + k) % count) * 3
+            ts = self.points[i + 2]
+            if after < ts <= until:
+                found.append((self.points[i], self.points[i + 1], ts))
+        return found
+
+
+class LocationHistory:
+    def __init__(self, capacity: int = CAPACITY, min_distance_m: float = MIN_DISTANCE_M,
+                 max_gap_seconds: float = MAX_GAP_SECONDS):
+        self.capacity = capacity
+        self.min_distance_m = min_distance_m
+        self.max_gap_seconds = max_gap_seconds
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._tracks = {}  # driver_id -> Track
+        self._rides = {}  # ride_id -> {"driver_id", "flushed_to", "ends_at", "seq"}
+        self._driver_rides = {}  # driver_id -> ride_id in progress
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def track(self, driver_id: int):
+        """The driver's buffered points, oldest first"""
+        with self._lock:
+            track = self._tracks.get(driver_id)
+            return track.between(-math.inf) if track else []
+
+    def record(self, driver_id: int, lat: float, lng: float, stamp: datetime):
+        """Offer one fix to the driver's ring; True if it was kept"""
+        return self.record_many([(driver_id, lat, lng, stamp)]) == 1
+
+    def record_many(self, fixes):
+        """Offer (driver_id, lat, lng, fix datetime) tuples, as heartbeats.apply sees them"""
+        counts = {"recorded": 0, "downsampled": 0, "overwritten": 0, "out_of_order": 0}
+        with self._lock:
+            for driver_id, lat, lng, stamp in fixes:
+                counts[self._record(driver_id, lat, lng, unix_seconds(stamp))] += 1
+        for name, count in counts.items():
+            if count:
+                metrics.incr(f"location_history.{name}", count)
+        return counts["recorded"] + counts["overwritten"]
+
+    def _record(self, driver_id, lat, lng, ts):
+        track = self._tracks.get(driver_id)
+        if track is None:
+            track = self._tracks[driver_id] = Track()
+        last = track.last()
+        if last is not None:
+            last_lat, last_lng, last_ts = last
+            if ts <= last_ts:
+                return "out_of_order"
+            if (ts - last_ts < self.max_gap_seconds
+                    and distance_m(last_lat, last_lng, lat, lng) < self.min_distance_m):
+                return "downsampled"
+        return "overwritten" if track.append(lat, lng, ts, self.capacity) else "recorded"
+
+    # ------------------ RIDES ------------------
+
+    def start_ride(self, ride_id: int, driver_id: int, at: datetime = None):
+        """Attribute the driver's points from `at` on to the ride"""
+        at = unix_seconds(at or datetime.utcnow())
+        with self._lock:
+            previous = self._driver_rides.get(driver_id)
+            if previous is not None and previous in self._rides:
+                self._rides[previous]["ends_at"] = at
+            self._driver_rides[driver_id] = ride_id
+            self._rides[ride_id] = {"driver_id": driver_id, "flushed_to": at, "ends_at": None, "seq": 0}
+
+    def end_rides(self, ride_ids, at: datetime = None):
+        """Stop attributing points to these rides; the next flush writes their tails"""
+        at = unix_seconds(at or datetime.utcnow())
+        with self._lock:
+            for ride_id in ride_ids:
+                ride = self._rides.get(ride_id)
+                if ride is None:
+                    continue
+                ride["ends_at"] = at
+                if self._driver_rides.get(ride["driver_id"]) == ride_id:
+                    del self._driver_rides[ride["driver_id"]]
+
+    def pending(self, ride_id: int):
+        """Points of a ride that are not flushed yet"""
+        with self._lock:
+            ride = self._rides.get(ride_id)
+            track = ride and self._tracks.get(ride["driver_id"])
+            if not track:
+                return []
+            return track.between(ride["flushed_to"], ride["ends_at"] or math.inf)
+
+    def flush(self, session_factory=SessionLocal):
+        """Write every ride's unflushed points as one segment each; returns points written"""
+        with self._flush_lock:
+            segments = []
+            with self._lock:
+                for ride_id, ride in self._rides.items():
+                    track = self._tracks.get(ride["driver_id"])
+                    points = track.between(ride["flushed_to"], ride["ends_at"] or math.inf) if track else []
+                    if points:
+                        segments.append((ride_id, ride, points))
+                finished = [ride_id for ride_id, ride in self._rides.items() if ride["ends_at"] is not None]
+
+            if segments:
+                db = session_factory()
+                try:
+                    db.execute(insert(models.RidePathSegment), [
+                        self._segment(ride_id, ride, points) for ride_id, ride, points in segments
+                    ])
+                    db.commit()
+                finally:
+                    db.close()
+
+            written = 0
+            with self._lock:
+                for _, ride, points in segments:
+                    ride["flushed_to"] = points[-1][2]
+                    ride["seq"] += 1
+                    written += len(points)
+                for ride_id in finished:
+                    self._rides.pop(ride_id, None)
+            metrics.incr("location_history.flushed_points", written)
+            metrics.incr("location_history.flushed_segments", len(segments))
+            metrics.set_gauge("location_history.drivers", len(self._tracks))
+            metrics.set_gauge("location_history.rides", len(self._rides))
+            return written
+
+    @staticmethod
+    def _segment(ride_id, ride, points):
+        started = points[0][2]
+        return {
+            "ride_id": ride_id,
+            "driver_id": ride["driver_id"],
+            "seq": ride["seq"],
+            "points": len(points),
+            "polyline": encode([(lat, lng) for lat, lng, _ in points], COORDINATE_SCALE),
+            "offsets": encode([(ts - started,) for _, _, ts in points], OFFSET_SCALE),
+            "started_at": from_unix_seconds(started),
+            "ended_at": from_unix_seconds(points[-1][2]),
+        }
+
+
+def segment_points(segment):
+    """(lat, lng, ts) points of a stored segment"""
+    started = unix_seconds(segment.started_at)
+    coordinates = decode(segment.polyline, 2, COORDINATE_SCALE)
+    offsets = decode(segment.offsets, 1, OFFSET_SCALE)
+    return [(lat, lng, started + offset) for (lat, lng), (offset,) in zip(coordinates, offsets)]
+
+
+class HistoryFlusher:
+    """Background thread that flushes ride tracks periodically"""
+
+    def __init__(self, history: LocationHistory, interval: float = FLUSH_SECONDS):
+        self.history = history
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="location-history", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.history.flush()
+        except Exception as e:
+            print(f"❌ Final location history flush failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.history.flush()
+            except Exception as e:
+                print(f"❌ Location history flush failed: {e}")
@@ -1,28 +1,102 @@
-from fastapi import FastAPI, Depends, Response
+from fastapi import FastAPI, Depends, Response, Request
+from fastapi.responses import HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, insert, select, text, update
 from sqlalchemy.orm import Session
-from datetime import datetime
-import threading, time, subprocess, json, random
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from typing import List
+from functools import lru_cache
+import os, time, math, random, threading
 
-from db import SessionLocal, engine
+from db import SessionLocal, engine, read_session, MAX_REPLICA_LAG_SECONDS
 import models, schemas
-
-# Wait for database to be ready
-import time as time_module
-for i in range(30):
+import bulk_import
+import dispatch_pool
+import events
+import geo
+import geocoder
+import heartbeats
+import load_shedding
+import location_history
+import metrics
+import offer_cache
+import partitioning
+import rate_limit
+import retention
+import ride_rollups
+import road_network
+import traffic_capture
+import user_stats
+import zone_matcher
+from docker_inventory import DockerInventory
+from responses import ORJSONResponse, columns, dumps, rows_json, rows_response
+import catalog_cache
+from trip_scheduler import TripScheduler
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+rate_limiter = rate_limit.RateLimiter()
+
+# Registered before CORS so throttled and shed responses still carry CORS headers
+@app.middleware("http")
+async def limit_rates(request: Request, call_next):
+    """Throttle clients that poll or heartbeat faster than their route allows"""
+    wait = rate_limiter.check(request)
+    if wait is not None:
+        return ORJSONResponse(
+            {"error": "Too many requests", "retry_after": round(wait, 3)},
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+    return await call_next(request)
+
+load_shedder = load_shedding.LoadShedder()
+
+@app.middleware("http")
+async def shed_load(request: Request, call_next):
+    """Turn low-priority traffic away first when the server is falling behind"""
+    if load_shedder.should_shed(load_shedder.priority(request.url.path)):
+        return ORJSONResponse(
+            {"error": "Server busy, try again shortly"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    load_shedder.in_flight += 1
     try:
-        models.Base.metadata.create_all(bind=engine)
-        print("✅ Database connected successfully")
-        break
-    except Exception as e:
-        if i < 29:
-            print(f"⏳ Waiting for database... ({i+1}/30)")
-            time_module.sleep(1)
-        else:
-            print(f"❌ Database connection failed: {e}")
-            raise
+        return await call_next(request)
+    finally:
+        load_shedder.in_flight -= 1
+
+traffic_recorder = traffic_capture.from_env()  # None unless TRAFFIC_CAPTURE_DIR is set
+
+# Outside the limiter and shedder, so a capture shows the 429s and 503s clients saw
+@app.middleware("http")
+async def capture_traffic(request: Request, call_next):
+    """Record each request and its response for replay_traffic.py"""
+    recorder = traffic_recorder
+    if recorder is None or not recorder.wants(request.url.path):
+        return await call_next(request)
+    body = await request.body()
+    started = time.perf_counter()
+    response = await call_next(request)
+    original = response.body_iterator
+    captured = bytearray()
+
+    async def tee():
+        async for chunk in original:
+            if len(captured) < traffic_capture.RESPONSE_BYTES:
+                captured.extend(chunk)
+            yield chunk
+        recorder.record(
+            request.method, request.url.path, request.url.query, request.headers.get("content-type", ""),
+            body, response.status_code, (time.perf_counter() - started) * 1000, bytes(captured),
+            response.headers.get("content-type", ""),
+        )
 
-app = FastAPI()
+    response.body_iterator = tee()
+    return response
 
 # ✅ CORS setup
 app.add_middleware(
@@ -31,92 +105,91 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Last-Write", "X-Changes-Cursor", "Retry-After"],
 )
 
+LAST_WRITE_COOKIE = "last_write"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+@app.middleware("http")
+async def remember_writes(request: Request, call_next):
+    """Stamp successful writes so the caller's next reads avoid lagging replicas"""
+    response = await call_next(request)
+    if request.method in WRITE_METHODS and response.status_code < 400:
+        stamp = f"{time.time():.3f}"
+        response.headers["X-Last-Write"] = stamp
+        response.set_cookie(LAST_WRITE_COOKIE, stamp, max_age=int(MAX_REPLICA_LAG_SECONDS) + 1, samesite="lax")
+    return response
+
+# How riders see their trip: "shared" serves /ride/{id}/view from this API,
+# "container" starts an nginx container per ride on its own host port
+RIDE_PAGE_MODE = os.getenv("RIDE_PAGE_MODE", "shared")
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000")
+RIDE_PAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ride-interface", "index.html")
+
 # Port management for ride containers
 USED_PORTS = set()
 BASE_PORT = 7000
+_port_lock = threading.Lock()
+container_inventory = DockerInventory()
+
+TRIP_DURATION_SECONDS = 60
+DISPATCH_RADIUS_KM = 100.0  # increased for testing
+DISPATCH_CANDIDATES = int(os.getenv("DISPATCH_CANDIDATES", "20"))  # nearest drivers offered each ride
+dispatcher = dispatch_pool.DispatchPool()  # zone workers when DISPATCH_WORKERS > 0
+MAX_SIMULATED_RIDES = 100000
+SIMULATOR_RIDER_EMAIL = "simulator@test.com"  # @test.com, so cleanup-simulation-data removes it
 
 def get_next_available_port():
     """Get the next available port starting from 7000"""
     import socket
     port = BASE_PORT
-    while True:
-        if port not in USED_PORTS:
-            # Check if port is actually free
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.bind(('', port))
-                USED_PORTS.add(port)
-                return port
-            except OSError:
-                pass  # Port is busy, try next
-        port += 1
+    with _port_lock:
+        while True:
+            if port not in USED_PORTS:
+                # Check if port is actually free
+                try:
+                    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                        s.bind(('', port))
+                    USED_PORTS.add(port)
+                    return port
+                except OSError:
+                    pass  # Port is busy, try next
+            port += 1
 
 def release_port(port):
     """Release a port when ride is completed"""
     USED_PORTS.discard(port)
 
+def ride_url(ride_id, port):
+    """Where the rider's trip page lives: its container, or the shared view"""
+    if port:
+        return f"http://localhost:{port}"
+    return f"{PUBLIC_BASE_URL}/ride/{ride_id}/view"
+
+@lru_cache(maxsize=1)
+def ride_page_template(mtime):
+    """index.html split around the point where ride data gets embedded"""
+    with open(RIDE_PAGE_PATH, encoding="utf-8") as f:
+        html = f.read()
+    head, _, tail = html.partition("<script>")
+    return head, "<script>" + tail
+
 def create_ride_container(ride_id, port):
-    """Create a Docker container for a specific ride"""
-    try:
-        container_name = f"ride-{ride_id}"
-        
-        subprocess.run(["docker", "rm", "-f", container_name], capture_output=True)
-        
-        # Create container first
-        cmd = [
-            "docker", "run", "-d",
-            "--name", container_name,
-            "--network", "mini_uber_default",
-            "-p", f"{port}:80",
-            "nginx:alpine"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            print(f"❌ Failed to create container: {result.stderr}")
-            release_port(port)
-            return False
-        
-        # Copy HTML file into container
-        import os
-        server_dir = os.path.dirname(os.path.abspath(__file__))
-        project_dir = os.path.dirname(server_dir)
-        html_file = os.path.join(project_dir, "ride-interface", "index.html")
-        
-        copy_cmd = ["docker", "cp", html_file, f"{container_name}:/usr/share/nginx/html/index.html"]
-        copy_result = subprocess.run(copy_cmd, capture_output=True, text=True)
-        
-        if copy_result.returncode == 0:
-            print(f"✅ Created ride container {container_name} on port {port}")
-            return True
-        else:
-            print(f"❌ Failed to copy HTML: {copy_result.stderr}")
-            subprocess.run(["docker", "rm", "-f", container_name], capture_output=True)
+    """Start a ride's container in the background; its port is freed if that fails"""
+    def release_on_failure(future):
+        if future.result() is False:
             release_port(port)
-            return False
-            
-    except Exception as e:
-        print(f"❌ Error creating container: {e}")
-        release_port(port)
-        return False
+    container_inventory.submit(
+        container_inventory.create_ride_container(ride_id, port, RIDE_PAGE_PATH)
+    ).add_done_callback(release_on_failure)
 
 def remove_ride_container(ride_id, port):
-    """Remove Docker container when ride is completed"""
-    try:
-        container_name = f"ride-{ride_id}"
-        
-        # Stop and remove container
-        subprocess.run(["docker", "stop", container_name], capture_output=True)
-        subprocess.run(["docker", "rm", container_name], capture_output=True)
-        
-        release_port(port)
-        print(f"🗑️ Removed ride container {container_name} from port {port}")
-        
-    except Exception as e:
-        print(f"❌ Error removing container: {e}")
+    """Remove a finished ride's container in the background, then free its port"""
+    container_inventory.submit(
+        container_inventory.remove_ride_container(ride_id)
+    ).add_done_callback(lambda future: release_port(port))
+    print(f"🗑️ Removing ride container ride-{ride_id} from port {port}")
 
 # Dependency to get DB session
 def get_db():
@@ -126,6 +199,22 @@ def get_db():
     finally:
         db.close()
 
+def seconds_since_write(request: Request):
+    """How long ago this caller last wrote, from the X-Last-Write header or cookie"""
+    stamp = request.headers.get("x-last-write") or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return max(0.0, time.time() - float(stamp)) if stamp else None
+    except ValueError:
+        return None
+
+# Read-only endpoints: a replica when one is fresh enough, else the primary
+def get_read_db(request: Request):
+    db = read_session(seconds_since_write(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
 
 # ------------------ USERS ------------------
 
@@ -147,6 +236,8 @@ async def register_user(name: str, email: str, response: Response = None, db: Se
 
 # ------------------ DRIVERS ------------------
 
+driver_tracks = location_history.LocationHistory()
+
 @app.post("/register-driver")
 async def register_driver(name: str, email: str, location: str, latitude: float = None, longitude: float = None, response: Response = None, db: Session = Depends(get_db)):
     if response:
@@ -160,6 +251,7 @@ async def register_driver(name: str, email: str, location: str, latitude: float
         if latitude and longitude:
             existing.latitude = latitude
             existing.longitude = longitude
+        events.record(db, "driver", existing.id, "registered", **events.driver_fields(existing))
         db.commit()
         return {"message": "Driver already exists", "driver_id": existing.id}
     driver = models.Driver(
@@ -172,6 +264,8 @@ async def register_driver(name: str, email: str, location: str, latitude: float
         last_seen=datetime.utcnow()
     )
     db.add(driver)
+    db.flush()
+    events.record(db, "driver", driver.id, "registered", **events.driver_fields(driver))
     db.commit()
     db.refresh(driver)
     return {"message": "Driver registered 🚖", "driver_id": driver.id}
@@ -184,6 +278,7 @@ def go_online(driver_id: int, db: Session = Depends(get_db)):
         return {"error": "Driver not found"}
     driver.status = "online"
     driver.last_seen = datetime.utcnow()
+    events.record(db, "driver", driver.id, "online", **events.driver_fields(driver))
     db.commit()
     assign_pending_rides(db)
     return {"message": f"Driver {driver.name} is now online ✅"}
@@ -195,6 +290,7 @@ def go_offline(driver_id: int, db: Session = Depends(get_db)):
     if not driver:
         return {"error": "Driver not found"}
     driver.status = "offline"
+    events.record(db, "driver", driver.id, "offline", status="offline")
     db.commit()
     return {"message": f"Driver {driver.name} is now offline ❌"}
 
@@ -205,32 +301,62 @@ def heartbeat(driver_id: int, latitude: float = None, longitude: float = None, d
     if not driver:
         return {"error": "Driver not found"}
     driver.last_seen = datetime.utcnow()
-    if driver.status == "offline":
+    came_online = driver.status == "offline"
+    if came_online:
         driver.status = "online"
     if latitude is not None and longitude is not None:
         driver.latitude = latitude
         driver.longitude = longitude
+        driver.fix_at = driver.last_seen
+        driver_tracks.record(driver.id, latitude, longitude, driver.last_seen)
+    if came_online:
+        events.record(db, "driver", driver.id, "online", **events.driver_fields(driver))
     db.commit()
+    if dispatcher.running and latitude is not None and longitude is not None:
+        dispatcher.move_many([(driver.id, latitude, longitude)])
     return {"status": "ok"}
 
+@app.post("/heartbeats")
+async def batch_heartbeats(request: Request, db: Session = Depends(get_db)):
+    """Positions for many drivers at once, as a JSON array or binary frames"""
+    body = await request.body()
+    now = datetime.utcnow()
+    try:
+        if request.headers.get("content-type", "").startswith("application/octet-stream"):
+            fixes = heartbeats.parse_frames(body, now)
+        else:
+            fixes = heartbeats.parse_json(body, now)
+    except ValueError as e:
+        return {"error": str(e)}
+    if len(fixes) > heartbeats.MAX_BATCH:
+        return {"error": f"At most {heartbeats.MAX_BATCH} heartbeats per request"}
+    result = await run_in_threadpool(heartbeats.apply, db, fixes, now)
+    applied = [fix for fix, status in zip(fixes, result["results"]) if status == heartbeats.OK]
+    await run_in_threadpool(driver_tracks.record_many, applied)
+    if dispatcher.running:
+        await run_in_threadpool(dispatcher.move_many, applied)
+    return result
+
 
-@app.get("/available-drivers")
+@app.get("/available-drivers", response_model=List[schemas.DriverOut])
 def available_drivers(db: Session = Depends(get_db)):
     from datetime import timedelta
     
     timeout = datetime.utcnow() - timedelta(seconds=60)
-    inactive_drivers = db.query(models.Driver).filter(
-        models.Driver.status == "online",
-        models.Driver.last_seen < timeout
+    went_offline = db.scalars(
+        update(models.Driver)
+        .where(models.Driver.status == "online", models.Driver.last_seen < timeout)
+        .values(status="offline")
+        .returning(models.Driver.id),
+        execution_options={"synchronize_session": False}
     ).all()
-    
-    for driver in inactive_drivers:
-        driver.status = "offline"
-    if inactive_drivers:
+    if went_offline:
+        events.record_many(db, "driver", "offline", [(driver_id, {"status": "offline"}) for driver_id in went_offline])
         db.commit()
     
-    online_drivers = db.query(models.Driver).filter(models.Driver.status == "online").all()
-    return online_drivers
+    return rows_response(
+        db.query(*columns(models.Driver, schemas.DriverOut)).filter(models.Driver.status == "online")
+    )
 
 
 # ------------------ RIDES ------------------
@@ -240,13 +366,19 @@ def home():
     return {"message": "🚖 Welcome to Mini-Uber Backend"}
 
 
-@app.get("/queue")
-def get_queue(db: Session = Depends(get_db)):
+@app.get("/queue", response_model=List[schemas.QueueRide])
+def get_queue(db: Session = Depends(get_read_db)):
     """Returns all rides in queue (pending, assigned, completed)."""
-    return db.query(models.RideQueue).order_by(models.RideQueue.id).all()
+    # Read before the rows, so the snapshot already covers every event up to it
+    cursor = events.head(db)
+    response = rows_response(
+        db.query(*columns(models.RideQueue, schemas.QueueRide)).order_by(models.RideQueue.id)
+    )
+    response.headers["X-Changes-Cursor"] = str(cursor)
+    return response
 
 @app.get("/ride/{ride_id}")
-def get_ride(ride_id: int, db: Session = Depends(get_db)):
+def get_ride(ride_id: int, db: Session = Depends(get_read_db)):
     """Get ride details by ID"""
     ride = db.query(models.RideQueue).filter(models.RideQueue.id == ride_id).first()
     if not ride:
@@ -264,8 +396,58 @@ def get_ride(ride_id: int, db: Session = Depends(get_db)):
         "status": ride.status
     }
 
+@app.get("/ride/{ride_id}/view")
+def view_ride(ride_id: int, db: Session = Depends(get_read_db)):
+    """The rider's trip page, served here with the ride embedded instead of from a container"""
+    ride = db.query(
+        models.RideQueue.id.label("ride_id"),
+        models.RideQueue.port,
+        models.RideQueue.container_name,
+        models.User.name.label("user_name"),
+        models.Driver.name.label("driver_name"),
+        models.RideQueue.start,
+        models.RideQueue.destination,
+        models.RideQueue.status
+    ).outerjoin(
+        models.User, models.User.id == models.RideQueue.user_id
+    ).outerjoin(
+        models.Driver, models.Driver.id == models.RideQueue.driver_id
+    ).filter(models.RideQueue.id == ride_id).first()
+    if not ride:
+        return {"error": "Ride not found"}
+
+    data = ride._asdict()
+    data["user_name"] = data["user_name"] or "Unknown"
+    data["driver_name"] = data["driver_name"] or "Not assigned"
+    head, tail = ride_page_template(os.path.getmtime(RIDE_PAGE_PATH))
+    # "</" would end the script element early if a name contained "</script>"
+    embedded = dumps(data).decode().replace("</", "<\\/")
+    metrics.incr("ride_pages.served")
+    return HTMLResponse(f"{head}<script>window.RIDE = {embedded};</script>\n    {tail}")
+
+@app.get("/ride/{ride_id}/path")
+def get_ride_path(ride_id: int, db: Session = Depends(get_read_db)):
+    """Route the driver took during a ride, as an encoded polyline and (lat, lng, ts) points"""
+    ride = db.query(models.RideQueue.id, models.RideQueue.driver_id).filter(models.RideQueue.id == ride_id).first()
+    if not ride:
+        return {"error": "Ride not found"}
+
+    segments = db.query(models.RidePathSegment).filter(
+        models.RidePathSegment.ride_id == ride_id
+    ).order_by(models.RidePathSegment.seq).all()
+    points = [point for segment in segments for point in location_history.segment_points(segment)]
+    flushed_to = points[-1][2] if points else -math.inf
+    points += [point for point in driver_tracks.pending(ride_id) if point[2] > flushed_to]
+    return {
+        "ride_id": ride_id,
+        "driver_id": ride.driver_id,
+        "points": len(points),
+        "polyline": location_history.encode([(lat, lng) for lat, lng, _ in points], location_history.COORDINATE_SCALE),
+        "path": [[round(lat, 5), round(lng, 5), round(ts, 1)] for lat, lng, ts in points],
+    }
+
 @app.get("/ride-by-port/{port}")
-async def get_ride_by_port(port: int, response: Response, db: Session = Depends(get_db)):
+async def get_ride_by_port(port: int, response: Response, db: Session = Depends(get_read_db)):
     """Get ride details by port number"""
     response.headers["Access-Control-Allow-Origin"] = "*"
     
@@ -298,47 +480,47 @@ async def get_ride_by_port(port: int, response: Response, db: Session = Depends(
 @app.get("/ride-containers")
 def get_ride_containers():
     """Returns information about active ride containers"""
-    try:
-        # Get running containers with ride- prefix
-        result = subprocess.run(
-            ["docker", "ps", "--filter", "name=ride-", "--format", "json"],
-            capture_output=True, text=True
-        )
-        
-        if result.returncode == 0:
-            containers = []
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    container_info = json.loads(line)
-                    containers.append({
-                        "name": container_info["Names"],
-                        "ports": container_info["Ports"],
-                        "status": container_info["Status"]
-                    })
-            return {"containers": containers, "used_ports": list(USED_PORTS)}
-        else:
-            return {"error": "Could not fetch containers", "containers": [], "used_ports": list(USED_PORTS)}
-            
-    except Exception as e:
-        return {"error": str(e), "containers": [], "used_ports": list(USED_PORTS)}
+    containers = [
+        {"name": c["name"], "ports": c["ports"], "status": c["status"]}
+        for c in container_inventory.containers() if c["state"] == "running"
+    ]
+    result = {"containers": containers, "used_ports": list(USED_PORTS)}
+    if not container_inventory.synced:
+        result["error"] = container_inventory.last_error or "Docker inventory not running"
+    return result
 
 
 @app.options("/book-ride")
 def book_ride_options():
     return {"message": "OK"}
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points in km using Haversine formula"""
-    from math import radians, sin, cos, sqrt, atan2
-    R = 6371  # Earth radius in km
-    
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
+def find_nearby_drivers(db: Session, ride_id: int, lat: float, lng: float):
+    """(driver_id, km, road ETA or None) for the nearest online drivers, best first"""
+    if dispatcher.running:
+        try:
+            dispatcher.follow(db)
+            return dispatcher.dispatch(lat, lng, DISPATCH_CANDIDATES, DISPATCH_RADIUS_KM, ride_id)
+        except dispatch_pool.DispatchUnavailable as e:
+            print(f"❌ Dispatch pool unavailable, dispatching inline: {e}")
+            metrics.incr("dispatch_pool.fallbacks")
+
+    # Index range scans over geohash cells
+    nearby = geo.nearest(
+        db.query(models.Driver).filter(models.Driver.status == "online"),
+        models.Driver, lat, lng, k=DISPATCH_CANDIDATES, max_km=DISPATCH_RADIUS_KM
+    )
+    for driver, distance in nearby:
+        print(f"  🚗 {driver.name}: {distance:.2f}km away at ({driver.latitude}, {driver.longitude})")
+
+    # Rank by driving time when a road network is loaded, else by distance
+    network = road_network.get_network()
+    if network and nearby:
+        etas = network.etas_to(lat, lng, [(d.latitude, d.longitude) for d, _ in nearby])
+        ranked = [(driver.id, distance, eta) for (driver, distance), eta in zip(nearby, etas)]
+        ranked.sort(key=lambda x: (x[2] is None, x[2] or 0, x[1]))
+        metrics.incr("dispatch.road_eta_ranked")
+        return ranked
+    return [(driver.id, distance, None) for driver, distance in nearby]
 
 @app.post("/book-ride")
 def book_ride(ride: schemas.RideCreate, response: Response, db: Session = Depends(get_db)):
@@ -351,6 +533,16 @@ def book_ride(ride: schemas.RideCreate, response: Response, db: Session = Depend
     dest_lat = ride.dest_lat
     dest_lng = ride.dest_lng
 
+    # Text-only bookings are placed from the local gazetteer so dispatch has coordinates
+    if pickup_lat is None or pickup_lng is None:
+        place = geocoder.geocode(start)
+        if place:
+            pickup_lat, pickup_lng = place["lat"], place["lon"]
+    if dest_lat is None or dest_lng is None:
+        place = geocoder.geocode(destination)
+        if place:
+            dest_lat, dest_lng = place["lat"], place["lon"]
+
     # Calculate fare
     base_fare = 100.0
     discount = 0.0
@@ -381,48 +573,41 @@ def book_ride(ride: schemas.RideCreate, response: Response, db: Session = Depend
         coupon_id=coupon_id
     )
     db.add(ride_db)
+    db.flush()
+    events.record(db, "ride", ride_db.id, "created", **events.ride_fields(ride_db))
     db.commit()
     db.refresh(ride_db)
     
-    # Find drivers within 1km radius
+    # Find the nearest online drivers
     nearby_drivers = []
     if pickup_lat and pickup_lng:
-        online_drivers = db.query(models.Driver).filter(
-            models.Driver.status == "online",
-            models.Driver.latitude.isnot(None),
-            models.Driver.longitude.isnot(None)
-        ).all()
-        
         print(f"\n🔍 Searching for drivers near ({pickup_lat}, {pickup_lng})")
-        print(f"📊 Found {len(online_drivers)} online drivers with location")
-        
-        for driver in online_drivers:
-            distance = calculate_distance(pickup_lat, pickup_lng, driver.latitude, driver.longitude)
-            print(f"  🚗 {driver.name}: {distance:.2f}km away at ({driver.latitude}, {driver.longitude})")
-            if distance <= 100.0:  # Within 100km (increased for testing)
-                nearby_drivers.append((driver, distance))
-                print(f"    ✅ Added to nearby drivers")
-            else:
-                print(f"    ❌ Too far (> 100km)")
-        
-        # Sort by distance
-        nearby_drivers.sort(key=lambda x: x[1])
+        nearby_drivers = find_nearby_drivers(db, ride_db.id, pickup_lat, pickup_lng)
         print(f"\n✅ Total nearby drivers: {len(nearby_drivers)}\n")
     else:
         print(f"\n⚠️ No pickup coordinates provided: lat={pickup_lat}, lng={pickup_lng}\n")
     
     # Send ride requests to nearby drivers
     if nearby_drivers:
-        for driver, distance in nearby_drivers:
+        ride_requests = []
+        for driver_id, distance, eta in nearby_drivers:
             ride_request = models.RideRequest(
                 ride_id=ride_db.id,
-                driver_id=driver.id,
-                status="pending"
+                driver_id=driver_id,
+                status="pending",
+                eta_seconds=eta
             )
             db.add(ride_request)
+            ride_requests.append(ride_request)
+        db.flush()
+        events.record_many(db, "request", "created", [
+            (req.id, {"ride_id": req.ride_id, "driver_id": req.driver_id, "status": "pending"})
+            for req in ride_requests
+        ])
         db.commit()
     else:
         ride_db.status = "no_drivers"
+        events.record(db, "ride", ride_db.id, "no_drivers", status="no_drivers")
         db.commit()
     # Update coupon usage
     if coupon_id:
@@ -436,6 +621,7 @@ def book_ride(ride: schemas.RideCreate, response: Response, db: Session = Depend
         if user_coupon:
             user_coupon.usage_count += 1
         db.commit()
+        catalog_cache.bump("coupons", f"user_coupons:{user_id}")
 
     response.headers["Access-Control-Allow-Origin"] = "*"
     response.headers["Access-Control-Allow-Methods"] = "POST, GET, OPTIONS"
@@ -449,13 +635,14 @@ def book_ride(ride: schemas.RideCreate, response: Response, db: Session = Depend
         "destination": destination,
         "status": ride_db.status,
         "nearby_drivers": len(nearby_drivers),
+        "pickup_eta_seconds": nearby_drivers[0][2] if nearby_drivers else None,
         "fare": base_fare,
         "discount": discount,
         "final_fare": final_fare
     }
 
 @app.get("/driver-ride-requests/{driver_id}")
-def get_driver_ride_requests(driver_id: int, db: Session = Depends(get_db)):
+def get_driver_ride_requests(driver_id: int, db: Session = Depends(get_read_db)):
     """Get pending ride requests for a driver"""
     requests = db.query(models.RideRequest).filter(
         models.RideRequest.driver_id == driver_id,
@@ -478,6 +665,7 @@ def get_driver_ride_requests(driver_id: int, db: Session = Depends(get_db)):
                 "dest_lat": ride.dest_lat,
                 "dest_lng": ride.dest_lng,
                 "fare": ride.final_fare,
+                "eta_seconds": req.eta_seconds,
                 "created_at": req.created_at
             })
     return result
@@ -493,62 +681,81 @@ def accept_ride_request(request_id: int, driver_id: int, db: Session = Depends(g
     if not ride_request:
         return {"error": "Request not found"}
     
-    ride = db.query(models.RideQueue).filter(models.RideQueue.id == ride_request.ride_id).first()
-    if not ride or ride.status != "searching":
-        return {"error": "Ride no longer available"}
+    # Claim the ride. A ride another driver is claiming right now is skipped
+    # rather than waited on, and the version check makes the update a no-op
+    # if anyone got there between our read and our write.
+    ride_id = ride_request.ride_id
+    claim = db.execute(
+        select(models.RideQueue.version).where(
+            models.RideQueue.id == ride_id,
+            models.RideQueue.status == "searching"
+        ).with_for_update(skip_locked=True)
+    ).first()
+    port = get_next_available_port() if claim and RIDE_PAGE_MODE == "container" else None
+    claimed = claim and db.execute(
+        update(models.RideQueue)
+        .where(
+            models.RideQueue.id == ride_id,
+            models.RideQueue.status == "searching",
+            models.RideQueue.version == claim.version
+        )
+        .values(
+            status="assigned",
+            driver_id=driver_id,
+            port=port,
+            container_name=f"ride-{ride_id}" if port else None,
+            version=models.RideQueue.version + 1
+        ),
+        execution_options={"synchronize_session": False}
+    ).rowcount == 1
+    if not claimed:
+        db.rollback()
+        if port:
+            release_port(port)
+        metrics.incr("rides.accept_taken")
+        return {"error": "Ride no longer available", "status": "taken"}
     
     # Accept this request
     ride_request.status = "accepted"
     ride_request.responded_at = datetime.utcnow()
     
-    # Reject all other requests for this ride
-    other_requests = db.query(models.RideRequest).filter(
-        models.RideRequest.ride_id == ride.id,
-        models.RideRequest.id != request_id,
-        models.RideRequest.status == "pending"
+    # Expire all other requests for this ride
+    expired = db.scalars(
+        update(models.RideRequest)
+        .where(
+            models.RideRequest.ride_id == ride_id,
+            models.RideRequest.id != request_id,
+            models.RideRequest.status == "pending"
+        )
+        .values(status="expired", responded_at=datetime.utcnow())
+        .returning(models.RideRequest.id),
+        execution_options={"synchronize_session": False}
     ).all()
-    for req in other_requests:
-        req.status = "expired"
-        req.responded_at = datetime.utcnow()
-    
-    # Assign ride to driver
-    ride.driver_id = driver_id
-    ride.status = "assigned"
-    ride.port = get_next_available_port()
-    ride.container_name = f"ride-{ride.id}"
     
     driver = db.query(models.Driver).filter(models.Driver.id == driver_id).first()
     if driver:
         driver.status = "on_trip"
     
+    events.record(db, "request", ride_request.id, "accepted", status="accepted")
+    events.record_many(db, "request", "expired", [(req_id, {"status": "expired"}) for req_id in expired])
+    events.record(db, "ride", ride_id, "assigned", status="assigned", driver_id=driver_id, port=port)
+    if driver:
+        events.record(db, "driver", driver.id, "on_trip", status="on_trip")
     db.commit()
+    metrics.incr("rides.accepted")
+    driver_tracks.start_ride(ride_id, driver_id)
     
-    # Create container
-    create_ride_container(ride.id, ride.port)
+    if port:
+        create_ride_container(ride_id, port)
     
     # Auto-complete ride after 1 minute
-    def finish_trip(driver_id, ride_id, ride_port):
-        time.sleep(60)
-        thread_db = SessionLocal()
-        try:
-            driver = thread_db.query(models.Driver).filter(models.Driver.id == driver_id).first()
-            ride = thread_db.query(models.RideQueue).filter(models.RideQueue.id == ride_id).first()
-            if driver and ride:
-                if driver.status == "on_trip":
-                    driver.status = "online"
-                ride.status = "completed"
-                thread_db.commit()
-                remove_ride_container(ride_id, ride_port)
-        finally:
-            thread_db.close()
-    
-    threading.Thread(target=finish_trip, args=(driver_id, ride.id, ride.port)).start()
+    trip_scheduler.schedule(ride_id, driver_id, port, TRIP_DURATION_SECONDS)
     
     return {
         "message": "Ride accepted",
-        "ride_id": ride.id,
-        "ride_port": ride.port,
-        "ride_url": f"http://localhost:{ride.port}"
+        "ride_id": ride_id,
+        "ride_port": port,
+        "ride_url": ride_url(ride_id, port)
     }
 
 @app.post("/reject-ride-request/{request_id}")
@@ -564,6 +771,7 @@ def reject_ride_request(request_id: int, driver_id: int, db: Session = Depends(g
     
     ride_request.status = "rejected"
     ride_request.responded_at = datetime.utcnow()
+    events.record(db, "request", ride_request.id, "rejected", status="rejected")
     db.commit()
     
     # Check if all drivers rejected
@@ -574,11 +782,27 @@ def reject_ride_request(request_id: int, driver_id: int, db: Session = Depends(g
         ).all()
         if all(req.status in ["rejected", "expired"] for req in all_requests):
             ride.status = "no_drivers"
+            events.record(db, "ride", ride.id, "no_drivers", status="no_drivers")
             db.commit()
     
     return {"message": "Ride rejected"}
 
 
+# ------------------ GEOCODING ------------------
+
+@app.get("/geocode")
+def geocode_place(q: str):
+    """Coordinates for a place name, from the local gazetteer"""
+    place = geocoder.geocode(q)
+    if place is None:
+        return {"error": "Location not found"}
+    return place
+
+@app.get("/autocomplete")
+def autocomplete_places(q: str, limit: int = 5):
+    """Place suggestions for a partially typed name"""
+    return geocoder.autocomplete(q, limit)
+
 # ------------------ COUPONS ------------------
 
 @app.post("/create-coupon")
@@ -587,14 +811,24 @@ def create_coupon(coupon: schemas.CouponCreate, db: Session = Depends(get_db)):
     db.add(coupon_db)
     db.commit()
     db.refresh(coupon_db)
+    catalog_cache.bump("coupons", "coupon_zones")
     return {"message": "Coupon created 🎟️", "coupon_id": coupon_db.id, "code": coupon_db.code}
 
-@app.get("/coupons")
-def get_all_coupons(db: Session = Depends(get_db)):
-    return db.query(models.Coupon).filter(models.Coupon.is_active == True).all()
+@app.get("/coupons", response_model=List[schemas.CouponOut])
+def get_all_coupons(request: Request, db: Session = Depends(get_db)):
+    return catalog_cache.cached(request, "coupons", ["coupons"], lambda: rows_json(
+        db.query(*columns(models.Coupon, schemas.CouponOut)).filter(models.Coupon.is_active == True)
+    ))
 
 @app.get("/user-coupons/{user_id}")
-def get_user_coupons(user_id: int, location: str = None, db: Session = Depends(get_db)):
+def get_user_coupons(user_id: int, request: Request, location: str = None, db: Session = Depends(get_db)):
+    return catalog_cache.cached(
+        request, f"user-coupons:{user_id}:{location}",
+        ["coupons", "user_coupons", f"user_coupons:{user_id}"],
+        lambda: dumps(list_user_coupons(db, user_id, location)),
+    )
+
+def list_user_coupons(db: Session, user_id: int, location: str = None):
     from datetime import datetime
     
     # Get all active coupons
@@ -603,10 +837,11 @@ def get_user_coupons(user_id: int, location: str = None, db: Session = Depends(g
         models.Coupon.valid_until > datetime.utcnow()
     )
     
-    # Filter by location if provided
+    # Filter by location if provided, with the same zone matching as validation
     if location:
+        zoned = zone_matcher.coupons_for(db, location)
         query = query.filter(
-            (models.Coupon.zone == None) | (models.Coupon.zone == location)
+            (models.Coupon.zone == None) | models.Coupon.id.in_(zoned)
         )
     
     coupons = query.all()
@@ -639,6 +874,8 @@ def get_user_coupons(user_id: int, location: str = None, db: Session = Depends(g
                     "usage_limit": coupon.per_user_limit
                 })
     
+    # The list shrinks as soon as a coupon runs out, without any write
+    catalog_cache.expire_at("coupons", min((c.valid_until for c in coupons), default=None))
     return available_coupons
 
 @app.post("/validate-coupon")
@@ -663,7 +900,7 @@ def validate_and_apply_coupon(db: Session, user_id: int, code: str, fare: float,
     if fare < coupon.min_fare:
         return {"valid": False, "message": f"Minimum fare ₹{coupon.min_fare} required", "discount": 0}
     
-    if coupon.zone and location and coupon.zone.lower() not in location.lower():
+    if coupon.zone and location and coupon.id not in zone_matcher.coupons_for(db, location):
         return {"valid": False, "message": f"Coupon valid only in {coupon.zone}", "discount": 0}
     
     if coupon.total_usage_limit and coupon.usage_count >= coupon.total_usage_limit:
@@ -699,6 +936,8 @@ def validate_and_apply_coupon(db: Session, user_id: int, code: str, fare: float,
 
 # ------------------ MERCHANTS ------------------
 
+merchant_offers = offer_cache.OfferCache()  # nearby merchant coupons per destination cell
+
 @app.post("/register-merchant")
 def register_merchant(merchant: schemas.MerchantCreate, response: Response = None, db: Session = Depends(get_db)):
     if response:
@@ -711,6 +950,7 @@ def register_merchant(merchant: schemas.MerchantCreate, response: Response = Non
     db.add(merchant_db)
     db.commit()
     db.refresh(merchant_db)
+    catalog_cache.bump("merchants")
     return {"message": "Merchant registered", "merchant_id": merchant_db.id, "name": merchant_db.name, "business_type": merchant_db.business_type}
 
 @app.post("/merchant-login")
@@ -742,71 +982,62 @@ def create_merchant_coupon(coupon: schemas.MerchantCouponCreate, db: Session = D
     db.add(coupon_db)
     db.commit()
     db.refresh(coupon_db)
+    catalog_cache.bump(f"merchant_coupons:{coupon.merchant_id}", "merchant_offers")
     return {"message": "Merchant coupon created", "coupon_id": coupon_db.id}
 
 @app.get("/nearby-merchant-coupons")
-def get_nearby_merchant_coupons(user_id: int, dest_lat: float, dest_lng: float, db: Session = Depends(get_db)):
+def get_nearby_merchant_coupons(user_id: int, dest_lat: float, dest_lng: float, db: Session = Depends(get_read_db)):
     """Get merchant coupons near destination based on user eligibility"""
     
-    # Get user stats
-    user_rides = db.query(models.RideQueue).filter(
-        models.RideQueue.user_id == user_id,
-        models.RideQueue.status == "completed"
-    ).all()
+    # The merchant side is shared by everyone heading to the same cell; the
+    # cache builds it from the primary so a new coupon is never cached missing
+    offers = merchant_offers.offers(dest_lat, dest_lng, SessionLocal)
+    if not offers:
+        return []
     
-    total_rides = len(user_rides)
-    total_spent = sum(ride.final_fare for ride in user_rides)
-    
-    # Get all active merchant coupons
-    all_coupons = db.query(models.MerchantCoupon).filter(
-        models.MerchantCoupon.is_active == True,
-        models.MerchantCoupon.valid_until > datetime.utcnow()
-    ).all()
+    # Get user stats
+    total_rides, total_spent = user_stats.get(db, user_id)
+    redeemed = {row.merchant_coupon_id for row in db.query(models.CouponRedemption.merchant_coupon_id).filter(
+        models.CouponRedemption.user_id == user_id,
+        models.CouponRedemption.merchant_coupon_id.in_([offer.coupon_id for offer in offers])
+    )}
+    now = datetime.utcnow()
     
     eligible_coupons = []
-    for coupon in all_coupons:
-        merchant = db.query(models.Merchant).filter(models.Merchant.id == coupon.merchant_id).first()
-        if not merchant or not merchant.is_active:
-            continue
-        
+    for offer in offers:
         # Check distance
-        distance = calculate_distance(dest_lat, dest_lng, merchant.latitude, merchant.longitude)
-        if distance > coupon.radius_km:
+        distance = geo.distance_km(dest_lat, dest_lng, offer.latitude, offer.longitude)
+        if distance > offer.radius_km or offer.valid_until <= now:
             continue
         
         # Check eligibility
-        if total_rides < coupon.min_rides_required:
+        if total_rides < offer.min_rides_required:
             continue
-        if total_spent < coupon.min_fare_spent:
+        if total_spent < offer.min_fare_spent:
             continue
         
         # Check usage limit
-        if coupon.usage_limit and coupon.usage_count >= coupon.usage_limit:
+        if offer.usage_limit and offer.usage_count >= offer.usage_limit:
             continue
         
         # Check if user already redeemed
-        already_redeemed = db.query(models.CouponRedemption).filter(
-            models.CouponRedemption.user_id == user_id,
-            models.CouponRedemption.merchant_coupon_id == coupon.id
-        ).first()
-        
-        if already_redeemed:
+        if offer.coupon_id in redeemed:
             continue
         
         eligible_coupons.append({
-            "coupon_id": coupon.id,
-            "code": coupon.code,
-            "title": coupon.title,
-            "description": coupon.description,
-            "discount_type": coupon.discount_type,
-            "discount_value": coupon.discount_value,
-            "max_discount": coupon.max_discount,
-            "min_purchase": coupon.min_purchase,
-            "merchant_name": merchant.name,
-            "merchant_type": merchant.business_type,
-            "merchant_address": merchant.address,
+            "coupon_id": offer.coupon_id,
+            "code": offer.code,
+            "title": offer.title,
+            "description": offer.description,
+            "discount_type": offer.discount_type,
+            "discount_value": offer.discount_value,
+            "max_discount": offer.max_discount,
+            "min_purchase": offer.min_purchase,
+            "merchant_name": offer.merchant_name,
+            "merchant_type": offer.merchant_type,
+            "merchant_address": offer.merchant_address,
             "distance_km": round(distance, 2),
-            "valid_until": coupon.valid_until
+            "valid_until": offer.valid_until
         })
     
     # Sort by distance
@@ -828,19 +1059,24 @@ def redeem_merchant_coupon(user_id: int, coupon_id: int, ride_id: int, db: Sessi
     db.add(redemption)
     coupon.usage_count += 1
     db.commit()
+    catalog_cache.bump(f"merchant_coupons:{coupon.merchant_id}", "merchant_offers")
     
     return {"message": "Coupon redeemed successfully"}
 
-@app.get("/merchant-coupons/{merchant_id}")
-def get_merchant_coupons(merchant_id: int, db: Session = Depends(get_db)):
+@app.get("/merchant-coupons/{merchant_id}", response_model=List[schemas.MerchantCouponOut])
+def get_merchant_coupons(merchant_id: int, request: Request, db: Session = Depends(get_db)):
     """Get all coupons for a merchant"""
-    coupons = db.query(models.MerchantCoupon).filter(
+    coupons = db.query(*columns(models.MerchantCoupon, schemas.MerchantCouponOut)).filter(
         models.MerchantCoupon.merchant_id == merchant_id
-    ).order_by(models.MerchantCoupon.created_at.desc()).all()
-    return coupons
+    ).order_by(models.MerchantCoupon.created_at.desc())
+    return catalog_cache.cached(
+        request, f"merchant-coupons:{merchant_id}",
+        ["merchant_coupons", f"merchant_coupons:{merchant_id}"],
+        lambda: rows_json(coupons),
+    )
 
 @app.get("/merchant-analytics/{merchant_id}")
-def get_merchant_analytics(merchant_id: int, db: Session = Depends(get_db)):
+def get_merchant_analytics(merchant_id: int, db: Session = Depends(get_read_db)):
     """Get analytics for merchant dashboard"""
     coupons = db.query(models.MerchantCoupon).filter(
         models.MerchantCoupon.merchant_id == merchant_id
@@ -927,7 +1163,7 @@ def get_merchant_analytics(merchant_id: int, db: Session = Depends(get_db)):
     }
 
 @app.get("/merchant-redemptions/{merchant_id}")
-def get_merchant_redemptions(merchant_id: int, db: Session = Depends(get_db)):
+def get_merchant_redemptions(merchant_id: int, db: Session = Depends(get_read_db)):
     """Get all redemptions for merchant coupons"""
     redemptions = db.query(models.CouponRedemption).join(
         models.MerchantCoupon
@@ -961,6 +1197,7 @@ def toggle_merchant_coupon(coupon_id: int, is_active: bool, db: Session = Depend
     
     coupon.is_active = is_active
     db.commit()
+    catalog_cache.bump(f"merchant_coupons:{coupon.merchant_id}", "merchant_offers")
     return {"message": "Coupon updated"}
 
 @app.delete("/delete-merchant-coupon/{coupon_id}")
@@ -975,15 +1212,18 @@ def delete_merchant_coupon(coupon_id: int, db: Session = Depends(get_db)):
         models.CouponRedemption.merchant_coupon_id == coupon_id
     ).delete()
     
+    merchant_id = coupon.merchant_id
     db.delete(coupon)
     db.commit()
+    catalog_cache.bump(f"merchant_coupons:{merchant_id}", "merchant_offers")
     return {"message": "Coupon deleted"}
 
-@app.get("/all-merchants")
-def get_all_merchants(db: Session = Depends(get_db)):
+@app.get("/all-merchants", response_model=List[schemas.MerchantOut])
+def get_all_merchants(request: Request, db: Session = Depends(get_db)):
     """Get all merchants for admin"""
-    merchants = db.query(models.Merchant).all()
-    return merchants
+    return catalog_cache.cached(request, "all-merchants", ["merchants"], lambda: rows_json(
+        db.query(*columns(models.Merchant, schemas.MerchantOut))
+    ))
 
 @app.put("/update-merchant/{merchant_id}")
 def update_merchant(merchant_id: int, merchant: schemas.MerchantCreate, db: Session = Depends(get_db)):
@@ -996,6 +1236,7 @@ def update_merchant(merchant_id: int, merchant: schemas.MerchantCreate, db: Sess
         setattr(merchant_db, key, value)
     
     db.commit()
+    catalog_cache.bump("merchants")
     return {"message": "Merchant updated"}
 
 @app.delete("/delete-merchant/{merchant_id}")
@@ -1015,11 +1256,44 @@ def delete_merchant(merchant_id: int, db: Session = Depends(get_db)):
     
     db.delete(merchant)
     db.commit()
+    catalog_cache.bump("merchants", f"merchant_coupons:{merchant_id}")
     return {"message": "Merchant deleted"}
 
+# ------------------ BULK IMPORT ------------------
+
+async def _bulk_register(entity: str, request: Request, format: str = None):
+    try:
+        fmt = bulk_import.detect_format(request.headers.get("content-type"), format)
+        body = (await request.body()).decode("utf-8")
+        result = await run_in_threadpool(bulk_import.import_text, entity, body, fmt)
+        catalog_cache.bump(entity)
+        if entity == "drivers" and dispatcher.running:
+            # Bulk loads log no events for the dispatch pool to follow
+            with SessionLocal() as db:
+                await run_in_threadpool(dispatcher.load_drivers, db, result["ids"])
+        return result
+    except (bulk_import.BulkImportError, UnicodeDecodeError) as e:
+        return {"error": str(e)}
+
+@app.post("/bulk-register-users")
+async def bulk_register_users(request: Request, format: str = None):
+    """Create many users from a CSV or NDJSON body; existing emails are skipped"""
+    return await _bulk_register("users", request, format)
+
+@app.post("/bulk-register-drivers")
+async def bulk_register_drivers(request: Request, format: str = None):
+    """Create many drivers from a CSV or NDJSON body; existing emails are skipped"""
+    return await _bulk_register("drivers", request, format)
+
+@app.post("/bulk-register-merchants")
+async def bulk_register_merchants(request: Request, format: str = None):
+    """Create many merchants from a CSV or NDJSON body; existing emails are skipped"""
+    return await _bulk_register("merchants", request, format)
+
 @app.post("/simulate-ride-with-driver")
 def simulate_ride_with_driver(user_id: int, driver_id: int, db: Session = Depends(get_db)):
     """Directly create and assign a ride to a specific driver for simulation"""
+    port = get_next_available_port() if RIDE_PAGE_MODE == "container" else None
     try:
         # Create ride
         ride_db = models.RideQueue(
@@ -1035,71 +1309,141 @@ def simulate_ride_with_driver(user_id: int, driver_id: int, db: Session = Depend
             discount=0.0,
             final_fare=100.0,
             driver_id=driver_id,
-            port=get_next_available_port(),
+            port=port,
             container_name=None
         )
         db.add(ride_db)
-        db.commit()
-        db.refresh(ride_db)
+        db.flush()
         
-        ride_db.container_name = f"ride-{ride_db.id}"
+        if ride_db.port:
+            ride_db.container_name = f"ride-{ride_db.id}"
+        events.record(db, "ride", ride_db.id, "created", **events.ride_fields(ride_db))
         db.commit()
         
-        # Create container
-        create_ride_container(ride_db.id, ride_db.port)
+        if ride_db.port:
+            create_ride_container(ride_db.id, ride_db.port)
         
         # Auto-complete after 60 seconds
-        def finish_trip(driver_id, ride_id, ride_port):
-            time.sleep(60)
-            thread_db = SessionLocal()
-            try:
-                ride = thread_db.query(models.RideQueue).filter(models.RideQueue.id == ride_id).first()
-                if ride:
-                    ride.status = "completed"
-                    thread_db.commit()
-                    remove_ride_container(ride_id, ride_port)
-            finally:
-                thread_db.close()
-        
-        threading.Thread(target=finish_trip, args=(driver_id, ride_db.id, ride_db.port)).start()
+        driver_tracks.start_ride(ride_db.id, driver_id)
+        trip_scheduler.schedule(ride_db.id, driver_id, ride_db.port, TRIP_DURATION_SECONDS)
         
         return {
             "message": "Ride created",
             "ride_id": ride_db.id,
             "port": ride_db.port,
-            "container_name": ride_db.container_name
+            "container_name": ride_db.container_name,
+            "ride_url": ride_url(ride_db.id, ride_db.port)
         }
     except Exception as e:
         db.rollback()
         return {"error": str(e)}
 
+def simulator_rider(db: Session):
+    """Id of the rider simulated batches book as, created on first use"""
+    rider_id = db.scalar(select(models.User.id).where(models.User.email == SIMULATOR_RIDER_EMAIL))
+    if rider_id is None:
+        try:
+            with db.begin_nested():
+                rider = models.User(name="Simulator", email=SIMULATOR_RIDER_EMAIL)
+                db.add(rider)
+            rider_id = rider.id
+        except IntegrityError:  # created by a concurrent batch
+            rider_id = db.scalar(select(models.User.id).where(models.User.email == SIMULATOR_RIDER_EMAIL))
+    return rider_id
+
+@app.post("/simulate-rides-batch")
+def simulate_rides_batch(batch: schemas.SimulationBatch, db: Session = Depends(get_db)):
+    """Create many assigned rides across the given drivers in one transaction"""
+    if not batch.driver_ids or batch.user_ids == []:
+        return {"error": "driver_ids and user_ids must not be empty"}
+    if batch.rides < 1 or batch.rides > MAX_SIMULATED_RIDES:
+        return {"error": f"rides must be between 1 and {MAX_SIMULATED_RIDES}"}
+    if batch.trip_seconds < 0:
+        return {"error": "trip_seconds must not be negative"}
+
+    if batch.user_ids is None:
+        user_ids = [simulator_rider(db)]
+    else:
+        user_ids = batch.user_ids
+        known = set(db.scalars(select(models.User.id).where(models.User.id.in_(set(user_ids)))))
+        unknown = sorted(set(user_ids) - known)
+        if unknown:
+            return {"error": f"Unknown user_ids: {unknown}"}
+
+    rows = []
+    try:
+        for i in range(batch.rides):
+            port = get_next_available_port() if batch.use_containers else None
+            rows.append({
+                "user_id": user_ids[i % len(user_ids)],
+                "driver_id": batch.driver_ids[i % len(batch.driver_ids)],
+                "start": "Test Location A",
+                "destination": "Test Location B",
+                "pickup_lat": 28.6139 + (random.random() - 0.5) * 0.1,
+                "pickup_lng": 77.2090 + (random.random() - 0.5) * 0.1,
+                "dest_lat": 28.6315 + (random.random() - 0.5) * 0.1,
+                "dest_lng": 77.2167 + (random.random() - 0.5) * 0.1,
+                "status": "assigned",
+                "fare": 100.0,
+                "discount": 0.0,
+                "final_fare": 100.0,
+                "port": port,
+                "created_at": datetime.utcnow()
+            })
+
+        ride_ids = db.scalars(
+            insert(models.RideQueue).returning(models.RideQueue.id, sort_by_parameter_order=True),
+            rows
+        ).all()
+        if batch.use_containers:
+            db.execute(update(models.RideQueue), [
+                {"id": ride_id, "container_name": f"ride-{ride_id}"} for ride_id in ride_ids
+            ])
+        on_trip = db.scalars(
+            update(models.Driver)
+            .where(models.Driver.id.in_(batch.driver_ids), models.Driver.status == "online")
+            .values(status="on_trip")
+            .returning(models.Driver.id),
+            execution_options={"synchronize_session": False}
+        ).all()
+        events.record_many(db, "ride", "created", [
+            (ride_id, {name: row.get(name) for name in events.RIDE_FIELDS})
+            for ride_id, row in zip(ride_ids, rows)
+        ])
+        events.record_many(db, "driver", "on_trip", [(driver_id, {"status": "on_trip"}) for driver_id in on_trip])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        for row in rows:
+            if row["port"]:
+                release_port(row["port"])
+        return {"error": str(e)}
+
+    trips = [(ride_id, row["driver_id"], row["port"]) for ride_id, row in zip(ride_ids, rows)]
+    if batch.use_containers:
+        for ride_id, _, port in trips:
+            create_ride_container(ride_id, port)
+    trip_scheduler.schedule_many(trips, batch.trip_seconds)
+
+    return {
+        "message": "Rides created",
+        "count": len(ride_ids),
+        "ride_ids": ride_ids,
+        "containers": batch.use_containers,
+        "completes_in_seconds": batch.trip_seconds
+    }
+
 @app.post("/cleanup-simulation-data")
-def cleanup_simulation_data(db: Session = Depends(get_db)):
+def cleanup_simulation_data():
     """Delete all simulation test data (users, drivers, rides created by simulator)"""
     try:
-        # Delete users with test emails
-        deleted_users = db.query(models.User).filter(
-            models.User.email.like('%@test.com')
-        ).delete(synchronize_session=False)
-        
-        # Delete drivers with test emails
-        deleted_drivers = db.query(models.Driver).filter(
-            models.Driver.email.like('%@test.com')
-        ).delete(synchronize_session=False)
-        
-        # Delete ride requests for deleted users/drivers
-        db.query(models.RideRequest).delete(synchronize_session=False)
-        
-        # Delete user coupons for deleted users
-        db.query(models.UserCoupon).delete(synchronize_session=False)
-        
-        # Delete coupon redemptions for deleted users
-        db.query(models.CouponRedemption).delete(synchronize_session=False)
-        
-        # Delete rides for deleted users
-        deleted_rides = db.query(models.RideQueue).delete(synchronize_session=False)
-        
-        db.commit()
+        # Children before parents, each table in short primary-key batches
+        retention.purge("ride_requests", pause=0)
+        retention.purge("user_coupons", pause=0)
+        retention.purge("coupon_redemptions", pause=0)
+        deleted_rides = retention.purge("ride_queue", pause=0)
+        deleted_users = retention.purge("users", models.User.email.like('%@test.com'), pause=0)
+        deleted_drivers = retention.purge("drivers", models.Driver.email.like('%@test.com'), pause=0)
         
         return {
             "message": "Simulation data cleaned up successfully",
@@ -1108,9 +1452,141 @@ def cleanup_simulation_data(db: Session = Depends(get_db)):
             "deleted_rides": deleted_rides
         }
     except Exception as e:
-        db.rollback()
         return {"error": f"Cleanup failed: {str(e)}"}
 
+# ------------------ CHANGES ------------------
+
+@app.get("/changes")
+def get_changes(since: int = None, limit: int = 1000, db: Session = Depends(get_read_db)):
+    """Ride, request and driver events after the `since` cursor; without it, just the current cursor"""
+    if since is None:
+        return {"events": [], "cursor": events.head(db), "has_more": False, "reset": False}
+    return events.changes(db, since, limit)
+
+# ------------------ ADMIN ------------------
+
+STATS_PERIODS = {"hour": timedelta(hours=1), "24h": timedelta(hours=24), "7d": timedelta(days=7), "30d": timedelta(days=30)}
+
+@app.get("/admin/stats")
+def get_admin_stats(period: str = "today", since: datetime = None, until: datetime = None, zone: int = None,
+                    by_zone: bool = False, db: Session = Depends(get_read_db)):
+    """Ride totals for a time range from the minute rollups, with rides in progress and online drivers"""
+    now = datetime.utcnow()
+    if since is not None or until is not None:
+        period = "custom"
+    elif period == "today":
+        since = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif period in STATS_PERIODS:
+        since = now - STATS_PERIODS[period]
+    elif period != "all":
+        return {"error": f"period must be one of today, all, {', '.join(STATS_PERIODS)}"}
+    stats = ride_rollups.stats(db, since, until, zone, by_zone)
+    stats["online_drivers"] = db.query(func.count(models.Driver.id)).filter(models.Driver.status == "online").scalar()
+    return {"period": period, "since": since, "until": until, "zone": zone, **stats}
+
+# ------------------ HEALTH ------------------
+
+STARTED_AT = time.monotonic()
+database_state = {"ready": False, "checked_at": None, "last_error": None}
+
+def check_database():
+    """Ping the database and record whether it answered"""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        database_state.update(ready=True, last_error=None)
+    except Exception as e:
+        database_state.update(ready=False, last_error=str(e))
+    database_state["checked_at"] = datetime.utcnow().isoformat()
+    return database_state["ready"]
+
+def wait_for_database(interval: float = 1):
+    """Retry in the background until the database is reachable"""
+    while not check_database():
+        print(f"⏳ Waiting for database... ({database_state['last_error']})")
+        time.sleep(interval)
+    print("✅ Database connected successfully")
+
+def pool_status():
+    pool = engine.pool
+    status = {"class": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok", "uptime_seconds": round(time.monotonic() - STARTED_AT, 3)}
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """Readiness: the database answers and the trip scheduler is running"""
+    database_ready = check_database()
+    ready = database_ready and trip_scheduler.running
+    if not ready:
+        response.status_code = 503
+    return {
+        "status": "ready" if ready else "not_ready",
+        "database": database_state,
+        "pool": pool_status(),
+        "scheduler": {"running": trip_scheduler.running, "pending": trip_scheduler.pending},
+    }
+
+# ------------------ MAINTENANCE ------------------
+
+retention_worker = retention.RetentionWorker()
+history_flusher = location_history.HistoryFlusher(driver_tracks)
+rollup_worker = ride_rollups.RollupWorker(SessionLocal)
+partition_maintainer = partitioning.PartitionMaintainer()
+
+@app.on_event("startup")
+def start_background_services():
+    # Never block boot on the database; /readyz reports when it is reachable
+    threading.Thread(target=wait_for_database, name="db-wait", daemon=True).start()
+    trip_scheduler.start()
+    retention_worker.start()
+    history_flusher.start()
+    rollup_worker.start()
+    dispatcher.start()
+    if RIDE_PAGE_MODE == "container":
+        container_inventory.start()
+    # Compiling an uncached extract can take a while; bookings use distance until it is ready
+    threading.Thread(target=road_network.get_network, name="road-network", daemon=True).start()
+    if os.getenv("PARTITIONING") == "1" and engine.dialect.name == "postgresql":
+        partition_maintainer.start()
+
+@app.on_event("shutdown")
+def stop_background_services():
+    trip_scheduler.stop()
+    retention_worker.stop()
+    history_flusher.stop()
+    rollup_worker.stop()
+    dispatcher.stop()
+    partition_maintainer.stop()
+    container_inventory.stop()
+
+@app.get("/retention/status")
+def get_retention_status():
+    """Retention policies and per-table purge progress"""
+    return retention.status()
+
+@app.post("/retention/run")
+def run_retention():
+    """Apply the retention policies now, in the background"""
+    retention_worker.trigger()
+    return {"message": "Retention run started", "status": retention.status()}
+
+@app.get("/dispatch/status")
+def get_dispatch_status():
+    """Zone layout and what each dispatch worker holds"""
+    return dispatcher.stats()
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
+
 # ------------------ HELPER ------------------
 
 def assign_pending_rides(db: Session):
@@ -1123,36 +1599,58 @@ def assign_pending_rides(db: Session):
             ride.status = "assigned"
             driver.status = "on_trip"
             
-            # Use existing port if already allocated, otherwise get new one
-            if not ride.port:
+            # Container mode: reuse an allocated port, otherwise get a new one
+            if not ride.port and RIDE_PAGE_MODE == "container":
                 ride.port = get_next_available_port()
                 ride.container_name = f"ride-{ride.id}"
                 create_ride_container(ride.id, ride.port)
             
-            ride_port = ride.port
+            events.record(db, "ride", ride.id, "assigned", status="assigned", driver_id=driver.id, port=ride.port)
+            events.record(db, "driver", driver.id, "on_trip", status="on_trip")
             db.commit()
 
-            def finish_trip(driver_id, ride_id, ride_port, duration=1):
-                time.sleep(duration * 60)
-                
-                # Get fresh DB session for the thread
-                thread_db = SessionLocal()
-                try:
-                    driver = thread_db.query(models.Driver).filter(models.Driver.id == driver_id).first()
-                    ride = thread_db.query(models.RideQueue).filter(models.RideQueue.id == ride_id).first()
-                    
-                    if driver and ride:
-                        # Only set driver online if they were on_trip, not if they went offline
-                        if driver.status == "on_trip":
-                            driver.status = "online"
-                        ride.status = "completed"
-                        thread_db.commit()
-                        
-                        # Remove the ride container
-                        remove_ride_container(ride_id, ride_port)
-                        
-                        assign_pending_rides(thread_db)
-                finally:
-                    thread_db.close()
-
-            threading.Thread(target=finish_trip, args=(driver.id, ride.id, ride_port, 1)).start()
+            driver_tracks.start_ride(ride.id, driver.id)
+            trip_scheduler.schedule(ride.id, driver.id, ride.port, TRIP_DURATION_SECONDS)
+
+
+def complete_trips(trips):
+    """Complete a batch of due (ride_id, driver_id, port) trips in one transaction"""
+    ride_ids = [ride_id for ride_id, _, _ in trips]
+    driver_ids = [driver_id for _, driver_id, _ in trips if driver_id]
+
+    db = SessionLocal()
+    try:
+        finished = db.execute(
+            update(models.RideQueue)
+            .where(models.RideQueue.id.in_(ride_ids), models.RideQueue.status == "assigned")
+            .values(status="completed")
+            .returning(models.RideQueue.id, models.RideQueue.user_id, models.RideQueue.final_fare),
+            execution_options={"synchronize_session": False}
+        ).all()
+        completed = [ride.id for ride in finished]
+        user_stats.rides_completed(db, [(ride.user_id, ride.final_fare) for ride in finished])
+        # Only set drivers online if they were on_trip, not if they went offline
+        back_online = db.execute(
+            update(models.Driver)
+            .where(models.Driver.id.in_(driver_ids), models.Driver.status == "on_trip")
+            .values(status="online")
+            .returning(models.Driver.id, *[getattr(models.Driver, name) for name in events.DRIVER_FIELDS]),
+            execution_options={"synchronize_session": False}
+        ).all()
+        events.record_many(db, "ride", "completed", [(ride_id, {"status": "completed"}) for ride_id in completed])
+        events.record_many(db, "driver", "online", [
+            (driver.id, {name: getattr(driver, name) for name in events.DRIVER_FIELDS}) for driver in back_online
+        ])
+        db.commit()
+        driver_tracks.end_rides(completed)
+
+        for ride_id, _, ride_port in trips:
+            if ride_port:
+                remove_ride_container(ride_id, ride_port)
+
+        assign_pending_rides(db)
+    finally:
+        db.close()
+
+
+trip_scheduler = TripScheduler(complete_trips)
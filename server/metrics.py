@@ -0,0 +1,33 @@
+"""
+Process-local counters and gauges, served as JSON from /metrics.
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def incr(name: str, value: float = 1):
+    """Add `value` to a monotonically increasing counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value):
+    """Record the current value of something that goes up and down"""
+    with _lock:
+        _gauges[name] = value
+
+
+def get(name: str, default=0):
+    with _lock:
+        if name in _counters:
+            return _counters[name]
+        return _gauges.get(name, default)
+
+
+def snapshot():
+    with _lock:
+        return {"counters": dict(_counters), "gauges": dict(_gauges)}
@@ -0,0 +1,110 @@
+"""
+Schema migrations, run once before the API starts.
+
+  python migrate.py
+
+Waits for the database, creates missing tables, adds columns and indexes that
+were added to the models after a table was first created, fills in geohashes
+for rows that predate that column, builds user_stats and ride_rollups when
+those tables are new, and (with PARTITIONING=1 on Postgres) converts the
+ride tables to partitioned tables.
+Importing the API never touches the schema; this script is the only place
+that does.
+"""
+
+import os
+import time
+
+from sqlalchemy import inspect, text
+
+from db import engine
+import geo
+import models
+import ride_rollups
+import user_stats
+
+CONNECT_RETRIES = int(os.getenv("MIGRATE_CONNECT_RETRIES", "30"))
+CONNECT_DELAY_SECONDS = float(os.getenv("MIGRATE_CONNECT_DELAY_SECONDS", "1"))
+
+
+def wait_for_database(bind=None, retries: int = CONNECT_RETRIES, delay: float = CONNECT_DELAY_SECONDS):
+    """Block until the database accepts connections"""
+    bind = bind or engine
+    for attempt in range(1, retries + 1):
+        try:
+            with bind.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            return
+        except Exception as e:
+            if attempt == retries:
+                print(f"❌ Database connection failed: {e}")
+                raise
+            print(f"⏳ Waiting for database... ({attempt}/{retries})")
+            time.sleep(delay)
+
+
+def _column_ddl(conn, column):
+    ddl = f"{column.name} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        if not isinstance(default, str):
+            default = default.compile(dialect=conn.dialect)
+        ddl += f" DEFAULT {default}"
+    return ddl
+
+
+def add_missing_columns(bind=None):
+    """Add model columns and indexes that existing tables do not have yet"""
+    bind = bind or engine
+    added = []
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in models.Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {_column_ddl(conn, column)}"))
+                    added.append(f"{table.name}.{column.name}")
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+                    added.append(index.name)
+    return added
+
+
+def migrate(bind=None):
+    """Bring the database schema up to date with the models"""
+    bind = bind or engine
+    wait_for_database(bind)
+    new_tables = set(models.Base.metadata.tables) - set(inspect(bind).get_table_names())
+    models.Base.metadata.create_all(bind=bind)
+    if bind.dialect.name == "postgresql":
+        import partitioning
+
+        # Converted ride tables must own their index names before the check below looks for them
+        with bind.begin() as conn:
+            for table in partitioning.PARTITIONED_TABLES:
+                if partitioning.is_partitioned(conn, table):
+                    partitioning.adopt_indexes(conn, table)
+    for name in add_missing_columns(bind):
+        print(f"✅ Added {name}")
+    filled = geo.backfill(bind)
+    if filled:
+        print(f"✅ Geohashed {filled} drivers and merchants")
+    if "user_stats" in new_tables:
+        print(f"✅ Built ride stats for {user_stats.backfill(bind)} users")
+    if "ride_rollups" in new_tables:
+        print(f"✅ Rolled up {ride_rollups.backfill(bind)} rides")
+    if os.getenv("PARTITIONING") == "1" and bind.dialect.name == "postgresql":
+        import partitioning
+
+        partitioning.convert(bind)
+    print("✅ Database schema is up to date")
+
+
+if __name__ == "__main__":
+    migrate()
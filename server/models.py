@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float, Boolean, JSON, Text
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
@@ -34,6 +34,7 @@ class RideQueue(Base):
     final_fare = Column(Float, default=100.0)
     coupon_id = Column(Integer, ForeignKey("coupons.id"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # bumped on every claim
 
     user = relationship("User", back_populates="rides")
     driver = relationship("Driver", back_populates="rides")
@@ -47,6 +48,7 @@ class RideRequest(Base):
     ride_id = Column(Integer, ForeignKey("ride_queue.id"))
     driver_id = Column(Integer, ForeignKey("drivers.id"))
     status = Column(String, default="pending")  # pending, accepted, rejected, expired
+    eta_seconds = Column(Float, nullable=True)  # driver to pickup by road, when a road network is loaded
     created_at = Column(DateTime, default=datetime.utcnow)
     responded_at = Column(DateTime, nullable=True)
 
@@ -64,6 +66,8 @@ class Driver(Base):
     longitude = Column(Float, nullable=True)
     status = Column(String, default="offline")
     last_seen = Column(DateTime, default=datetime.utcnow)
+    fix_at = Column(DateTime, nullable=True)  # when the stored position was measured
+    geohash = Column(String, nullable=True, index=True)  # see geo.py
 
     rides = relationship("RideQueue", back_populates="driver")
 
@@ -110,6 +114,7 @@ class Merchant(Base):
     address = Column(String)
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(String, nullable=True, index=True)
     phone = Column(String, nullable=True)
     description = Column(String, nullable=True)
     is_active = Column(Boolean, default=True)
@@ -152,3 +157,60 @@ class CouponRedemption(Base):
     redeemed_at = Column(DateTime, default=datetime.utcnow)
 
     merchant_coupon = relationship("MerchantCoupon", back_populates="redemptions")
+
+class RideEvent(Base):
+    """Append-only log of ride, request and driver state transitions"""
+    __tablename__ = "ride_events"
+
+    id = Column(Integer, primary_key=True, index=True)  # sequence clients sync from
+    entity = Column(String)  # ride, request, driver
+    entity_id = Column(Integer, index=True)
+    event_type = Column(String)
+    payload = Column(JSON)  # fields that changed, including the new status
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class RidePathSegment(Base):
+    """A stretch of the route a driver took during a ride, flushed from memory"""
+    __tablename__ = "ride_path_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ride_id = Column(Integer, index=True)  # no foreign key: ride_queue may be partitioned
+    driver_id = Column(Integer)
+    seq = Column(Integer)  # order of the segment within the ride
+    points = Column(Integer)
+    polyline = Column(Text)  # encoded polyline, 1e-5 degree precision
+    offsets = Column(Text)  # seconds since started_at per point, encoded the same way
+    started_at = Column(DateTime)
+    ended_at = Column(DateTime)
+
+class UserStats(Base):
+    """Running totals of a user's completed rides, maintained by user_stats.py"""
+    __tablename__ = "user_stats"
+
+    user_id = Column(Integer, primary_key=True)  # no foreign key, like ride_queue.user_id once partitioned
+    completed_rides = Column(Integer, nullable=False, default=0, server_default="0")
+    total_spent = Column(Float, nullable=False, default=0.0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class RideRollup(Base):
+    """Ride counts and money per zone over one minute (or, once compacted, one hour)"""
+    __tablename__ = "ride_rollups"
+
+    bucket = Column(DateTime, primary_key=True)  # start of the minute or hour
+    span = Column(Integer, primary_key=True)  # minutes covered: 1 or 60
+    zone = Column(Integer, primary_key=True)  # dispatch zone of the pickup, -1 without coordinates
+    booked = Column(Integer, nullable=False, default=0, server_default="0")
+    assigned = Column(Integer, nullable=False, default=0, server_default="0")
+    completed = Column(Integer, nullable=False, default=0, server_default="0")
+    unfulfilled = Column(Integer, nullable=False, default=0, server_default="0")  # ended with no driver
+    revenue = Column(Float, nullable=False, default=0.0, server_default="0")  # final fares of completed rides
+    discounts = Column(Float, nullable=False, default=0.0, server_default="0")
+    active = Column(Integer, nullable=False, default=0, server_default="0")  # change in rides in progress
+
+class RollupCursor(Base):
+    """How far a rollup has read the ride event log"""
+    __tablename__ = "rollup_cursors"
+
+    name = Column(String, primary_key=True)
+    cursor = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,136 @@
+"""
+Merchant offers by destination cell.
+
+Riders bound for the same place ask /nearby-merchant-coupons the same
+question over and over. The merchant side of the answer (which active
+coupons are close enough to apply, and where their merchants are) only
+changes when a merchant or merchant coupon does, so it is computed once
+per geohash cell of the destination and kept here. A request then only
+measures its exact distance to each cached offer and applies the rider's
+own eligibility (rides taken, fare spent, prior redemption).
+
+A cell's offers include every coupon whose radius reaches any point of the
+cell, so the exact per-request distance check gives the same result as
+searching from the destination itself. Everything is dropped whenever the
+catalog_cache resources "merchants" or "merchant_offers" change; cells
+beyond OFFER_CACHE_CELLS are evicted least recently used first.
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+from sqlalchemy import func
+
+import catalog_cache
+import geo
+import metrics
+import models
+
+PRECISION = int(os.getenv("OFFER_CACHE_PRECISION", "6"))  # cells about 1.2 x 0.6 km
+MAX_CELLS = int(os.getenv("OFFER_CACHE_CELLS", "4096"))
+
+Offer = namedtuple("Offer", [
+    "coupon_id", "code", "title", "description", "discount_type", "discount_value", "max_discount",
+    "min_purchase", "merchant_name", "merchant_type", "merchant_address", "latitude", "longitude",
+    "radius_km", "valid_until", "min_rides_required", "min_fare_spent", "usage_limit", "usage_count",
+])
+
+
+def cell(lat: float, lng: float, precision: int = PRECISION):
+    """(geohash, centre latitude, centre longitude, km from the centre to a corner)"""
+    height, width = geo.cell_size(precision)
+    south = (lat + 90.0) // height * height - 90.0
+    west = (lng + 180.0) // width * width - 180.0
+    centre_lat, centre_lng = south + height / 2, west + width / 2
+    reach = max(geo.distance_km(centre_lat, centre_lng, south + dy, west + dx)
+                for dy in (0, height) for dx in (0, width))
+    return geo.encode(lat, lng, precision), centre_lat, centre_lng, reach
+
+
+def build_offers(db, lat: float, lng: float, reach_km: float):
+    """Active merchant coupons that apply somewhere within reach_km of a point"""
+    active = db.query(models.MerchantCoupon).filter(
+        models.MerchantCoupon.is_active == True,
+        models.MerchantCoupon.valid_until > datetime.utcnow()
+    )
+    widest_radius = active.with_entities(func.max(models.MerchantCoupon.radius_km)).scalar()
+    if not widest_radius:
+        return []
+    merchants = {
+        merchant.id: (merchant, distance) for merchant, distance in geo.nearest(
+            db.query(models.Merchant).filter(models.Merchant.is_active == True),
+            models.Merchant, lat, lng, max_km=widest_radius + reach_km
+        )
+    }
+    if not merchants:
+        return []
+    offers = []
+    for coupon in active.filter(models.MerchantCoupon.merchant_id.in_(list(merchants))):
+        merchant, distance = merchants[coupon.merchant_id]
+        if distance > coupon.radius_km + reach_km:
+            continue
+        offers.append(Offer(
+            coupon.id, coupon.code, coupon.title, coupon.description, coupon.discount_type,
+            coupon.discount_value, coupon.max_discount, coupon.min_purchase, merchant.name,
+            merchant.business_type, merchant.address, merchant.latitude, merchant.longitude,
+            coupon.radius_km, coupon.valid_until, coupon.min_rides_required, coupon.min_fare_spent,
+            coupon.usage_limit, coupon.usage_count,
+        ))
+    return offers
+
+
+class OfferCache:
+    def __init__(self, precision: int = PRECISION, max_cells: int = MAX_CELLS):
+        self.precision = precision
+        self.max_cells = max_cells
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cells = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def offers(self, lat: float, lng: float, session_factory):
+        """Offers for the cell containing a point, built with a new session on a miss"""
+        key, centre_lat, centre_lng, reach = cell(lat, lng, self.precision)
+        version = catalog_cache.etag("merchants", "merchant_offers")
+        with self._lock:
+            if version != self._version:
+                self._cells.clear()
+                self._version = version
+            found = self._cells.get(key)
+            if found is not None:
+                self._cells.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._publish()
+        if found is not None:
+            metrics.incr("offer_cache.hits")
+            return found
+        metrics.incr("offer_cache.misses")
+        # Built after reading the version, so a concurrent change can only
+        # leave this entry to be dropped early, never served stale
+        with session_factory() as db:
+            found = build_offers(db, centre_lat, centre_lng, reach)
+        with self._lock:
+            if version == self._version:
+                self._cells[key] = found
+                self._cells.move_to_end(key)
+                while len(self._cells) > self.max_cells:
+                    self._cells.popitem(last=False)
+                    self.evictions += 1
+                    metrics.incr("offer_cache.evictions")
+            self._publish()
+        return found
+
+    def _publish(self):
+        total = self.hits + self.misses
+        metrics.set_gauge("offer_cache.cells", len(self._cells))
+        metrics.set_gauge("offer_cache.hit_rate", round(self.hits / total, 4) if total else 0.0)
+
+    def clear(self):
+        with self._lock:
+            self._cells.clear()
@@ -0,0 +1,370 @@
+"""
+Time partitioning and cold archive for the ride tables (Postgres only).
+
+`convert` turns ride_queue and ride_requests into tables range-partitioned by
+created_at. The existing heap is attached unchanged as the first partition,
+so no rows are copied. `ensure_partitions` keeps PARTITION_AHEAD future
+partitions ready. `archive` detaches partitions older than ARCHIVE_AFTER_DAYS,
+exports them to compressed Parquet (or Arrow IPC) files and drops them.
+`read_archive` queries those files locally.
+
+USAGE:
+  python partitioning.py convert
+  python partitioning.py maintain
+  python partitioning.py archive --older-than-days 30
+  python partitioning.py read ride_queue --status completed
+"""
+
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, text
+
+from db import engine
+import models
+import ride_rollups
+
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "day")  # day or month
+PARTITION_AHEAD = int(os.getenv("PARTITION_AHEAD", "3"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))  # 0 disables archiving
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "parquet")  # parquet or arrow
+EXPORT_BATCH_SIZE = 50000
+DETACH_LOCK_TIMEOUT_MS = 2000
+
+# Converted in this order: ride_queue first, since ride_requests references it
+PARTITIONED_TABLES = {
+    "ride_queue": models.RideQueue,
+    "ride_requests": models.RideRequest,
+}
+
+_BOUND = re.compile(r"FROM \((MINVALUE|'[^']+')\) TO \((MAXVALUE|'[^']+')\)")
+
+
+def _period_start(moment: datetime):
+    if PARTITION_INTERVAL == "month":
+        return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_period(start: datetime):
+    if PARTITION_INTERVAL == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def _partition_name(table: str, start: datetime):
+    suffix = start.strftime("%Y%m") if PARTITION_INTERVAL == "month" else start.strftime("%Y%m%d")
+    return f"{table}_p{suffix}"
+
+
+def _parse_bound(value: str):
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def is_partitioned(conn, table: str):
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}
+    ).scalar()
+    return relkind == "p"
+
+
+def list_partitions(conn, table: str):
+    """(name, lower, upper) for every range partition; None means unbounded"""
+    rows = conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:t)
+    """), {"t": table}).all()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUND.search(bound or "")
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: p[1] or datetime.min)
+
+
+def adopt_indexes(conn, table: str):
+    """Give a partitioned parent the model's indexes, renaming any a partition still holds under those names"""
+    for index in PARTITIONED_TABLES[table].__table__.indexes:
+        owner = conn.execute(
+            text("SELECT indrelid::regclass::text FROM pg_index WHERE indexrelid = to_regclass(:i)"),
+            {"i": index.name}
+        ).scalar()
+        if owner == table:
+            continue
+        if owner is not None:
+            conn.execute(text(f"ALTER INDEX {index.name} RENAME TO {index.name.replace(table, owner, 1)}"))
+        # Matching indexes on the partitions are attached rather than rebuilt
+        index.create(conn)
+
+
+def convert(bind=None):
+    """Convert the ride tables to range partitioning by created_at, in place"""
+    bind = bind or engine
+    with bind.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            raise RuntimeError("Partitioning needs Postgres")
+
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(conn, table):
+                adopt_indexes(conn, table)
+                continue
+            legacy = f"{table}_legacy"
+            boundary = _next_period(_period_start(datetime.utcnow()))
+
+            # Foreign keys cannot point at a partitioned table's non-unique id
+            referencing = conn.execute(text("""
+                SELECT conrelid::regclass::text, conname FROM pg_constraint
+                WHERE contype = 'f' AND confrelid = to_regclass(:t)
+            """), {"t": table}).all()
+            for child, constraint in referencing:
+                conn.execute(text(f'ALTER TABLE {child} DROP CONSTRAINT "{constraint}"'))
+
+            conn.execute(text(f"UPDATE {table} SET created_at = 'epoch' WHERE created_at IS NULL"))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL"))
+            conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+            # Attaching builds the (id, created_at) key; the plain id index stays for lookups and
+            # is handed its name back on the parent by adopt_indexes
+            conn.execute(text(f"ALTER TABLE {legacy} DROP CONSTRAINT {table}_pkey"))
+            conn.execute(text(
+                f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+            ))
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN created_at SET NOT NULL"))
+            conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+            conn.execute(text(f"CREATE INDEX ix_{table}_status_created ON {table} (status, created_at)"))
+            conn.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY NONE"))
+            conn.execute(text(
+                f"ALTER TABLE {table} ATTACH PARTITION {legacy} "
+                f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+            ))
+            conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+            adopt_indexes(conn, table)
+            print(f"✅ Partitioned {table} by created_at ({PARTITION_INTERVAL})")
+    ensure_partitions(bind)
+
+
+def ensure_partitions(bind=None, ahead: int = PARTITION_AHEAD):
+    """Create partitions for the current period and `ahead` periods after it"""
+    bind = bind or engine
+    created = []
+    with bind.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                continue
+            existing = list_partitions(conn, table)
+            start = _period_start(datetime.utcnow())
+            for _ in range(ahead + 1):
+                end = _next_period(start)
+                overlaps = any(
+                    (lower is None or lower < end) and (upper is None or upper > start)
+                    for _, lower, upper in existing
+                )
+                if not overlaps:
+                    name = _partition_name(table, start)
+                    conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    ))
+                    created.append(name)
+                start = end
+    return created
+
+
+def _arrow_schema(model):
+    import pyarrow as pa
+
+    fields = []
+    for column in model.__table__.columns:
+        if isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, Boolean):
+            arrow_type = pa.bool_()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def export_partition(conn, table: str, partition: str, out_dir: str = ARCHIVE_DIR, fmt: str = ARCHIVE_FORMAT):
+    """Stream a (detached) partition into a zstd-compressed columnar file"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("pyarrow is required to export archives (pip install pyarrow)")
+
+    model = PARTITIONED_TABLES[table]
+    schema = _arrow_schema(model)
+    os.makedirs(os.path.join(out_dir, table), exist_ok=True)
+    extension = "parquet" if fmt == "parquet" else "arrow"
+    path = os.path.join(out_dir, table, f"{partition}.{extension}")
+    partial = path + ".partial"
+
+    columns = ", ".join(schema.names)
+    # Typed so values come back as Python objects on every driver (SQLite returns datetimes as text)
+    query = text(f"SELECT {columns} FROM {partition} ORDER BY id").columns(*model.__table__.columns)
+    result = conn.execute(query.execution_options(stream_results=True))
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(partial, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(partial, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    rows = 0
+    try:
+        while True:
+            chunk = result.fetchmany(EXPORT_BATCH_SIZE)
+            if not chunk:
+                break
+            batch = pa.Table.from_pylist([dict(row._mapping) for row in chunk], schema=schema)
+            writer.write_table(batch)
+            rows += len(chunk)
+    finally:
+        writer.close()
+    os.replace(partial, path)
+    return path, rows
+
+
+def _forget_rides(conn, partition: str):
+    """Take a ride partition's completed rides out of user_stats before it is dropped"""
+    conn.execute(text(
+        f"UPDATE user_stats SET completed_rides = user_stats.completed_rides - gone.rides, "
+        f"total_spent = user_stats.total_spent - gone.spent, updated_at = :now "
+        f"FROM (SELECT user_id, count(*) AS rides, coalesce(sum(final_fare), 0) AS spent "
+        f"FROM {partition} WHERE status = 'completed' GROUP BY user_id) AS gone "
+        f"WHERE user_stats.user_id = gone.user_id"
+    ), {"now": datetime.utcnow()})
+
+
+def archive(bind=None, older_than_days: float = ARCHIVE_AFTER_DAYS, out_dir: str = ARCHIVE_DIR,
+            fmt: str = ARCHIVE_FORMAT):
+    """Detach, export and drop every partition that ends before the cutoff"""
+    bind = bind or engine
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = []
+    for table in PARTITIONED_TABLES:
+        with bind.connect() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            candidates = [(name, lower, upper) for name, lower, upper in list_partitions(conn, table)
+                          if upper is not None and upper <= cutoff]
+
+        for partition, lower, upper in candidates:
+            # Detaching briefly locks the parent; give up rather than queue behind live traffic
+            with bind.begin() as conn:
+                conn.execute(text(f"SET LOCAL lock_timeout = '{DETACH_LOCK_TIMEOUT_MS}ms'"))
+                conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+            try:
+                with bind.begin() as conn:
+                    path, rows = export_partition(conn, table, partition, out_dir, fmt)
+                    if table == "ride_queue":
+                        _forget_rides(conn, partition)
+                        ride_rollups.forget_partition(conn, partition)
+                    conn.execute(text(f"DROP TABLE {partition}"))
+            except Exception:
+                lower_bound = f"'{lower.isoformat()}'" if lower else "MINVALUE"
+                with bind.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {table} ATTACH PARTITION {partition} "
+                        f"FOR VALUES FROM ({lower_bound}) TO ('{upper.isoformat()}')"
+                    ))
+                raise
+            print(f"📦 Archived {partition}: {rows} rows -> {path}")
+            archived.append({"table": table, "partition": partition, "rows": rows, "path": path})
+    return archived
+
+
+def read_archive(table: str, out_dir: str = ARCHIVE_DIR, columns=None, filter=None):
+    """Load archived rows as a pyarrow Table, optionally filtered with a dataset expression"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    directory = os.path.join(out_dir, table)
+    if not os.path.isdir(directory):
+        return pa.Table.from_pylist([], schema=_arrow_schema(PARTITIONED_TABLES[table]))
+    datasets = []
+    for fmt, extension in (("parquet", ".parquet"), ("ipc", ".arrow")):
+        files = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extension))
+        if files:
+            datasets.append(ds.dataset(files, format=fmt))
+    dataset = datasets[0] if len(datasets) == 1 else ds.dataset(datasets)
+    return dataset.to_table(columns=columns, filter=filter)
+
+
+def maintain(bind=None):
+    """Create upcoming partitions and archive expired ones"""
+    created = ensure_partitions(bind)
+    archived = archive(bind) if ARCHIVE_AFTER_DAYS > 0 else []
+    return {"created": created, "archived": archived}
+
+
+class PartitionMaintainer:
+    """Background thread that runs `maintain` periodically"""
+
+    def __init__(self, interval: float = 3600):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="partition-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                maintain()
+            except Exception as e:
+                print(f"❌ Partition maintenance failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ride table partitioning and archives")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("convert", help="partition ride_queue and ride_requests by created_at")
+    commands.add_parser("maintain", help="create upcoming partitions and archive expired ones")
+    archive_cmd = commands.add_parser("archive", help="detach and export old partitions")
+    archive_cmd.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS or 30)
+    archive_cmd.add_argument("--format", choices=["parquet", "arrow"], default=ARCHIVE_FORMAT)
+    read_cmd = commands.add_parser("read", help="summarize archived rows")
+    read_cmd.add_argument("table", choices=sorted(PARTITIONED_TABLES))
+    read_cmd.add_argument("--status")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        convert()
+    elif args.command == "maintain":
+        print(maintain())
+    elif args.command == "archive":
+        archive(older_than_days=args.older_than_days, fmt=args.format)
+    else:
+        import pyarrow.dataset as ds
+
+        condition = ds.field("status") == args.status if args.status else None
+        rows = read_archive(args.table, filter=condition)
+        print(f"📊 {rows.num_rows} archived {args.table} rows")
+        if rows.num_rows:
+            for entry in rows.group_by("status").aggregate([("id", "count")]).to_pylist():
+                print(f"   {entry['status']}: {entry['id_count']}")
+
+
+if __name__ == "__main__":
+    main()
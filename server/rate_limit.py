@@ -0,0 +1,153 @@
+"""
+Token-bucket admission control for chatty endpoints.
+
+Each limited route names who it is counted against (the driver, the user or
+the client IP), a refill rate in requests per second and a burst size.
+Limits are configured per route with RATE_LIMITS (JSON), e.g.
+
+  {"/heartbeat": {"key": "driver", "rate": 0.5, "burst": 5},
+   "/queue": null}
+
+where null switches a default limit off. Buckets live in two flat float
+arrays (tokens, last refill) indexed through one dict, and buckets that have
+been idle long enough to be full again are evicted every EVICT_SECONDS, so
+the table only holds clients that are actually busy.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from array import array
+
+import metrics
+
+MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+EVICT_SECONDS = 30
+
+DEFAULT_LIMITS = {
+    "/heartbeat": {"key": "driver", "rate": 1, "burst": 10},
+    "/driver-ride-requests/{driver_id}": {"key": "driver", "rate": 1, "burst": 10},
+    "/queue": {"key": "ip", "rate": 5, "burst": 30},
+    "/user-coupons/{user_id}": {"key": "user", "rate": 2, "burst": 20},
+}
+
+IDENTITY_PARAMS = {"driver": "driver_id", "user": "user_id"}
+
+
+def load_limits():
+    """Default limits overridden per route by RATE_LIMITS"""
+    limits = {route: dict(limit) for route, limit in DEFAULT_LIMITS.items()}
+    raw = os.getenv("RATE_LIMITS")
+    if raw:
+        for route, limit in json.loads(raw).items():
+            if limit is None:
+                limits.pop(route, None)
+            else:
+                limits[route] = limit
+    return limits
+
+
+class Rule:
+    def __init__(self, route: str, key: str, rate: float, burst: float):
+        if key not in ("driver", "user", "ip"):
+            raise ValueError(f"Unknown rate limit key '{key}' for {route}")
+        self.route = route
+        self.key = key
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.pattern = re.compile("^" + re.sub(r"\\{(\w+)\\}", r"(?P<\1>[^/]+)", re.escape(route)) + "$")
+
+    def identity(self, request, params):
+        """Who this request is counted against, or None to let it through"""
+        if self.key == "ip":
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+            return request.client.host if request.client else None
+        name = IDENTITY_PARAMS[self.key]
+        return params.get(name) or request.query_params.get(name)
+
+
+class RateLimiter:
+    def __init__(self, limits=None):
+        self.rules = [Rule(route, **limit) for route, limit in (load_limits() if limits is None else limits).items()]
+        self._lock = threading.Lock()
+        self._slots = {}  # (route, identity) -> index into the arrays
+        self._free = []
+        self._tokens = array("d")
+        self._stamps = array("d")
+        self._next_eviction = time.monotonic() + EVICT_SECONDS
+
+    def __len__(self):
+        return len(self._slots)
+
+    def match(self, path: str):
+        for rule in self.rules:
+            found = rule.pattern.match(path)
+            if found:
+                return rule, found.groupdict()
+        return None, None
+
+    def check(self, request):
+        """None if the request may proceed, else seconds until it would be allowed"""
+        rule, params = self.match(request.url.path)
+        if rule is None:
+            return None
+        identity = rule.identity(request, params)
+        if identity is None:
+            return None
+        wait = self.take(rule, identity)
+        if wait is not None:
+            metrics.incr("rate_limit.throttled")
+            metrics.incr(f"rate_limit.throttled.{rule.route}")
+        return wait
+
+    def take(self, rule: Rule, identity: str, now: float = None):
+        now = time.monotonic() if now is None else now
+        key = (rule.route, identity)
+        with self._lock:
+            if now >= self._next_eviction:
+                self._evict(now)
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._allocate(key, rule.burst, now)
+                if slot is None:
+                    metrics.incr("rate_limit.table_full")
+                    return None
+            tokens = min(rule.burst, self._tokens[slot] + (now - self._stamps[slot]) * rule.rate)
+            self._stamps[slot] = now
+            if tokens >= 1:
+                self._tokens[slot] = tokens - 1
+                return None
+            self._tokens[slot] = tokens
+            return (1 - tokens) / rule.rate if rule.rate > 0 else math.inf
+
+    def _allocate(self, key, tokens, now):
+        if self._free:
+            slot = self._free.pop()
+            self._tokens[slot] = tokens
+            self._stamps[slot] = now
+        elif len(self._tokens) < MAX_BUCKETS:
+            slot = len(self._tokens)
+            self._tokens.append(tokens)
+            self._stamps.append(now)
+        else:
+            return None
+        self._slots[key] = slot
+        return slot
+
+    def _evict(self, now):
+        """Forget buckets that have refilled completely; they would start full anyway"""
+        rules = {rule.route: rule for rule in self.rules}
+        idle = []
+        for key, slot in self._slots.items():
+            rule = rules.get(key[0])
+            if rule is None or self._tokens[slot] + (now - self._stamps[slot]) * rule.rate >= rule.burst:
+                idle.append(key)
+        for key in idle:
+            self._free.append(self._slots.pop(key))
+        metrics.set_gauge("rate_limit.buckets", len(self._slots))
+        self._next_eviction = now + EVICT_SECONDS
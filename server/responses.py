@@ -0,0 +1,33 @@
+"""
+JSON responses rendered with orjson.
+
+Used as the app's default response class. List endpoints build plain dicts
+from column selects and return ORJSONResponse directly, which skips
+FastAPI's per-object jsonable_encoder pass entirely.
+"""
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def rows_json(query) -> bytes:
+    """Serialize a column-select query as a JSON list of objects"""
+    return dumps([row._asdict() for row in query])
+
+
+def rows_response(query):
+    return ORJSONResponse([row._asdict() for row in query])
+
+
+def columns(model, schema):
+    """Model columns backing each field of a response schema"""
+    return [getattr(model, name) for name in schema.model_fields]
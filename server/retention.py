@@ -0,0 +1,250 @@
+"""
+Retention policies and chunked purges for ride data.
+
+Rows are deleted in small batches walked by primary key, one short
+transaction per batch with a pause in between, so a purge never holds locks
+on the hot tables for longer than a single batch.
+
+Policies are configured per table with RETENTION_POLICIES (JSON), e.g.
+
+  {"ride_requests": {"statuses": ["expired", "rejected"], "max_age_days": 1},
+   "ride_queue": {"statuses": ["completed"], "max_age_days": 30},
+   "ride_events": {"max_age_days": 7}}
+
+Only dead ride requests are purged by default. Ride history and the event
+log are kept unless a policy opts them in: purged rides are taken out of
+user_stats and the ride rollups, and the event log is what replay rebuilds
+state from.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, text
+
+from db import SessionLocal
+import catalog_cache
+import metrics
+import models
+import ride_rollups
+import user_stats
+
+BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+PAUSE_SECONDS = float(os.getenv("RETENTION_PAUSE_SECONDS", "0.05"))
+INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "600"))
+LOCK_TIMEOUT_MS = int(os.getenv("RETENTION_LOCK_TIMEOUT_MS", "1000"))
+
+DEFAULT_POLICIES = {
+    "ride_requests": {"statuses": ["expired", "rejected"], "max_age_days": 1},
+}
+
+# table -> (model, age column, status column, [(child model, foreign key column)])
+TABLES = {
+    "ride_requests": (models.RideRequest, models.RideRequest.created_at, models.RideRequest.status, []),
+    "ride_queue": (models.RideQueue, models.RideQueue.created_at, models.RideQueue.status, [
+        (models.RideRequest, models.RideRequest.ride_id),
+        (models.CouponRedemption, models.CouponRedemption.ride_id),
+        (models.RidePathSegment, models.RidePathSegment.ride_id),
+    ]),
+    "coupon_redemptions": (models.CouponRedemption, models.CouponRedemption.redeemed_at, None, []),
+    "user_coupons": (models.UserCoupon, models.UserCoupon.assigned_at, None, []),
+    "users": (models.User, models.User.created_at, None, [
+        (models.UserCoupon, models.UserCoupon.user_id),
+        (models.UserStats, models.UserStats.user_id),
+    ]),
+    "drivers": (models.Driver, models.Driver.last_seen, None, [(models.RideRequest, models.RideRequest.driver_id)]),
+    "ride_events": (models.RideEvent, models.RideEvent.created_at, None, []),
+}
+
+# table -> [(columns returned by the delete, callback run with them in the same transaction)]
+ON_DELETE = {
+    "ride_queue": [
+        (user_stats.RIDE_COLUMNS, user_stats.rides_deleted),
+        (ride_rollups.RIDE_COLUMNS, ride_rollups.rides_deleted),
+    ],
+}
+
+progress = {}
+_run_lock = threading.Lock()
+
+
+def load_policies():
+    """Default policies overridden per table by RETENTION_POLICIES"""
+    policies = {table: dict(policy) for table, policy in DEFAULT_POLICIES.items()}
+    raw = os.getenv("RETENTION_POLICIES")
+    if raw:
+        for table, policy in json.loads(raw).items():
+            if table not in TABLES:
+                raise ValueError(f"No retention support for table '{table}'")
+            if policy is None:
+                policies.pop(table, None)
+            else:
+                policies[table] = policy
+    return policies
+
+
+def _table_progress(table: str):
+    return progress.setdefault(table, {
+        "running": False,
+        "deleted": 0,
+        "batches": 0,
+        "skipped_batches": 0,
+        "cursor": 0,
+        "last_started": None,
+        "last_finished": None,
+        "last_deleted": 0,
+        "last_error": None,
+    })
+
+
+def purge(table: str, where=None, batch_size: int = None, pause: float = None,
+          session_factory=SessionLocal):
+    """Delete rows of `table` matching `where` in primary-key ordered batches"""
+    model, _, _, children = TABLES[table]
+    batch_size = batch_size or BATCH_SIZE
+    pause = PAUSE_SECONDS if pause is None else pause
+    state = _table_progress(table)
+    state.update(running=True, cursor=0, last_deleted=0, last_error=None,
+                 last_started=datetime.utcnow().isoformat())
+
+    deleted_total = 0
+    cursor = 0
+    try:
+        while True:
+            ids = []
+            db = session_factory()
+            try:
+                if db.bind.dialect.name == "postgresql":
+                    # Give way to live traffic instead of queueing behind it
+                    db.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT_MS}ms'"))
+
+                query = db.query(model.id).filter(model.id > cursor)
+                if where is not None:
+                    query = query.filter(where)
+                ids = [row_id for (row_id,) in query.order_by(model.id).limit(batch_size)]
+                if not ids:
+                    break
+
+                for child, foreign_key in children:
+                    db.query(child).filter(foreign_key.in_(ids)).delete(synchronize_session=False)
+                conditions = [model.id >= ids[0], model.id <= ids[-1], model.id.in_(ids)]
+                if where is not None:
+                    conditions.append(where)
+                if table in ON_DELETE:
+                    returning = list({column.key: column for columns, _ in ON_DELETE[table] for column in columns}.values())
+                    rows = db.execute(delete(model).where(*conditions).returning(*returning)).all()
+                    for _, callback in ON_DELETE[table]:
+                        callback(db, rows)
+                    deleted = len(rows)
+                else:
+                    deleted = db.query(model).filter(*conditions).delete(synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if "lock timeout" not in str(e) or not ids:
+                    raise
+                # Skip this window for now; the next run picks it up again
+                state["skipped_batches"] += 1
+                metrics.incr(f"retention.{table}.skipped_batches")
+                deleted = 0
+            finally:
+                db.close()
+
+            cursor = ids[-1]
+            deleted_total += deleted
+            state["cursor"] = cursor
+            state["deleted"] += deleted
+            state["last_deleted"] = deleted_total
+            state["batches"] += 1
+            metrics.incr(f"retention.{table}.deleted", deleted)
+            metrics.incr(f"retention.{table}.batches")
+            if pause:
+                time.sleep(pause)
+    except Exception as e:
+        state["last_error"] = str(e)
+        metrics.incr(f"retention.{table}.errors")
+        raise
+    finally:
+        state["running"] = False
+        state["last_finished"] = datetime.utcnow().isoformat()
+        if deleted_total:
+            catalog_cache.bump(table)
+    return deleted_total
+
+
+def policy_filter(table: str, policy: dict, now: datetime = None):
+    """SQL condition selecting the rows a policy allows us to delete"""
+    _, age_column, status_column, _ = TABLES[table]
+    now = now or datetime.utcnow()
+    condition = age_column < now - timedelta(days=float(policy.get("max_age_days", 0)))
+    statuses = policy.get("statuses")
+    if statuses:
+        if status_column is None:
+            raise ValueError(f"Table '{table}' has no status column")
+        condition = condition & status_column.in_(statuses)
+    return condition
+
+
+def run_policies(policies=None, session_factory=SessionLocal):
+    """Apply every retention policy once; concurrent calls are skipped"""
+    if not _run_lock.acquire(blocking=False):
+        return None
+    try:
+        policies = load_policies() if policies is None else policies
+        results = {}
+        # Children first so parent purges have less cascading work to do
+        for table in sorted(policies, key=lambda t: t != "ride_requests"):
+            try:
+                results[table] = purge(table, policy_filter(table, policies[table]),
+                                       session_factory=session_factory)
+            except Exception as e:
+                print(f"❌ Retention purge of {table} failed: {e}")
+                results[table] = {"error": str(e)}
+        metrics.incr("retention.runs")
+        return results
+    finally:
+        _run_lock.release()
+
+
+def status():
+    return {
+        "policies": load_policies(),
+        "batch_size": BATCH_SIZE,
+        "pause_seconds": PAUSE_SECONDS,
+        "interval_seconds": INTERVAL_SECONDS,
+        "running": _run_lock.locked(),
+        "tables": progress,
+    }
+
+
+class RetentionWorker:
+    """Background thread that applies the retention policies periodically"""
+
+    def __init__(self, interval: float = INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def trigger(self):
+        """Run the policies now on a separate thread"""
+        threading.Thread(target=run_policies, name="retention-manual", daemon=True).start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                run_policies()
+            except Exception as e:
+                print(f"❌ Retention run failed: {e}")
@@ -0,0 +1,366 @@
+"""
+Per-minute ride rollups for the admin dashboard.
+
+ride_rollups holds, per dispatch zone and minute, how many rides were
+booked, assigned, completed and left without a driver, the revenue and
+discounts of the completed ones, and the change in rides in progress.
+/admin/stats sums a time range of these rows, so its cost depends on the
+length of the range, never on the size of ride_queue.
+
+Rows are written behind the requests that change rides: RollupWorker folds
+the ride event log (events.py) into them every ROLLUP_INTERVAL_SECONDS,
+storing its cursor in the same transaction as the rows, so every event is
+counted exactly once. Rides deleted while still in progress (retention,
+partition archiving) are taken out of the in-progress count directly.
+
+Once an hour, minute rows older than ROLLUP_MINUTE_HOURS are compacted into
+one row per hour and zone; ranges reaching further back than that resolve
+to the hour.
+
+  python ride_rollups.py backfill    # rebuild every row from ride_queue
+"""
+
+import os
+import sys
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select, text
+
+import events
+import metrics
+import models
+import zones
+
+INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL_SECONDS", "5"))
+COMPACT_SECONDS = float(os.getenv("ROLLUP_COMPACT_SECONDS", "3600"))
+MINUTE_HOURS = float(os.getenv("ROLLUP_MINUTE_HOURS", "48"))
+PAGE_SIZE = 5000
+BACKFILL_BATCH_SIZE = 5000
+
+CURSOR_NAME = "ride_rollups"
+UNKNOWN_ZONE = -1
+ACTIVE_STATUSES = ("pending", "searching", "assigned")
+MEASURES = ("booked", "assigned", "completed", "unfulfilled", "revenue", "discounts", "active")
+
+# What retention needs back from a deleted ride to undo it here
+RIDE_COLUMNS = (models.RideQueue.status, models.RideQueue.pickup_lat, models.RideQueue.pickup_lng)
+
+_grid = None
+
+
+def zone_of(lat, lng):
+    global _grid
+    if lat is None or lng is None:
+        return UNKNOWN_ZONE
+    if _grid is None:
+        _grid = zones.load_zones()
+    return _grid.zone_of(lat, lng)
+
+
+def _minute(moment: datetime):
+    return moment.replace(second=0, microsecond=0)
+
+
+def _hour(moment: datetime):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _dialect(conn):
+    return (conn.get_bind() if hasattr(conn, "get_bind") else conn).dialect.name
+
+
+class Deltas:
+    """Changes to rollup rows, keyed by (bucket, span, zone)"""
+
+    def __init__(self):
+        self.rows = defaultdict(lambda: dict.fromkeys(MEASURES, 0))
+
+    def add(self, bucket, span, zone, **changes):
+        row = self.rows[(bucket, span, zone)]
+        for name, value in changes.items():
+            row[name] += value or 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def write(self, conn):
+        """Add every delta into ride_rollups with one upsert statement"""
+        if not self.rows:
+            return 0
+        if _dialect(conn) == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+
+        table = models.RideRollup.__table__
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["bucket", "span", "zone"],
+            set_={name: table.c[name] + stmt.excluded[name] for name in MEASURES},
+        )
+        # Sorted, so concurrent writers lock rows in the same order
+        conn.execute(stmt, [
+            {"bucket": bucket, "span": span, "zone": zone, **values}
+            for (bucket, span, zone), values in sorted(self.rows.items())
+        ])
+        return len(self.rows)
+
+
+# ------------------ FOLDING THE EVENT LOG ------------------
+
+def fold(conn, page):
+    """Deltas for a page of events from events.changes()"""
+    rides = [e for e in page if e["entity"] == "ride"]
+    lookup = list({e["entity_id"] for e in rides if e["event_type"] != "created"})
+    queue = models.RideQueue
+    known = {}
+    for start in range(0, len(lookup), 1000):
+        known.update((row.id, row) for row in conn.execute(
+            select(queue.id, queue.pickup_lat, queue.pickup_lng, queue.final_fare, queue.discount)
+            .where(queue.id.in_(lookup[start:start + 1000]))
+        ))
+
+    deltas = Deltas()
+    for event in rides:
+        bucket = _minute(event["created_at"])
+        kind = event["event_type"]
+        if kind == "created":
+            payload = event["payload"] or {}
+            status = payload.get("status")
+            deltas.add(bucket, 1, zone_of(payload.get("pickup_lat"), payload.get("pickup_lng")),
+                       booked=1, assigned=int(status == "assigned"), active=int(status in ACTIVE_STATUSES))
+            continue
+        # Later events only carry the new status; the ride row has the rest
+        ride = known.get(event["entity_id"])
+        zone = zone_of(ride.pickup_lat, ride.pickup_lng) if ride else UNKNOWN_ZONE
+        if kind == "assigned":
+            deltas.add(bucket, 1, zone, assigned=1)
+        elif kind == "completed":
+            deltas.add(bucket, 1, zone, completed=1, active=-1,
+                       revenue=ride.final_fare if ride else 0, discounts=ride.discount if ride else 0)
+        elif kind == "no_drivers":
+            deltas.add(bucket, 1, zone, unfulfilled=1, active=-1)
+    return deltas
+
+
+def _lock_cursor(conn):
+    """The stored cursor, locked until commit so only one process folds at a time"""
+    cursor = models.RollupCursor
+    row = conn.execute(
+        select(cursor.cursor).where(cursor.name == CURSOR_NAME).with_for_update()
+    ).first()
+    if row is None:
+        conn.execute(cursor.__table__.insert().values(name=CURSOR_NAME, cursor=0, updated_at=datetime.utcnow()))
+        return 0
+    return row.cursor
+
+
+def _save_cursor(conn, position: int):
+    cursor = models.RollupCursor
+    conn.execute(cursor.__table__.update().where(cursor.name == CURSOR_NAME).values(
+        cursor=position, updated_at=datetime.utcnow()
+    ))
+
+
+def catch_up(session_factory, page_size: int = PAGE_SIZE):
+    """Fold every event after the stored cursor; returns how many were read"""
+    read = 0
+    while True:
+        with session_factory() as db:
+            position = _lock_cursor(db)
+            page = events.changes(db, position, limit=page_size)
+            if page["reset"]:
+                # Retention dropped events we never folded; their rides are missing from the rollups
+                print(f"⚠️ Ride rollups skipped purged events after {position}")
+                metrics.incr("ride_rollups.gaps")
+            written = fold(db, page["events"]).write(db)
+            _save_cursor(db, page["cursor"])
+            db.commit()
+        read += len(page["events"])
+        metrics.incr("ride_rollups.events", len(page["events"]))
+        metrics.incr("ride_rollups.rows_written", written)
+        if not page["has_more"]:
+            return read
+
+
+def rides_deleted(db, rows):
+    """Take deleted rides that were still in progress out of the in-progress count"""
+    deltas = Deltas()
+    now = _minute(datetime.utcnow())
+    for row in rows:
+        if row.status in ACTIVE_STATUSES:
+            deltas.add(now, 1, zone_of(row.pickup_lat, row.pickup_lng), active=-1)
+    return deltas.write(db)
+
+
+def forget_partition(conn, partition: str):
+    """rides_deleted() for a ride_queue partition about to be dropped"""
+    statuses = ", ".join(f"'{status}'" for status in ACTIVE_STATUSES)
+    rows = conn.execute(text(
+        f"SELECT status, pickup_lat, pickup_lng FROM {partition} WHERE status IN ({statuses})"
+    )).all()
+    return rides_deleted(conn, rows)
+
+
+# ------------------ COMPACTION ------------------
+
+def compact(conn, now: datetime = None, older_than_hours: float = MINUTE_HOURS):
+    """Fold minute rows older than the cutoff into hourly rows; the caller commits"""
+    rollup = models.RideRollup
+    cutoff = _hour((now or datetime.utcnow()) - timedelta(hours=older_than_hours))
+    old = (rollup.span == 1) & (rollup.bucket < cutoff)
+    deltas = Deltas()
+    minutes = 0
+    for row in conn.execute(select(rollup.bucket, rollup.zone, *[rollup.__table__.c[m] for m in MEASURES]).where(old)):
+        deltas.add(_hour(row.bucket), 60, row.zone, **{name: getattr(row, name) for name in MEASURES})
+        minutes += 1
+    if minutes:
+        deltas.write(conn)
+        conn.execute(delete(rollup).where(old))
+        metrics.incr("ride_rollups.compacted", minutes)
+    return minutes
+
+
+class RollupWorker:
+    """Background thread that keeps the rollups current and compacts them hourly"""
+
+    def __init__(self, session_factory=None, interval: float = INTERVAL_SECONDS,
+                 compact_interval: float = COMPACT_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.compact_interval = compact_interval
+        self.last_compacted = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sessions(self):
+        if self.session_factory is None:
+            from db import SessionLocal
+
+            self.session_factory = SessionLocal
+        return self.session_factory
+
+    def start(self):
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ride-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self, now: datetime = None):
+        """Catch up with the event log, then compact if an hour has passed"""
+        with self._lock:
+            read = catch_up(self._sessions())
+            now = now or datetime.utcnow()
+            if self.last_compacted is None or (now - self.last_compacted).total_seconds() >= self.compact_interval:
+                with self._sessions()() as db:
+                    _lock_cursor(db)
+                    compact(db, now)
+                    db.commit()
+                self.last_compacted = now
+            return read
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ Ride rollup update failed: {e}")
+
+
+# ------------------ QUERIES ------------------
+
+def _summary(values):
+    summary = {name: values.get(name) or 0 for name in MEASURES if name != "active"}
+    summary["revenue"] = round(summary["revenue"], 2)
+    summary["discounts"] = round(summary["discounts"], 2)
+    return summary
+
+
+def stats(db, since: datetime = None, until: datetime = None, zone: int = None, by_zone: bool = False):
+    """Totals for rows in [since, until), plus rides in progress now"""
+    rollup = models.RideRollup
+    sums = [func.coalesce(func.sum(rollup.__table__.c[name]), 0).label(name) for name in MEASURES]
+    query = select(rollup.zone, *sums).group_by(rollup.zone)
+    in_progress = select(rollup.zone, func.coalesce(func.sum(rollup.active), 0).label("active")).group_by(rollup.zone)
+    if zone is not None:
+        query = query.where(rollup.zone == zone)
+        in_progress = in_progress.where(rollup.zone == zone)
+    if since is not None:
+        query = query.where(rollup.bucket >= since)
+    if until is not None:
+        query = query.where(rollup.bucket < until)
+
+    per_zone = {row.zone: row._mapping for row in db.execute(query)}
+    active = {row.zone: row.active for row in db.execute(in_progress)}
+    totals = {name: sum(row[name] for row in per_zone.values()) for name in MEASURES}
+    result = {**_summary(totals), "active_rides": sum(active.values())}
+    if by_zone:
+        result["zones"] = {
+            str(z): {**_summary(per_zone.get(z, {})), "active_rides": active.get(z, 0)}
+            for z in sorted(set(per_zone) | {z for z, count in active.items() if count})
+        }
+    cursor = db.execute(select(models.RollupCursor.cursor).where(models.RollupCursor.name == CURSOR_NAME)).scalar()
+    result["as_of_event"] = cursor or 0
+    return result
+
+
+# ------------------ BACKFILL ------------------
+
+def backfill(bind, batch_size: int = BACKFILL_BATCH_SIZE):
+    """Rebuild every row from ride_queue; returns the number of rides read
+
+    Rides are bucketed by when they were booked, since ride_queue does not
+    keep when they were assigned or completed. The cursor is set to the end of
+    the event log in the same snapshot, so the worker carries on from there.
+    """
+    ride = models.RideQueue
+    with bind.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            # One snapshot for the rides and the log head
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        with conn.begin():
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("LOCK TABLE ride_rollups, rollup_cursors IN EXCLUSIVE MODE"))
+            head = conn.execute(select(func.max(models.RideEvent.id))).scalar() or 0
+            conn.execute(delete(models.RideRollup))
+            _lock_cursor(conn)
+            last, rides = 0, 0
+            while True:
+                rows = conn.execute(
+                    select(ride.id, ride.created_at, ride.status, ride.pickup_lat, ride.pickup_lng,
+                           ride.final_fare, ride.discount)
+                    .where(ride.id > last).order_by(ride.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                deltas = Deltas()
+                for row in rows:
+                    done = row.status == "completed"
+                    deltas.add(
+                        _minute(row.created_at or datetime.utcnow()), 1, zone_of(row.pickup_lat, row.pickup_lng),
+                        booked=1, assigned=int(row.status in ("assigned", "completed")), completed=int(done),
+                        unfulfilled=int(row.status == "no_drivers"), revenue=row.final_fare if done else 0,
+                        discounts=row.discount if done else 0, active=int(row.status in ACTIVE_STATUSES),
+                    )
+                deltas.write(conn)
+                last, rides = rows[-1].id, rides + len(rows)
+            compact(conn)
+            _save_cursor(conn, head)
+    return rides
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        from db import engine
+
+        print(f"✅ Rolled up {backfill(engine)} rides")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,421 @@
+"""
+Offline road network for pickup ETAs.
+
+  python road_network.py build city.osm                  # parse once, writes city.osm.rnet
+  python road_network.py eta city.osm 12.97 77.59 12.93 77.62
+
+An OpenStreetMap XML extract is loaded into a compact CSR graph: every
+node's outgoing edges sit in one slice of flat `array` buffers (targets and
+travel seconds), with a reverse copy for searches that run backwards, so a
+city costs a few bytes per edge instead of a Python object each.
+
+Point-to-point ETAs use A* with ALT lower bounds (precomputed distances to
+and from a handful of landmarks). Dispatch asks one-to-many: a single
+reverse Dijkstra from the pickup settles every candidate driver at once.
+The compiled graph is cached next to the extract and reused until the
+extract changes. Nothing here touches the network.
+"""
+
+import heapq
+import json
+import math
+import os
+import struct
+import threading
+import xml.etree.ElementTree as ET
+from array import array
+
+ROAD_NETWORK_PATH = os.getenv("ROAD_NETWORK_PATH")
+LANDMARKS = int(os.getenv("ROAD_NETWORK_LANDMARKS", "8"))
+MAX_SNAP_METERS = float(os.getenv("ROAD_NETWORK_MAX_SNAP_METERS", "2000"))
+OFFROAD_SPEED_MPS = 4.0  # walking-pace crawl from the snapped road node to the point
+
+CACHE_VERSION = 2  # 2: bad maxspeed tags fall back to the class default
+GRID_DEGREES = 0.01
+EARTH_RADIUS_M = 6371000.0
+INF = float("inf")
+
+# km/h when a way has no usable maxspeed tag
+SPEEDS_KMH = {
+    "motorway": 90, "motorway_link": 50, "trunk": 70, "trunk_link": 40,
+    "primary": 50, "primary_link": 35, "secondary": 40, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25, "unclassified": 30, "residential": 25,
+    "living_street": 10, "service": 15, "road": 25,
+}
+
+
+def _meters(lat1, lon1, lat2, lon2):
+    """Equirectangular distance; plenty accurate at city scale"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_M * math.hypot(x, y)
+
+
+def _speed_kmh(tags):
+    maxspeed = tags.get("maxspeed", "")
+    try:
+        if maxspeed.endswith("mph"):
+            speed = float(maxspeed[:-3].strip()) * 1.609
+        else:
+            speed = float(maxspeed)
+    except ValueError:
+        speed = None
+    # "0", negative or infinite limits would make zero-length or negative edge weights
+    if speed is None or not math.isfinite(speed) or speed <= 0:
+        return SPEEDS_KMH[tags["highway"]]
+    return speed
+
+
+def parse_osm(path):
+    """Drivable edges of an OSM XML extract as (node coords, [(a, b, seconds)])"""
+    coords = {}
+    ways = []
+    refs = []
+    tags = {}
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+        elif elem.tag == "nd":
+            refs.append(int(elem.get("ref")))
+        elif elem.tag == "tag":
+            tags[elem.get("k")] = elem.get("v")
+        elif elem.tag == "way":
+            if tags.get("highway") in SPEEDS_KMH:
+                ways.append((refs, dict(tags)))
+            refs, tags = [], {}
+        elif elem.tag == "relation":
+            refs, tags = [], {}
+        else:
+            continue
+        elem.clear()
+
+    edges = []
+    for way_refs, way_tags in ways:
+        mps = _speed_kmh(way_tags) / 3.6
+        oneway = way_tags.get("oneway", "no")
+        if way_tags.get("highway") in ("motorway", "motorway_link") and oneway == "no":
+            oneway = "yes"
+        if oneway == "-1":
+            way_refs = way_refs[::-1]
+        for a, b in zip(way_refs, way_refs[1:]):
+            if a not in coords or b not in coords:
+                continue
+            seconds = _meters(*coords[a], *coords[b]) / mps
+            edges.append((a, b, seconds))
+            if oneway not in ("yes", "true", "1", "-1"):
+                edges.append((b, a, seconds))
+    return coords, edges
+
+
+def _csr(count, sources, targets, weights):
+    """Group edges by source: offsets[u]..offsets[u+1] index u's edges"""
+    offsets = array("I", [0]) * (count + 1)
+    for u in sources:
+        offsets[u + 1] += 1
+    for u in range(count):
+        offsets[u + 1] += offsets[u]
+    cursor = array("I", offsets[:-1])
+    out_targets = array("I", [0]) * len(sources)
+    out_weights = array("f", [0.0]) * len(sources)
+    for u, v, w in zip(sources, targets, weights):
+        slot = cursor[u]
+        out_targets[slot] = v
+        out_weights[slot] = w
+        cursor[u] += 1
+    return offsets, out_targets, out_weights
+
+
+class RoadNetwork:
+    def __init__(self, lat, lon, forward, backward, landmarks=()):
+        self.lat = lat
+        self.lon = lon
+        self.forward = forward  # (offsets, targets, seconds)
+        self.backward = backward
+        self.landmarks = list(landmarks)  # [(seconds from landmark, seconds to landmark)]
+        self._grid = {}
+        for node in range(len(lat)):
+            self._grid.setdefault(self._cell(lat[node], lon[node]), array("I")).append(node)
+
+    @property
+    def node_count(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return len(self.forward[1])
+
+    # ------------------ BUILD ------------------
+
+    @classmethod
+    def from_osm(cls, path, landmarks: int = LANDMARKS):
+        coords, edges = parse_osm(path)
+        index = {}
+        lat, lon = array("d"), array("d")
+        sources, targets, weights = array("I"), array("I"), array("f")
+        for a, b, seconds in edges:
+            for osm_id in (a, b):
+                if osm_id not in index:
+                    index[osm_id] = len(index)
+                    lat.append(coords[osm_id][0])
+                    lon.append(coords[osm_id][1])
+            sources.append(index[a])
+            targets.append(index[b])
+            weights.append(seconds)
+        count = len(index)
+        network = cls(lat, lon, _csr(count, sources, targets, weights), _csr(count, targets, sources, weights))
+        network.landmarks = network._pick_landmarks(landmarks)
+        return network
+
+    def _pick_landmarks(self, count):
+        """Farthest-point landmarks: each one as far as possible from those already chosen"""
+        if not self.node_count or count <= 0:
+            return []
+        # Start from the far edge of the graph, not wherever node 0 happens to be
+        seed = self._dijkstra(self.forward, 0)
+        landmark = max((d, node) for node, d in enumerate(seed) if d < INF)[1]
+        nearest = array("f", [INF]) * self.node_count
+        chosen = []
+        while len(chosen) < count:
+            from_landmark = array("f", self._dijkstra(self.forward, landmark))
+            to_landmark = array("f", self._dijkstra(self.backward, landmark))
+            chosen.append((from_landmark, to_landmark))
+            for node in range(self.node_count):
+                nearest[node] = min(nearest[node], from_landmark[node])
+            distance, landmark = max((d, node) for node, d in enumerate(nearest) if d < INF)
+            if distance == 0:
+                break
+        return chosen
+
+    def _dijkstra(self, graph, source):
+        offsets, targets, weights = graph
+        dist = array("d", [INF]) * self.node_count
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for slot in range(offsets[u], offsets[u + 1]):
+                v = targets[slot]
+                nd = d + weights[slot]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    # ------------------ CACHE ------------------
+
+    def save(self, path):
+        buffers = [self.lat, self.lon, *self.forward, *self.backward]
+        for from_landmark, to_landmark in self.landmarks:
+            buffers += [from_landmark, to_landmark]
+        header = json.dumps({
+            "version": CACHE_VERSION,
+            "nodes": self.node_count,
+            "edges": self.edge_count,
+            "landmarks": len(self.landmarks),
+        }).encode()
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for buffer in buffers:
+                buffer.tofile(f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load_cache(cls, path):
+        with open(path, "rb") as f:
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+            if header["version"] != CACHE_VERSION:
+                raise ValueError("Stale road network cache")
+            nodes, edges = header["nodes"], header["edges"]
+
+            def read(typecode, count):
+                buffer = array(typecode)
+                buffer.fromfile(f, count)
+                return buffer
+
+            lat, lon = read("d", nodes), read("d", nodes)
+            forward = (read("I", nodes + 1), read("I", edges), read("f", edges))
+            backward = (read("I", nodes + 1), read("I", edges), read("f", edges))
+            landmarks = [(read("f", nodes), read("f", nodes)) for _ in range(header["landmarks"])]
+        return cls(lat, lon, forward, backward, landmarks)
+
+    @classmethod
+    def load(cls, osm_path, landmarks: int = LANDMARKS):
+        """Load from the compiled cache, rebuilding it when the extract is newer"""
+        cache = f"{osm_path}.rnet"
+        if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(osm_path):
+            try:
+                return cls.load_cache(cache)
+            except (ValueError, EOFError, KeyError) as e:
+                print(f"⚠️ Rebuilding road network cache: {e}")
+        network = cls.from_osm(osm_path, landmarks)
+        network.save(cache)
+        return network
+
+    # ------------------ QUERIES ------------------
+
+    @staticmethod
+    def _cell(lat, lon):
+        return (math.floor(lat / GRID_DEGREES), math.floor(lon / GRID_DEGREES))
+
+    def nearest_node(self, lat, lon, max_meters: float = MAX_SNAP_METERS):
+        """Closest road node to a point as (node, meters), or (None, inf)"""
+        row, col = self._cell(lat, lon)
+        cell_meters = GRID_DEGREES * math.pi / 180 * EARTH_RADIUS_M * math.cos(math.radians(lat))
+        best, best_meters = None, INF
+        ring = 0
+        while ring * cell_meters <= min(best_meters, max_meters) + cell_meters:
+            for r in range(row - ring, row + ring + 1):
+                for c in range(col - ring, col + ring + 1):
+                    if max(abs(r - row), abs(c - col)) != ring:
+                        continue
+                    for node in self._grid.get((r, c), ()):
+                        meters = _meters(lat, lon, self.lat[node], self.lon[node])
+                        if meters < best_meters:
+                            best, best_meters = node, meters
+            ring += 1
+        if best_meters > max_meters:
+            return None, INF
+        return best, best_meters
+
+    def _lower_bound(self, node, target):
+        bound = 0.0
+        for from_landmark, to_landmark in self.landmarks:
+            if from_landmark[target] < INF and from_landmark[node] < INF:
+                bound = max(bound, from_landmark[target] - from_landmark[node])
+            if to_landmark[node] < INF and to_landmark[target] < INF:
+                bound = max(bound, to_landmark[node] - to_landmark[target])
+        return bound
+
+    def route_seconds(self, source: int, target: int):
+        """Shortest travel time between two nodes (A* with landmark bounds)"""
+        if source == target:
+            return 0.0
+        offsets, targets, weights = self.forward
+        best = {source: 0.0}
+        heap = [(self._lower_bound(source, target), 0.0, source)]
+        while heap:
+            _, d, u = heapq.heappop(heap)
+            if u == target:
+                return d
+            if d > best.get(u, INF):
+                continue
+            for slot in range(offsets[u], offsets[u + 1]):
+                v = targets[slot]
+                nd = d + weights[slot]
+                if nd < best.get(v, INF):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd + self._lower_bound(v, target), nd, v))
+        return None
+
+    def eta(self, from_lat, from_lon, to_lat, to_lon):
+        """Seconds to drive from one point to another, None if there is no route"""
+        source, source_meters = self.nearest_node(from_lat, from_lon)
+        target, target_meters = self.nearest_node(to_lat, to_lon)
+        if source is None or target is None:
+            return None
+        seconds = self.route_seconds(source, target)
+        if seconds is None:
+            return None
+        return seconds + (source_meters + target_meters) / OFFROAD_SPEED_MPS
+
+    def etas_to(self, lat, lon, origins, max_seconds: float = INF):
+        """Seconds from each (lat, lon) origin to one destination, in one search
+
+        Runs Dijkstra backwards from the destination and stops as soon as
+        every origin's road node is settled.
+        """
+        target, target_meters = self.nearest_node(lat, lon)
+        results = [None] * len(origins)
+        if target is None:
+            return results
+        waiting = {}
+        for i, (origin_lat, origin_lon) in enumerate(origins):
+            node, meters = self.nearest_node(origin_lat, origin_lon)
+            if node is not None:
+                waiting.setdefault(node, []).append((i, meters))
+        if not waiting:
+            return results
+
+        offsets, targets, weights = self.backward
+        best = {target: 0.0}
+        heap = [(0.0, target)]
+        while heap and waiting:
+            d, u = heapq.heappop(heap)
+            if d > best.get(u, INF):
+                continue
+            if d > max_seconds:
+                break
+            for i, meters in waiting.pop(u, ()):
+                results[i] = d + (meters + target_meters) / OFFROAD_SPEED_MPS
+            for slot in range(offsets[u], offsets[u + 1]):
+                v = targets[slot]
+                nd = d + weights[slot]
+                if nd < best.get(v, INF):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return results
+
+
+_network = None
+_network_lock = threading.Lock()
+_network_failed = False
+
+
+def get_network():
+    """The network at ROAD_NETWORK_PATH, loaded once; None when unset, unloadable or still loading
+
+    Never waits for a load already in progress, so callers fall back to
+    straight-line distance instead of queueing behind the compile.
+    """
+    global _network, _network_failed
+    if _network is None and ROAD_NETWORK_PATH and not _network_failed:
+        if not _network_lock.acquire(blocking=False):
+            return None
+        try:
+            if _network is None and not _network_failed:
+                try:
+                    _network = RoadNetwork.load(ROAD_NETWORK_PATH)
+                    print(f"✅ Road network loaded: {_network.node_count} nodes, {_network.edge_count} edges")
+                except Exception as e:
+                    _network_failed = True
+                    print(f"❌ Road network unavailable, falling back to straight-line distance: {e}")
+        finally:
+            _network_lock.release()
+    return _network
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Offline road network tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_cmd = commands.add_parser("build", help="compile an OSM extract and its landmarks")
+    build_cmd.add_argument("osm")
+    build_cmd.add_argument("--landmarks", type=int, default=LANDMARKS)
+    eta_cmd = commands.add_parser("eta", help="driving time between two points")
+    eta_cmd.add_argument("osm")
+    eta_cmd.add_argument("coords", nargs=4, type=float, metavar="LAT/LON")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "build":
+        network = RoadNetwork.from_osm(args.osm, args.landmarks)
+        network.save(f"{args.osm}.rnet")
+        print(f"✅ {network.node_count} nodes, {network.edge_count} edges, {len(network.landmarks)} landmarks "
+              f"in {time.perf_counter() - started:.1f}s")
+    else:
+        network = RoadNetwork.load(args.osm)
+        loaded = time.perf_counter()
+        seconds = network.eta(*args.coords)
+        took = (time.perf_counter() - loaded) * 1000
+        print(f"⏱️  {'no route' if seconds is None else f'{seconds / 60:.1f} min'} (query {took:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
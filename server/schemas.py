@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 class RideRequest(BaseModel):
@@ -62,4 +62,91 @@ class MerchantCouponCreate(BaseModel):
     usage_limit: Optional[int] = None
     min_rides_required: int = 0
     min_fare_spent: float = 0.0
-    radius_km: float = 0.5
\ No newline at end of file
+    radius_km: float = 0.5
+
+
+class SimulationBatch(BaseModel):
+    driver_ids: List[int]
+    user_ids: Optional[List[int]] = None  # None books as the shared simulator rider
+    rides: int
+    use_containers: bool = False
+    trip_seconds: float = 60.0
+
+# Response shapes for the list endpoints. The field names double as the
+# columns selected for them, so keep them in sync with models.py.
+
+class QueueRide(BaseModel):
+    id: int
+    user_id: Optional[int] = None
+    start: Optional[str] = None
+    destination: Optional[str] = None
+    pickup_lat: Optional[float] = None
+    pickup_lng: Optional[float] = None
+    dest_lat: Optional[float] = None
+    dest_lng: Optional[float] = None
+    status: Optional[str] = None
+    driver_id: Optional[int] = None
+    port: Optional[int] = None
+    fare: Optional[float] = None
+    discount: Optional[float] = None
+    final_fare: Optional[float] = None
+    coupon_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+
+class DriverOut(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    location: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    status: Optional[str] = None
+    last_seen: Optional[datetime] = None
+
+class CouponOut(BaseModel):
+    id: int
+    code: str
+    discount_type: str
+    discount_value: float
+    max_discount: Optional[float] = None
+    min_fare: Optional[float] = None
+    valid_from: Optional[datetime] = None
+    valid_until: Optional[datetime] = None
+    total_usage_limit: Optional[int] = None
+    per_user_limit: Optional[int] = None
+    usage_count: Optional[int] = None
+    target_audience: Optional[str] = None
+    zone: Optional[str] = None
+    is_active: Optional[bool] = None
+
+class MerchantOut(BaseModel):
+    id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    business_type: Optional[str] = None
+    address: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    phone: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
+
+class MerchantCouponOut(BaseModel):
+    id: int
+    merchant_id: int
+    code: str
+    title: Optional[str] = None
+    description: Optional[str] = None
+    discount_type: str
+    discount_value: float
+    min_purchase: Optional[float] = None
+    max_discount: Optional[float] = None
+    valid_from: Optional[datetime] = None
+    valid_until: Optional[datetime] = None
+    usage_limit: Optional[int] = None
+    usage_count: Optional[int] = None
+    min_rides_required: Optional[int] = None
+    min_fare_spent: Optional[float] = None
+    radius_km: Optional[float] = None
+    is_active: Optional[bool] = None
+    created_at: Optional[datetime] = None
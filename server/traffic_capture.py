@@ -0,0 +1,218 @@
+"""
+Traffic capture to rotating NDJSON files.
+
+With TRAFFIC_CAPTURE_DIR set, every request is written as one JSON line:
+
+  {"seq": 12, "ts": 1718000000.123, "method": "POST", "path": "/book-ride",
+   "query": "", "content_type": "application/json", "body": "{...}",
+   "status": 200, "duration_ms": 41.7, "response": "{\"ride_id\": 88, ...}"}
+
+Response bodies are kept (up to RESPONSE_BYTES) because replay needs the
+ids the server handed out to follow a booking through to its acceptance.
+Files rotate at TRAFFIC_CAPTURE_MAX_MB and only the newest
+TRAFFIC_CAPTURE_MAX_FILES are kept. Lines are written by a background
+thread, never on the event loop.
+
+TRAFFIC_CAPTURE_ANONYMIZE=1 replaces emails, names, phone numbers,
+addresses (also under prefixed keys such as user_name or merchant_address)
+and free-text places (location, start, pickup, destination) with keyed
+hashes. The same input always maps to the same token
+within a capture (set TRAFFIC_CAPTURE_SALT to keep them stable across
+restarts), so a replay still sees one user behind repeated requests.
+
+Replay a capture with replay_traffic.py in the repository root.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+import orjson
+
+import metrics
+
+CAPTURE_DIR = os.getenv("TRAFFIC_CAPTURE_DIR")
+MAX_BYTES = int(float(os.getenv("TRAFFIC_CAPTURE_MAX_MB", "64")) * 1024 * 1024)
+MAX_FILES = int(os.getenv("TRAFFIC_CAPTURE_MAX_FILES", "10"))
+ANONYMIZE = os.getenv("TRAFFIC_CAPTURE_ANONYMIZE") == "1"
+SKIP_PREFIXES = tuple(p for p in os.getenv("TRAFFIC_CAPTURE_SKIP", "/healthz,/readyz,/metrics").split(",") if p)
+BODY_BYTES = 256 * 1024
+RESPONSE_BYTES = 64 * 1024
+QUEUE_SIZE = 10000
+
+SENSITIVE_KEYS = {"email", "name", "phone", "address"}  # also matched as a suffix: user_name, merchant_address
+PLACE_KEYS = {"location", "start", "pickup", "destination", "dropoff"}
+EMAIL = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+
+
+class Anonymizer:
+    def __init__(self, salt: str = None):
+        self.key = (salt or os.getenv("TRAFFIC_CAPTURE_SALT") or secrets.token_hex(16)).encode()
+
+    def token(self, value: str) -> str:
+        return hmac.new(self.key, value.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def email(self, value: str) -> str:
+        return f"user-{self.token(value.lower())}@anon.invalid"
+
+    @staticmethod
+    def kind(key: str):
+        """How a key's value is anonymized: "email", "token", or None to keep it"""
+        suffix = key.rpartition("_")[2]
+        if suffix == "email":
+            return "email"
+        if suffix in SENSITIVE_KEYS or key in PLACE_KEYS:
+            return "token"
+        return None
+
+    def value(self, key: str, value):
+        kind = self.kind(key) if isinstance(value, str) else None
+        if kind is None:
+            return value
+        return self.email(value) if kind == "email" else f"anon-{self.token(value)}"
+
+    def tree(self, data):
+        if isinstance(data, dict):
+            return {k: self.tree(v) if isinstance(v, (dict, list)) else self.value(k, v) for k, v in data.items()}
+        if isinstance(data, list):
+            return [self.tree(item) for item in data]
+        return data
+
+    def query(self, query: str) -> str:
+        if not query:
+            return query
+        return urlencode([(k, self.value(k, v)) for k, v in parse_qsl(query, keep_blank_values=True)])
+
+    def text(self, text: str, content_type: str) -> str:
+        """A request or response body; JSON is rewritten by key, anything else by pattern"""
+        if not text:
+            return text
+        if "ndjson" in content_type:
+            return "\n".join(self.text(line, "application/json") for line in text.split("\n"))
+        if "json" in content_type:
+            try:
+                return orjson.dumps(self.tree(orjson.loads(text))).decode()
+            except orjson.JSONDecodeError:
+                pass
+        return EMAIL.sub(lambda m: self.email(m.group(0)), text)
+
+
+class TrafficRecorder:
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES, max_files: int = MAX_FILES,
+                 anonymize: bool = ANONYMIZE, skip_prefixes=SKIP_PREFIXES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.anonymizer = Anonymizer() if anonymize else None
+        self.skip_prefixes = tuple(skip_prefixes)
+        self.dropped = 0
+        self._seq = 0
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._file = None
+        self._written = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def wants(self, path: str) -> bool:
+        return not path.startswith(self.skip_prefixes)
+
+    def record(self, method, path, query, content_type, body: bytes, status, duration_ms, response: bytes,
+               response_type: str = ""):
+        """Queue one exchange for writing; drops it (and counts) if the writer is behind"""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        entry = {
+            "seq": seq,
+            "ts": round(time.time() - duration_ms / 1000, 6),
+            "method": method,
+            "path": path,
+            "query": query,
+            "content_type": content_type,
+            "body": self._decode(body[:BODY_BYTES]),
+            "status": status,
+            "duration_ms": round(duration_ms, 3),
+            "response": self._decode(response[:RESPONSE_BYTES]),
+        }
+        if self.anonymizer:
+            entry["query"] = self.anonymizer.query(query)
+            if isinstance(entry["body"], str):
+                entry["body"] = self.anonymizer.text(entry["body"], content_type)
+            if isinstance(entry["response"], str):
+                entry["response"] = self.anonymizer.text(entry["response"], response_type or "application/json")
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            metrics.incr("traffic_capture.dropped")
+
+    @staticmethod
+    def _decode(data: bytes):
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return {"b64": base64.b64encode(data).decode()}
+
+    def _ensure_writer(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True)
+                    self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is None:
+                    if self._file:
+                        self._file.flush()
+                    continue
+                self._write(orjson.dumps(entry) + b"\n")
+                metrics.incr("traffic_capture.recorded")
+            except Exception as e:
+                print(f"❌ Traffic capture write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, line: bytes):
+        if self._file is None or self._written + len(line) > self.max_bytes:
+            self._rotate()
+        self._file.write(line)
+        self._written += len(line)
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+        name = time.strftime("traffic-%Y%m%d-%H%M%S", time.gmtime())
+        path = os.path.join(self.directory, f"{name}-{self._seq:09d}.ndjson")
+        self._file = open(path, "ab")
+        self._written = 0
+        captures = sorted(f for f in os.listdir(self.directory) if f.startswith("traffic-") and f.endswith(".ndjson"))
+        for old in captures[:-self.max_files] if self.max_files > 0 else []:
+            os.remove(os.path.join(self.directory, old))
+
+    def files(self):
+        return sorted(os.path.join(self.directory, f) for f in os.listdir(self.directory)
+                      if f.startswith("traffic-") and f.endswith(".ndjson"))
+
+    def flush(self):
+        """Block until everything queued so far is on disk"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._queue.join()
+
+
+def from_env():
+    """A recorder for TRAFFIC_CAPTURE_DIR, or None when capture is off"""
+    return TrafficRecorder(CAPTURE_DIR) if CAPTURE_DIR else None
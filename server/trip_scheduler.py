@@ -0,0 +1,96 @@
+"""
+Central trip scheduler.
+
+Instead of one sleeping thread per ride, trips are pushed onto a single heap
+ordered by due time. One worker thread wakes up when the earliest trip is due
+and hands every due trip to the completion callback in one batch, so finishing
+thousands of simulated rides costs a handful of transactions.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class TripScheduler:
+    def __init__(self, complete_trips, batch_size: int = DEFAULT_BATCH_SIZE):
+        """`complete_trips` is called with a list of (ride_id, driver_id, port) tuples"""
+        self._complete_trips = complete_trips
+        self._batch_size = batch_size
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self):
+        return len(self._heap)
+
+    def schedule(self, ride_id: int, driver_id: int, port: int = None, delay_seconds: float = 60):
+        """Complete a trip after `delay_seconds`"""
+        self.schedule_many([(ride_id, driver_id, port)], delay_seconds)
+
+    def schedule_many(self, trips, delay_seconds: float = 60):
+        """Complete several (ride_id, driver_id, port) trips after `delay_seconds`"""
+        due = time.monotonic() + delay_seconds
+        with self._cond:
+            for ride_id, driver_id, port in trips:
+                heapq.heappush(self._heap, (due, next(self._counter), ride_id, driver_id, port))
+            self._cond.notify()
+        self.start()
+
+    def start(self):
+        with self._cond:
+            if self.running:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="trip-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._stopping:
+                wait = None
+                if self._heap:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                self._cond.wait(wait)
+            if self._stopping:
+                return None
+
+            now = time.monotonic()
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self._batch_size:
+                _, _, ride_id, driver_id, port = heapq.heappop(self._heap)
+                batch.append((ride_id, driver_id, port))
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._complete_trips(batch)
+                self.completed += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"❌ Failed to complete {len(batch)} trips: {e}")
@@ -0,0 +1,98 @@
+"""
+Per-user ride totals.
+
+user_stats holds each user's completed ride count and total spend, so
+eligibility checks read one row by primary key instead of loading every
+completed ride. The totals always equal what ride_queue holds:
+
+- complete_trips adds a ride in the transaction that marks it completed
+- retention purges and partition archiving take completed rides back out
+  in the transaction that deletes them
+
+  python user_stats.py backfill    # rebuild every row from ride_queue
+"""
+
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, literal, select, text
+
+import models
+
+# What retention needs back from a deleted ride to undo it here
+RIDE_COLUMNS = (models.RideQueue.user_id, models.RideQueue.status, models.RideQueue.final_fare)
+
+
+def add(db, changes):
+    """Apply (user_id, rides, spent) deltas with one upsert per user"""
+    totals = defaultdict(lambda: [0, 0.0])
+    for user_id, rides, spent in changes:
+        if user_id is None:
+            continue
+        totals[user_id][0] += rides
+        totals[user_id][1] += spent or 0.0
+    if not totals:
+        return 0
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as upsert
+
+    now = datetime.utcnow()
+    stmt = upsert(models.UserStats.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=["user_id"], set_={
+        "completed_rides": models.UserStats.completed_rides + stmt.excluded.completed_rides,
+        "total_spent": models.UserStats.total_spent + stmt.excluded.total_spent,
+        "updated_at": stmt.excluded.updated_at,
+    })
+    # Sorted, so concurrent batches lock rows in the same order
+    db.execute(stmt, [
+        {"user_id": user_id, "completed_rides": rides, "total_spent": spent, "updated_at": now}
+        for user_id, (rides, spent) in sorted(totals.items())
+    ])
+    return len(totals)
+
+
+def rides_completed(db, rides):
+    """Count (user_id, final_fare) rows that just became completed"""
+    return add(db, [(user_id, 1, fare) for user_id, fare in rides])
+
+
+def rides_deleted(db, rows):
+    """Undo deleted rides, given their RIDE_COLUMNS"""
+    return add(db, [(row.user_id, -1, -(row.final_fare or 0.0)) for row in rows if row.status == "completed"])
+
+
+def get(db, user_id: int):
+    """(completed rides, total spent) for a user"""
+    row = db.get(models.UserStats, user_id)
+    return (row.completed_rides, row.total_spent) if row else (0, 0.0)
+
+
+def backfill(bind):
+    """Rebuild every row from the completed rides in ride_queue"""
+    ride = models.RideQueue
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Completions wait for the rebuild instead of landing in between
+            conn.execute(text("LOCK TABLE user_stats IN EXCLUSIVE MODE"))
+        conn.execute(delete(models.UserStats))
+        result = conn.execute(insert(models.UserStats).from_select(
+            ["user_id", "completed_rides", "total_spent", "updated_at"],
+            select(ride.user_id, func.count(), func.coalesce(func.sum(ride.final_fare), 0.0),
+                   literal(datetime.utcnow(), models.UserStats.updated_at.type))
+            .where(ride.status == "completed", ride.user_id.isnot(None))
+            .group_by(ride.user_id),
+        ))
+        return result.rowcount
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["backfill"]:
+        from db import engine
+
+        print(f"✅ Rebuilt stats for {backfill(engine)} users")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,107 @@
+"""
+Coupon zone matching.
+
+A zone-targeted coupon applies wherever its zone name appears in the
+pickup location, case-insensitively: a "Koramangala" coupon applies to
+"5th Block, Koramangala, Bengaluru". Validation, listing and booking all
+ask coupons_for() so they agree on which coupons a location gets.
+
+The zones of all active coupons are compiled into one Aho-Corasick
+automaton, so a location is matched against every zone in a single pass
+over its characters, however many coupons there are. The automaton is
+rebuilt on the first lookup after the set of coupons changes (every such
+write bumps the catalog_cache resource "coupon_zones").
+"""
+
+import threading
+from collections import deque
+
+import catalog_cache
+import metrics
+import models
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+class ZoneMatcher:
+    """Aho-Corasick automaton over zone names"""
+
+    def __init__(self, zones):
+        """`zones` is an iterable of (zone name, value); search() returns the values"""
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for zone, value in zones:
+            pattern = normalize(zone)
+            if not pattern:
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(value)
+        # Breadth first, so a state's failure link is final before its children need it;
+        # states one character deep fail to the root
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for ch, nxt in self.goto[state].items():
+                pending.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def search(self, text: str) -> set:
+        """Values of every zone that occurs in `text`"""
+        found = set()
+        if not text:
+            return found
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for ch in normalize(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+_lock = threading.Lock()
+_matcher = None
+_version = None
+
+
+def matcher(db) -> ZoneMatcher:
+    """The automaton for the current active coupons, rebuilt if they changed"""
+    global _matcher, _version
+    version = catalog_cache.etag("coupon_zones")
+    if _matcher is not None and _version == version:
+        return _matcher
+    with _lock:
+        if _matcher is None or _version != version:
+            rows = db.query(models.Coupon.id, models.Coupon.zone).filter(
+                models.Coupon.is_active == True, models.Coupon.zone.isnot(None)
+            ).all()
+            _matcher = ZoneMatcher((row.zone, row.id) for row in rows)
+            _version = version
+            metrics.incr("zone_matcher.rebuilds")
+        return _matcher
+
+
+def coupons_for(db, location: str) -> set:
+    """Ids of the zone-targeted coupons that apply to `location`"""
+    return matcher(db).search(location)
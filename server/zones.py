@@ -0,0 +1,99 @@
+"""
+Dispatch zones.
+
+The city is split into a grid of rectangular zones over a bounding box.
+Every point belongs to exactly one zone (points outside the box count
+towards the nearest edge zone), and a driver within BORDER_KM of a
+neighbouring zone is also visible there as a ghost, so a pickup just across
+a border still sees the closest drivers. Configured with DISPATCH_ZONES
+(JSON), e.g.
+
+  DISPATCH_ZONES='{"bounds": [12.80, 77.45, 13.15, 77.80], "rows": 3, "cols": 3, "border_km": 2}'
+"""
+
+import json
+import math
+import os
+
+EARTH_RADIUS_KM = 6371.0
+
+DEFAULT_ZONES = {
+    "bounds": [12.80, 77.45, 13.15, 77.80],  # south, west, north, east
+    "rows": 2,
+    "cols": 2,
+    "border_km": 2.0,
+}
+
+
+def load_zones():
+    """Default zone grid overridden by DISPATCH_ZONES"""
+    config = dict(DEFAULT_ZONES)
+    raw = os.getenv("DISPATCH_ZONES")
+    if raw:
+        config.update(json.loads(raw))
+    return ZoneGrid(**config)
+
+
+def _km(lat1, lng1, lat2, lng2):
+    """Equirectangular distance; zones are city-sized"""
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_KM * math.hypot(x, y)
+
+
+class ZoneGrid:
+    def __init__(self, bounds, rows: int = 1, cols: int = 1, border_km: float = 2.0):
+        self.south, self.west, self.north, self.east = map(float, bounds)
+        if self.north <= self.south or self.east <= self.west:
+            raise ValueError(f"Zone bounds {bounds} are empty")
+        if rows < 1 or cols < 1:
+            raise ValueError("Zones need at least one row and one column")
+        self.rows = rows
+        self.cols = cols
+        self.border_km = float(border_km)
+        self.height = (self.north - self.south) / rows
+        self.width = (self.east - self.west) / cols
+
+    def __len__(self):
+        return self.rows * self.cols
+
+    def config(self):
+        return {"bounds": [self.south, self.west, self.north, self.east], "rows": self.rows,
+                "cols": self.cols, "border_km": self.border_km}
+
+    def _cell(self, lat, lng):
+        row = min(self.rows - 1, max(0, int((lat - self.south) / self.height)))
+        col = min(self.cols - 1, max(0, int((lng - self.west) / self.width)))
+        return row, col
+
+    def zone_of(self, lat: float, lng: float) -> int:
+        row, col = self._cell(lat, lng)
+        return row * self.cols + col
+
+    def bounds(self, zone: int):
+        row, col = divmod(zone, self.cols)
+        south = self.south + row * self.height
+        west = self.west + col * self.width
+        return south, west, south + self.height, west + self.width
+
+    def distance_km(self, zone: int, lat: float, lng: float) -> float:
+        """From a point to the nearest edge of a zone; 0 inside it"""
+        south, west, north, east = self.bounds(zone)
+        return _km(lat, lng, min(north, max(south, lat)), min(east, max(west, lng)))
+
+    def covering(self, lat: float, lng: float):
+        """The owning zone first, then every neighbour within border_km"""
+        row, col = self._cell(lat, lng)
+        owner = row * self.cols + col
+        zones = [owner]
+        for r in range(max(0, row - 1), min(self.rows, row + 2)):
+            for c in range(max(0, col - 1), min(self.cols, col + 2)):
+                zone = r * self.cols + c
+                if zone != owner and self.distance_km(zone, lat, lng) <= self.border_km:
+                    zones.append(zone)
+        return tuple(zones)
+
+    def within(self, lat: float, lng: float, km: float):
+        """Every zone, other than the owner, with some point within `km`"""
+        owner = self.zone_of(lat, lng)
+        return tuple(zone for zone in range(len(self)) if zone != owner and self.distance_km(zone, lat, lng) <= km)
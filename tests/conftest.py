@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# The server modules import each other as top-level modules (`from db import ...`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "server"))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def migrated_database():
+    """Importing the app no longer creates tables, so migrate once per run"""
+    from migrate import migrate
+
+    migrate()
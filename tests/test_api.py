@@ -1,6 +1,10 @@
+import asyncio
+import json
+import uuid
+
 import pytest
 from httpx import AsyncClient, ASGITransport
-from server.main import app
+from server.main import app, trip_scheduler
 
 @pytest.mark.asyncio
 async def test_home():
@@ -30,6 +34,21 @@ async def test_get_queue():
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
+@pytest.mark.asyncio
+async def test_list_endpoints_use_slim_schemas():
+    from server import schemas
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/book-ride", json={"user_id": 1, "start": "Bangalore", "destination": "Mysore"})
+        queue = await ac.get("/queue")
+        drivers = await ac.get("/available-drivers")
+    assert queue.status_code == 200
+    assert queue.headers["content-type"] == "application/json"
+    assert queue.json()
+    assert set(queue.json()[0]) == set(schemas.QueueRide.model_fields)
+    assert all(set(d) == set(schemas.DriverOut.model_fields) for d in drivers.json())
+
 @pytest.mark.asyncio
 async def test_next_ride():
     transport = ASGITransport(app=app)
@@ -37,3 +56,1108 @@ async def test_next_ride():
         response = await ac.get("/next-ride")
     assert response.status_code == 200
     assert "ride_id" in response.json() or response.json()["message"] == "No pending rides"
+
+@pytest.mark.asyncio
+async def test_health_and_readiness_probes():
+    trip_scheduler.start()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        health = await ac.get("/healthz")
+        ready = await ac.get("/readyz")
+    assert health.status_code == 200
+    assert health.json()["status"] == "ok"
+    assert ready.status_code == 200
+    body = ready.json()
+    assert body["status"] == "ready"
+    assert body["database"]["ready"] is True
+    assert body["scheduler"]["running"] is True
+    assert "class" in body["pool"]
+
+@pytest.mark.asyncio
+async def test_bulk_register_drivers():
+    tag = uuid.uuid4().hex[:8]
+    body = "\n".join([
+        json.dumps({"name": "Bulk A", "email": f"bulk-a-{tag}@test.com", "location": "Delhi",
+                    "latitude": 28.61, "longitude": 77.20, "status": "online"}),
+        json.dumps({"name": "Bulk B", "email": f"bulk-b-{tag}@test.com", "location": "Delhi"}),
+        json.dumps({"name": "Bulk A again", "email": f"bulk-a-{tag}@test.com"}),
+    ])
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post("/bulk-register-drivers?format=ndjson", content=body)
+        again = await ac.post(
+            "/bulk-register-drivers",
+            content=f"name,email\nBulk B,bulk-b-{tag}@test.com\n",
+            headers={"Content-Type": "text/csv"},
+        )
+    result = response.json()
+    assert result["received"] == 3
+    assert result["created"] == 2
+    assert result["ids"][0] == result["ids"][2]
+    assert again.json()["created"] == 0
+    assert again.json()["ids"] == [result["ids"][1]]
+
+@pytest.mark.asyncio
+async def test_simulate_rides_batch_completes_through_scheduler():
+    tag = uuid.uuid4().hex[:8]
+    drivers = "\n".join(
+        json.dumps({"name": f"Sim {i}", "email": f"sim-{i}-{tag}@test.com", "status": "online"})
+        for i in range(5)
+    )
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        driver_ids = (await ac.post("/bulk-register-drivers", content=drivers)).json()["ids"]
+        user_ids = (await ac.post("/bulk-register-users", content=json.dumps(
+            {"name": "Sim rider", "email": f"sim-rider-{tag}@test.com"}))).json()["ids"]
+        response = await ac.post("/simulate-rides-batch", json={
+            "driver_ids": driver_ids, "user_ids": user_ids, "rides": 20, "trip_seconds": 0.1
+        })
+        result = response.json()
+        assert result["count"] == 20
+        assert result["containers"] is False
+        unknown = (await ac.post("/simulate-rides-batch", json={
+            "driver_ids": driver_ids, "user_ids": [user_ids[0], -1], "rides": 2
+        })).json()
+        assert unknown == {"error": "Unknown user_ids: [-1]"}
+        simulated = [(await ac.post("/simulate-rides-batch", json={
+            "driver_ids": driver_ids, "rides": 1, "trip_seconds": 0.1
+        })).json()["ride_ids"][0] for _ in range(2)]
+        riders = [(await ac.get(f"/ride/{ride_id}")).json()["user_name"] for ride_id in simulated]
+        assert riders == ["Simulator", "Simulator"]
+
+        for _ in range(50):
+            statuses = [(await ac.get(f"/ride/{ride_id}")).json()["status"] for ride_id in result["ride_ids"]]
+            if all(status == "completed" for status in statuses):
+                break
+            await asyncio.sleep(0.1)
+    assert all(status == "completed" for status in statuses)
+
+@pytest.mark.asyncio
+async def test_merchant_coupons_conditional_get():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        merchant = (await ac.post("/register-merchant", json={
+            "name": "Etag Cafe", "email": f"etag-{uuid.uuid4().hex[:8]}@example.com",
+            "business_type": "cafe", "address": "MG Road", "latitude": 12.97, "longitude": 77.59,
+        })).json()
+        merchant_id = merchant["merchant_id"]
+        coupon = (await ac.post("/create-merchant-coupon", json={
+            "merchant_id": merchant_id, "code": f"ETAG{uuid.uuid4().hex[:6]}", "title": "Coffee",
+            "description": "10% off", "discount_type": "percentage", "discount_value": 10,
+            "valid_until": "2099-01-01T00:00:00",
+        })).json()
+
+        first = await ac.get(f"/merchant-coupons/{merchant_id}")
+        etag = first.headers["etag"]
+        unchanged = await ac.get(f"/merchant-coupons/{merchant_id}", headers={"If-None-Match": etag})
+        await ac.post(f"/toggle-merchant-coupon/{coupon['coupon_id']}?is_active=false")
+        changed = await ac.get(f"/merchant-coupons/{merchant_id}", headers={"If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert len(first.json()) == 1
+    assert unchanged.status_code == 304
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()[0]["is_active"] is False
+
+@pytest.mark.asyncio
+async def test_changes_feed_follows_ride_lifecycle():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        cursor = (await ac.get("/changes")).json()["cursor"]
+        users = await ac.post(
+            "/bulk-register-users", content=json.dumps({"name": "Feed Rider", "email": f"feed-{uuid.uuid4().hex[:8]}@example.com"}),
+            headers={"content-type": "application/x-ndjson"},
+        )
+        user_id = users.json()["ids"][0]
+        driver_id = (await ac.post(
+            f"/register-driver?name=Feed&email=feed-{uuid.uuid4().hex[:8]}@example.com&location=Indiranagar&latitude=12.97&longitude=77.64"
+        )).json()["driver_id"]
+        await ac.post(f"/go-online?driver_id={driver_id}")
+        ride = (await ac.post("/book-ride", json={
+            "user_id": user_id, "start": "Indiranagar", "destination": "Koramangala",
+            "pickup_lat": 12.971, "pickup_lng": 77.641,
+        })).json()
+        requests = (await ac.get(f"/driver-ride-requests/{driver_id}")).json()
+        request_id = next(r["request_id"] for r in requests if r["ride_id"] == ride["ride_id"])
+        await ac.post(f"/accept-ride-request/{request_id}?driver_id={driver_id}")
+
+        feed = (await ac.get(f"/changes?since={cursor}")).json()
+        page = (await ac.get(f"/changes?since={cursor}&limit=2")).json()
+
+    seqs = [e["seq"] for e in feed["events"]]
+    assert seqs == sorted(seqs) and seqs[0] > cursor
+    assert feed["cursor"] == seqs[-1]
+    ride_events = [e["event_type"] for e in feed["events"] if e["entity"] == "ride" and e["entity_id"] == ride["ride_id"]]
+    assert ride_events == ["created", "assigned"]
+    driver_events = [e["event_type"] for e in feed["events"] if e["entity"] == "driver" and e["entity_id"] == driver_id]
+    assert driver_events == ["registered", "online", "on_trip"]
+    assert page["has_more"] is True and page["cursor"] == seqs[1]
+
+    from events import rebuild_state
+
+    state, _ = rebuild_state(since=cursor)
+    assert state["ride"][ride["ride_id"]]["status"] == "assigned"
+    assert state["driver"][driver_id]["status"] == "on_trip"
+
+@pytest.mark.asyncio
+async def test_reads_use_replica_unless_stale_or_just_written(tmp_path, monkeypatch):
+    import time
+    import db
+    import models
+    from migrate import migrate
+    from sqlalchemy import create_engine, insert
+
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    migrate(create_engine(replica_url))
+    db.configure_replicas([replica_url])
+    with db.replica_engines[0].begin() as conn:
+        conn.execute(insert(models.RideQueue).values(
+            id=987654, user_id=1, start="Replica Start", destination="Replica End", status="completed"
+        ))
+    lag = {"seconds": 0.5}
+    monkeypatch.setattr(db, "replica_lag", lambda index: lag["seconds"])
+
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            from_replica = await ac.get("/ride/987654")
+            booked = await ac.post("/book-ride", json={"user_id": 1, "start": "A", "destination": "B"})
+            just_wrote = await ac.get("/ride/987654", headers={"X-Last-Write": booked.headers["x-last-write"]})
+            wrote_earlier = await ac.get("/ride/987654", headers={"X-Last-Write": str(time.time() - 10)})
+            lag["seconds"] = 30
+            lagging = await ac.get("/ride/987654")
+    finally:
+        db.configure_replicas([])
+
+    assert from_replica.json()["start"] == "Replica Start"
+    assert just_wrote.json() == {"error": "Ride not found"}
+    assert wrote_earlier.json()["start"] == "Replica Start"
+    assert lagging.json() == {"error": "Ride not found"}
+
+def test_archived_partitions_read_back(tmp_path):
+    from datetime import datetime
+    from sqlalchemy import create_engine
+    import models
+    import partitioning
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'rides.db'}")
+    models.RideQueue.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(models.RideQueue.__table__.insert(), [
+            {"user_id": 1, "start": "A", "destination": "B", "status": status, "final_fare": fare,
+             "created_at": datetime(2024, 1, 1, 8, i)}
+            for i, (status, fare) in enumerate([("completed", 120.5), ("completed", 80.0), ("no_drivers", None)])
+        ])
+    with engine.connect() as conn:
+        assert partitioning.export_partition(conn, "ride_queue", "ride_queue", str(tmp_path), "parquet")[1] == 3
+        partitioning.EXPORT_BATCH_SIZE, batch = 2, partitioning.EXPORT_BATCH_SIZE
+        try:
+            path, rows = partitioning.export_partition(conn, "ride_queue", "ride_queue", str(tmp_path / "ipc"), "arrow")
+        finally:
+            partitioning.EXPORT_BATCH_SIZE = batch
+    assert rows == 3 and path.endswith(".arrow")
+
+    import pyarrow.dataset as ds
+    for out_dir in (tmp_path, tmp_path / "ipc"):
+        archived = partitioning.read_archive("ride_queue", str(out_dir))
+        assert archived.column("status").to_pylist() == ["completed", "completed", "no_drivers"]
+        assert archived.column("created_at").to_pylist()[0] == datetime(2024, 1, 1, 8, 0)
+        completed = partitioning.read_archive("ride_queue", str(out_dir), columns=["final_fare"],
+                                              filter=ds.field("status") == "completed")
+        assert completed.column("final_fare").to_pylist() == [120.5, 80.0]
+    assert partitioning.read_archive("ride_requests", str(tmp_path)).num_rows == 0
+
+@pytest.mark.asyncio
+async def test_concurrent_accepts_assign_ride_once():
+    import random
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        # Somewhere quiet, so drivers left online by earlier runs don't crowd out these 20
+        lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+        drivers = await ac.post(
+            "/bulk-register-drivers",
+            content="\n".join(json.dumps({
+                "name": f"Racer {i}", "email": f"race-{tag}-{i}@example.com", "location": "Whitefield",
+                "latitude": lat, "longitude": lng, "status": "online",
+            }) for i in range(20)),
+            headers={"content-type": "application/x-ndjson"},
+        )
+        driver_ids = set(drivers.json()["ids"])
+        users = await ac.post(
+            "/bulk-register-users", content=json.dumps({"name": "Racer Rider", "email": f"race-{tag}@example.com"}),
+            headers={"content-type": "application/x-ndjson"},
+        )
+        ride = (await ac.post("/book-ride", json={
+            "user_id": users.json()["ids"][0], "start": "Whitefield", "destination": "Marathahalli",
+            "pickup_lat": lat, "pickup_lng": lng,
+        })).json()
+        requests = {}
+        for driver_id in driver_ids:
+            for r in (await ac.get(f"/driver-ride-requests/{driver_id}")).json():
+                if r["ride_id"] == ride["ride_id"]:
+                    requests[driver_id] = r["request_id"]
+        assert len(requests) == len(driver_ids)
+
+        answers = await asyncio.gather(*[
+            ac.post(f"/accept-ride-request/{request_id}?driver_id={driver_id}")
+            for driver_id, request_id in requests.items()
+        ])
+        queue = (await ac.get("/queue")).json()
+
+    results = [a.json() for a in answers]
+    winners = [r for r in results if r.get("message") == "Ride accepted"]
+    assert len(winners) == 1
+    assert all(r.get("status") == "taken" for r in results if r not in winners)
+    assigned = next(r for r in queue if r["id"] == ride["ride_id"])
+    assert assigned["status"] == "assigned" and assigned["driver_id"] in driver_ids
+
+RIVER_TOWN_OSM = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="1.0" lon="1.0"/><node id="2" lat="1.0" lon="1.01"/><node id="3" lat="1.0" lon="1.02"/>
+  <node id="4" lat="1.0" lon="1.03"/><node id="5" lat="1.0" lon="1.04"/><node id="6" lat="1.0" lon="1.05"/>
+  <node id="11" lat="1.01" lon="1.0"/><node id="12" lat="1.01" lon="1.01"/><node id="13" lat="1.01" lon="1.02"/>
+  <node id="14" lat="1.01" lon="1.03"/><node id="15" lat="1.01" lon="1.04"/><node id="16" lat="1.01" lon="1.05"/>
+  <node id="99" lat="1.005" lon="1.025"/>
+  <way id="100"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="5"/><nd ref="6"/>
+    <tag k="highway" v="residential"/></way>
+  <way id="101"><nd ref="11"/><nd ref="12"/><nd ref="13"/><nd ref="14"/><nd ref="15"/><nd ref="16"/>
+    <tag k="highway" v="residential"/></way>
+  <way id="102"><nd ref="6"/><nd ref="16"/><tag k="highway" v="primary"/><tag k="bridge" v="yes"/></way>
+  <way id="103"><nd ref="99"/><nd ref="3"/><tag k="waterway" v="river"/></way>
+</osm>
+"""
+
+def test_road_network_routes_around_the_river(tmp_path):
+    from road_network import RoadNetwork, _speed_kmh
+
+    osm = tmp_path / "river.osm"
+    osm.write_text(RIVER_TOWN_OSM)
+    network = RoadNetwork.load(str(osm), landmarks=3)
+    assert network.node_count == 12  # the river is not a road
+    assert (tmp_path / "river.osm.rnet").exists()
+
+    # 1.1km apart as the crow flies, but the only bridge is 5.5km east
+    across = network.eta(1.0, 1.0, 1.01, 1.0)
+    along = network.eta(1.0, 1.0, 1.0, 1.02)
+    assert across > 2 * along
+    assert network.etas_to(1.0, 1.0, [(1.01, 1.0), (1.0, 1.02), (40.0, 40.0)]) == [
+        pytest.approx(across), pytest.approx(along), None,
+    ]
+    cached = RoadNetwork.load(str(osm))
+    assert cached.eta(1.0, 1.0, 1.01, 1.0) == pytest.approx(across)
+    assert len(cached.landmarks) == 3
+    # Unusable limits fall back to the road class, so edge weights stay positive
+    assert [_speed_kmh({"highway": "primary", "maxspeed": v}) for v in ("0", "-30", "nan", "inf", "30 mph", "60")] == [
+        50, 50, 50, 50, pytest.approx(48.27), 60.0,
+    ]
+
+@pytest.mark.asyncio
+async def test_book_ride_ranks_drivers_by_road_eta(tmp_path, monkeypatch):
+    import road_network
+
+    osm = tmp_path / "river.osm"
+    osm.write_text(RIVER_TOWN_OSM)
+    monkeypatch.setattr(road_network, "_network", road_network.RoadNetwork.load(str(osm)))
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        drivers = await ac.post(
+            "/bulk-register-drivers",
+            content="\n".join(json.dumps({
+                "name": name, "email": f"{name}-{tag}@example.com", "location": "River Town",
+                "latitude": lat, "longitude": lng, "status": "online",
+            }) for name, lat, lng in [("north", 1.01, 1.0), ("south", 1.0, 1.02)]),
+            headers={"content-type": "application/x-ndjson"},
+        )
+        north, south = drivers.json()["ids"]
+        ride = (await ac.post("/book-ride", json={
+            "user_id": 1, "start": "South Bank", "destination": "Bridge",
+            "pickup_lat": 1.0, "pickup_lng": 1.0,
+        })).json()
+        offers = {}
+        for driver_id in (north, south):
+            for r in (await ac.get(f"/driver-ride-requests/{driver_id}")).json():
+                if r["ride_id"] == ride["ride_id"]:
+                    offers[driver_id] = r["eta_seconds"]
+        for driver_id in (north, south):
+            await ac.post(f"/go-offline?driver_id={driver_id}")
+
+    assert ride["pickup_eta_seconds"] == pytest.approx(offers[south])
+    assert offers[south] < offers[north]
+
+@pytest.mark.asyncio
+async def test_booking_does_not_wait_for_the_road_network_to_load(tmp_path, monkeypatch):
+    import random
+    from server import main as api
+    import road_network
+
+    osm = tmp_path / "river.osm"
+    osm.write_text(RIVER_TOWN_OSM)
+    monkeypatch.setattr(road_network, "ROAD_NETWORK_PATH", str(osm))
+    monkeypatch.setattr(road_network, "_network", None)
+    monkeypatch.setattr(road_network, "_network_failed", False)
+    monkeypatch.setattr(api, "DISPATCH_CANDIDATES", 1)
+    lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        near, far = (await ac.post(
+            "/bulk-register-drivers",
+            content="\n".join(json.dumps({
+                "name": name, "email": f"loading-{name}-{tag}@example.com", "location": "Loading",
+                "latitude": lat + offset, "longitude": lng, "status": "online",
+            }) for name, offset in [("near", 0.01), ("far", 0.02)]),
+            headers={"content-type": "application/x-ndjson"},
+        )).json()["ids"]
+        # As if the startup thread were still compiling the extract
+        assert road_network._network_lock.acquire(timeout=5)
+        try:
+            ride = (await asyncio.wait_for(ac.post("/book-ride", json={
+                "user_id": 1, "start": "Loading", "destination": "Elsewhere", "pickup_lat": lat, "pickup_lng": lng,
+            }), timeout=5)).json()
+        finally:
+            road_network._network_lock.release()
+        offered = [bool((await ac.get(f"/driver-ride-requests/{driver_id}")).json()) for driver_id in (near, far)]
+        for driver_id in (near, far):
+            await ac.post(f"/go-offline?driver_id={driver_id}")
+
+    assert ride["nearby_drivers"] == 1 and ride["pickup_eta_seconds"] is None
+    assert offered == [True, False]
+    assert road_network._network is None
+
+@pytest.mark.asyncio
+async def test_geocoding_is_served_from_the_local_gazetteer():
+    import db
+    import models
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        typed = (await ac.get("/autocomplete?q=Kora")).json()
+        suffix = (await ac.get("/autocomplete?q=5th%20bl")).json()
+        alias = (await ac.get("/autocomplete?q=bengaluru&limit=1")).json()
+        found = (await ac.get("/geocode", params={"q": "Koramangala, Bangalore"})).json()
+        missing = (await ac.get("/geocode?q=Atlantis")).json()
+        partial = [(await ac.get("/geocode", params={"q": q})).json() for q in ("A", "M", "Ko", "Koram")]
+        alias_word = (await ac.get("/geocode", params={"q": "Bombay"})).json()
+        ride = (await ac.post("/book-ride", json={
+            "user_id": 1, "start": "Indiranagar", "destination": "Electronic City",
+        })).json()
+
+    session = db.SessionLocal()
+    try:
+        placed = session.get(models.RideQueue, ride["ride_id"])
+    finally:
+        session.close()
+    assert [p["name"] for p in typed[:2]] == ["Koramangala", "Koramangala 5th Block"]
+    assert suffix[0]["name"] == "Koramangala 5th Block"
+    assert [p["name"] for p in alias] == ["Bangalore"]
+    assert found["name"] == "Koramangala" and found["lat"] == pytest.approx(12.9352)
+    assert missing == {"error": "Location not found"}
+    assert partial == [{"error": "Location not found"}] * 4
+    assert alias_word["name"] == "Mumbai"
+    assert (placed.pickup_lat, placed.pickup_lng) == pytest.approx((12.9784, 77.6408))
+    assert (placed.dest_lat, placed.dest_lng) == pytest.approx((12.8452, 77.6602))
+
+@pytest.mark.asyncio
+async def test_accepted_ride_page_is_served_without_a_container():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        driver_id = (await ac.post(
+            f"/register-driver?name=</script>Pat&email=page-{tag}@example.com&location=Sea%20Point&latitude=-33.91&longitude=18.39"
+        )).json()["driver_id"]
+        await ac.post(f"/go-online?driver_id={driver_id}")
+        ride = (await ac.post("/book-ride", json={
+            "user_id": 1, "start": "Sea Point", "destination": "Camps Bay",
+            "pickup_lat": -33.91, "pickup_lng": 18.39,
+        })).json()
+        request_id = (await ac.get(f"/driver-ride-requests/{driver_id}")).json()[0]["request_id"]
+        accepted = (await ac.post(f"/accept-ride-request/{request_id}?driver_id={driver_id}")).json()
+        page = await ac.get(f"/ride/{ride['ride_id']}/view")
+        missing = await ac.get("/ride/0/view")
+        simulated = (await ac.post(f"/simulate-ride-with-driver?user_id=1&driver_id={driver_id}")).json()
+        await ac.post(f"/go-offline?driver_id={driver_id}")
+
+    assert accepted["ride_port"] is None
+    assert (simulated["port"], simulated["container_name"]) == (None, None)
+    assert simulated["ride_url"].endswith(f"/ride/{simulated['ride_id']}/view")
+    assert accepted["ride_url"].endswith(f"/ride/{ride['ride_id']}/view")
+    assert page.headers["content-type"].startswith("text/html")
+    embedded = json.loads(page.text.split("window.RIDE = ", 1)[1].split(";</script>", 1)[0])
+    assert embedded["ride_id"] == ride["ride_id"] and embedded["port"] is None
+    assert (embedded["driver_name"], embedded["status"]) == ("</script>Pat", "assigned")
+    assert "</script>Pat" not in page.text
+    assert missing.json() == {"error": "Ride not found"}
+
+@pytest.mark.asyncio
+async def test_batch_heartbeats_drop_out_of_order_fixes(monkeypatch):
+    import struct
+    import time
+    import heartbeats
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        drivers = await ac.post(
+            "/bulk-register-drivers",
+            content="\n".join(json.dumps({
+                "name": f"Relay {i}", "email": f"relay-{tag}-{i}@example.com", "location": "Relay",
+                "status": status,
+            }) for i, status in enumerate(["online", "offline"])),
+            headers={"content-type": "application/x-ndjson"},
+        )
+        fresh, parked = drivers.json()["ids"]
+        first = (await ac.post("/heartbeats", json=[
+            {"driver_id": fresh, "lat": 12.91, "lng": 77.61, "ts": 1700000020},
+            {"driver_id": fresh, "lat": 12.90, "lng": 77.60, "ts": 1700000010},
+            [parked, 12.95, 77.65, 1700000000],
+            {"driver_id": 2**31 - 1, "lat": 12.9, "lng": 77.6, "ts": 1700000000},
+            {"driver_id": fresh, "lat": 123.0, "lng": 77.6},
+        ])).json()
+        late = await ac.post(
+            "/heartbeats",
+            content=struct.pack("<Iddd", fresh, 1.0, 1.0, 1700000015) + struct.pack("<Iddd", parked, 12.96, 77.66, 1700000030),
+            headers={"content-type": "application/octet-stream"},
+        )
+        torn = (await ac.post("/heartbeats", content=b"\x00" * 27, headers={"content-type": "application/octet-stream"})).json()
+        online = {d["id"]: d for d in (await ac.get("/available-drivers")).json()}
+        # A fix far in the future would make every correct one after it stale
+        skewed = (await ac.post("/heartbeats", json=[
+            {"driver_id": fresh, "lat": 1.0, "lng": 1.0, "ts": time.time() + 3600},
+            {"driver_id": parked, "lat": 12.97, "lng": 77.67, "ts": time.time() + 1},
+        ])).json()
+        monkeypatch.setattr(heartbeats, "LOOKUP_BATCH_SIZE", 2)
+        chunked = (await ac.post("/heartbeats", json=[
+            {"driver_id": fresh, "lat": 12.92, "lng": 77.62, "ts": time.time()},
+            {"driver_id": 2**31 - 2, "lat": 12.9, "lng": 77.6},
+            {"driver_id": 2**31 - 3, "lat": 12.9, "lng": 77.6},
+            {"driver_id": parked, "lat": 12.9, "lng": 77.6, "ts": 1700000000},
+        ])).json()
+        await ac.post(f"/go-offline?driver_id={fresh}")
+        await ac.post(f"/go-offline?driver_id={parked}")
+
+    assert first["results"] == ["ok", "stale", "ok", "unknown_driver", "invalid"]
+    assert (first["applied"], first["stale"], first["unknown"], first["invalid"]) == (2, 1, 1, 1)
+    assert late.json()["results"] == ["stale", "ok"]
+    assert "error" in torn
+    assert (online[fresh]["latitude"], online[fresh]["longitude"]) == (12.91, 77.61)
+    assert (online[parked]["latitude"], online[parked]["longitude"]) == (12.96, 77.66)
+    assert skewed["results"] == ["invalid", "ok"]
+    assert chunked["results"] == ["ok", "unknown_driver", "unknown_driver", "stale"]
+
+@pytest.mark.asyncio
+async def test_ride_path_joins_flushed_and_buffered_points():
+    import time
+    from server import main as api
+    import location_history
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        driver_id = (await ac.post(
+            f"/register-driver?name=Trail&email=trail-{tag}@example.com&location=Harbour&latitude=64.14&longitude=-21.94"
+        )).json()["driver_id"]
+        await ac.post(f"/go-online?driver_id={driver_id}")
+        ride = (await ac.post("/book-ride", json={
+            "user_id": 1, "start": "Harbour", "destination": "Old Town",
+            "pickup_lat": 64.14, "pickup_lng": -21.94,
+        })).json()
+        request_id = (await ac.get(f"/driver-ride-requests/{driver_id}")).json()[0]["request_id"]
+        await ac.post(f"/accept-ride-request/{request_id}?driver_id={driver_id}")
+
+        now = time.time()
+        for lat, offset in [(64.1400, 1), (64.14001, 2), (64.1410, 3)]:  # the second is a metre away
+            await ac.post("/heartbeats", json=[[driver_id, lat, -21.94, now + offset]])
+        assert api.driver_tracks.flush() >= 2
+        await ac.post("/heartbeats", json=[[driver_id, 64.1420, -21.94, now + 4]])
+        path = (await ac.get(f"/ride/{ride['ride_id']}/path")).json()
+        missing = (await ac.get("/ride/0/path")).json()
+        await ac.post(f"/go-offline?driver_id={driver_id}")
+
+    assert path["driver_id"] == driver_id and path["points"] == 3
+    assert [point[0] for point in path["path"]] == [64.14, 64.141, 64.142]
+    assert path["path"][2][2] == pytest.approx(now + 4, abs=0.1)
+    assert location_history.decode(path["polyline"], 2, location_history.COORDINATE_SCALE) == [
+        (64.14, -21.94), (64.141, -21.94), (64.142, -21.94)
+    ]
+    assert missing == {"error": "Ride not found"}
+
+@pytest.mark.asyncio
+async def test_nearest_drivers_and_merchants_come_from_geohash_cells(monkeypatch):
+    import random
+    from server import main as api
+    import db
+    import geo
+    import models
+
+    monkeypatch.setattr(api, "DISPATCH_CANDIDATES", 2)
+    # A fresh spot per run so rows left by earlier runs are never nearer
+    lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        offsets = [0.004, 0.001, 0.03, 0.002]  # degrees north of the pickup
+        drivers = (await ac.post(
+            "/bulk-register-drivers",
+            content="\n".join(json.dumps({
+                "name": f"Cell {i}", "email": f"cell-{tag}-{i}@example.com", "location": "Cell",
+                "latitude": lat + offset, "longitude": lng, "status": "online",
+            }) for i, offset in enumerate(offsets)),
+            headers={"content-type": "application/x-ndjson"},
+        )).json()["ids"]
+        # Moving the nearest driver away keeps its cell current
+        await ac.post(f"/heartbeat?driver_id={drivers[1]}&latitude={lat + 0.05}&longitude={lng}")
+        ride = (await ac.post("/book-ride", json={
+            "user_id": 1, "start": "Cell", "destination": "Elsewhere", "pickup_lat": lat, "pickup_lng": lng,
+        })).json()
+        offered = [bool((await ac.get(f"/driver-ride-requests/{driver_id}")).json()) for driver_id in drivers]
+
+        merchants = []
+        for name, offset, radius in [("Near", 0.002, 0.5), ("Wide", 0.02, 3), ("Far", 0.02, 0.5)]:
+            merchant_id = (await ac.post("/register-merchant", json={
+                "name": f"{name} {tag}", "email": f"{name.lower()}-{tag}@example.com", "business_type": "cafe",
+                "address": "Cell", "latitude": lat + offset, "longitude": lng,
+            })).json()["merchant_id"]
+            await ac.post("/create-merchant-coupon", json={
+                "merchant_id": merchant_id, "code": f"{name.upper()}{tag}", "title": name,
+                "description": "Nearby", "discount_type": "flat", "discount_value": 10,
+                "valid_until": "2099-01-01T00:00:00", "radius_km": radius,
+            })
+            merchants.append(merchant_id)
+        coupons = (await ac.get(f"/nearby-merchant-coupons?user_id=1&dest_lat={lat}&dest_lng={lng}")).json()
+        for driver_id in drivers:
+            await ac.post(f"/go-offline?driver_id={driver_id}")
+        # The 3km coupon would otherwise turn up in later runs' random spots
+        for merchant_id in merchants:
+            await ac.delete(f"/delete-merchant/{merchant_id}")
+
+    session = db.SessionLocal()
+    try:
+        cells = dict(session.query(models.Driver.id, models.Driver.geohash).filter(models.Driver.id.in_(drivers)))
+    finally:
+        session.close()
+    assert cells[drivers[0]] == geo.encode(lat + 0.004, lng)
+    assert cells[drivers[1]] == geo.encode(lat + 0.05, lng)
+    assert ride["nearby_drivers"] == 2
+    assert offered == [True, False, False, True]
+    assert [c["merchant_name"] for c in coupons] == [f"Near {tag}", f"Wide {tag}"]
+    assert coupons[0]["distance_km"] == pytest.approx(0.22, abs=0.01)
+
+@pytest.mark.asyncio
+async def test_dispatch_workers_see_ghosts_across_zone_borders(monkeypatch):
+    import random
+    from server import main as api
+    import dispatch_pool
+    import zones
+
+    # Two zones split at `lng`, each owned by its own worker process
+    lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+    monkeypatch.setattr(api, "DISPATCH_CANDIDATES", 2)
+    pool = dispatch_pool.DispatchPool(
+        workers=2, zones=zones.ZoneGrid([lat - 0.1, lng - 0.1, lat + 0.1, lng + 0.1], cols=2, border_km=1),
+        network_path="",
+    )
+    monkeypatch.setattr(api, "dispatcher", pool)
+    pool.start()
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            tag = uuid.uuid4().hex[:8]
+            drivers = []
+            # West near the border, east 3km in, west 5km out
+            for i, offset in enumerate([-0.005, 0.04, -0.065]):
+                driver_id = (await ac.post(
+                    f"/register-driver?name=Zone{i}&email=zone-{tag}-{i}@example.com&location=Zone"
+                    f"&latitude={lat}&longitude={lng + offset}"
+                )).json()["driver_id"]
+                await ac.post(f"/go-online?driver_id={driver_id}")
+                drivers.append(driver_id)
+
+            async def book():
+                ride = (await ac.post("/book-ride", json={
+                    "user_id": 1, "start": "Zone", "destination": "Elsewhere",
+                    "pickup_lat": lat, "pickup_lng": lng + 0.002,
+                })).json()
+                offered = []
+                for driver_id in drivers:
+                    requests = (await ac.get(f"/driver-ride-requests/{driver_id}")).json()
+                    offered.append(any(r["ride_id"] == ride["ride_id"] for r in requests))
+                return offered
+
+            across_border = await book()
+            # The west driver heads deep into its zone, behind the other two
+            await ac.post(f"/heartbeat?driver_id={drivers[0]}&latitude={lat}&longitude={lng - 0.09}")
+            handed_off = await book()
+            status = (await ac.get("/dispatch/status")).json()
+            for driver_id in drivers:
+                await ac.post(f"/go-offline?driver_id={driver_id}")
+    finally:
+        pool.stop()
+
+    assert across_border == [True, True, False]
+    # A stale ghost at the old spot would still be offered first
+    assert handed_off == [False, True, True]
+    assert [worker["open_rides"] for worker in status["workers"]] == [0, 2]
+
+def test_dispatch_pool_finds_drivers_beyond_the_border_ghosts():
+    import dispatch_pool
+    import zones
+
+    # Split at longitude 0, ghosts reach 1km; a degree is about 111km here
+    pool = dispatch_pool.DispatchPool(
+        workers=2, zones=zones.ZoneGrid([-1, -1, 1, 1], cols=2, border_km=1), network_path="",
+    )
+    pool.start()
+    try:
+        pool.update_drivers([(1, 0.0, -0.05, "online")])  # 5.5km into the west zone
+        across = pool.dispatch(0.0, 0.002, 5, 100)
+        empty_zone = pool.dispatch(0.0, 0.5, 5, 100)
+        out_of_range = pool.dispatch(0.0, 0.5, 5, 10)
+        pool.update_drivers([(2, 0.0, 0.01, "online")])  # 0.9km from the pickup, same zone
+        nearest = pool.dispatch(0.0, 0.002, 1, 100)
+        both = pool.dispatch(0.0, 0.002, 2, 100)
+    finally:
+        pool.stop()
+
+    assert [driver_id for driver_id, _, _ in across] == [1]
+    assert across[0][1] == pytest.approx(5.78, abs=0.05)
+    assert [driver_id for driver_id, _, _ in empty_zone] == [1] and out_of_range == []
+    assert [driver_id for driver_id, _, _ in nearest] == [2]
+    assert [driver_id for driver_id, _, _ in both] == [2, 1]
+
+@pytest.mark.asyncio
+async def test_heartbeats_are_throttled_per_driver(monkeypatch):
+    import rate_limit
+    from server import main as api
+
+    monkeypatch.setattr(api, "rate_limiter", rate_limit.RateLimiter({
+        "/heartbeat": {"key": "driver", "rate": 0.01, "burst": 2},
+    }))
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        chatty = [await ac.post("/heartbeat?driver_id=999001") for _ in range(3)]
+        quiet = await ac.post("/heartbeat?driver_id=999002")
+        counters = (await ac.get("/metrics")).json()["counters"]
+
+    assert [r.status_code for r in chatty] == [200, 200, 429]
+    assert chatty[2].headers["retry-after"] == "100"
+    assert chatty[2].json()["error"] == "Too many requests"
+    assert quiet.status_code == 200
+    assert counters["rate_limit.throttled./heartbeat"] >= 1
+
+@pytest.mark.asyncio
+async def test_low_priority_requests_are_shed_first(monkeypatch):
+    import load_shedding
+    from server import main as api
+
+    shedder = load_shedding.LoadShedder(
+        thresholds={"low": {"in_flight": 3, "waiting": 100}, "normal": {"in_flight": 10}},
+        priorities={"/queue": "low", "/heartbeat": "critical"},
+    )
+    monkeypatch.setattr(api, "load_shedder", shedder)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        shedder.in_flight = 5  # as if five slow requests were still running
+        listing = await ac.get("/queue")
+        catalog = await ac.get("/coupons")
+        heartbeat = await ac.post("/heartbeat?driver_id=999003")
+        shedder.in_flight = 0
+        recovered = await ac.get("/queue")
+        counters = (await ac.get("/metrics")).json()["counters"]
+
+    assert listing.status_code == 503 and listing.headers["retry-after"] == "1"
+    assert catalog.status_code == 200
+    assert heartbeat.status_code == 200
+    assert recovered.status_code == 200
+    assert counters["load_shed.shed.low"] >= 1
+    assert shedder.priority("/queue") == "low" and shedder.priority("/coupons") == "normal"
+
+class FakeDockerEngine:
+    """Just enough of the Docker Engine API, on a unix socket, for the container inventory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.containers = {}
+        self.archives = {}
+        self.subscribers = []
+
+    def add(self, name, state="running", port=None):
+        container_id = uuid.uuid4().hex
+        self.containers[container_id] = {
+            "Id": container_id, "Names": [f"/{name}"], "State": state, "Status": state.title(),
+            "Ports": [{"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": port, "Type": "tcp"}] if port else [],
+        }
+        return container_id
+
+    def emit(self, action, container_id, name):
+        event = {"Type": "container", "Action": action, "Actor": {"ID": container_id, "Attributes": {"name": name}}}
+        for queue in self.subscribers:
+            queue.put_nowait(event)
+
+    def find(self, name_or_id):
+        return next((cid for cid, c in self.containers.items() if name_or_id in (cid, c["Names"][0][1:])), None)
+
+    async def handle(self, reader, writer):
+        from urllib.parse import parse_qs, urlsplit
+
+        method, target, _ = (await reader.readline()).decode().split()
+        headers = {}
+        while (line := await reader.readline()) != b"\r\n":
+            key, _, value = line.decode().partition(":")
+            headers[key.lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+        url = urlsplit(target)
+        path, query = url.path.split("/", 2)[2], parse_qs(url.query)
+
+        def reply(status, payload=None):
+            data = json.dumps(payload).encode() if payload is not None else b""
+            writer.write(f"HTTP/1.1 {status} X\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+
+        if path == "events":
+            queue = asyncio.Queue()
+            self.subscribers.append(queue)
+            writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+            while True:
+                data = json.dumps(await queue.get()).encode() + b"\n"
+                writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                await writer.drain()
+        elif path == "containers/json":
+            filters = json.loads(query["filters"][0])
+            ids = filters.get("id")
+            reply(200, [c for cid, c in self.containers.items() if ids is None or cid in ids])
+        elif path == "containers/create":
+            name = query["name"][0]
+            port = json.loads(body)["HostConfig"]["PortBindings"]["80/tcp"][0]["HostPort"]
+            container_id = self.add(name, state="created")
+            self.containers[container_id]["_port"] = int(port)
+            self.emit("create", container_id, name)
+            reply(201, {"Id": container_id})
+        elif path.endswith("/archive"):
+            self.archives[path.split("/")[1]] = body
+            reply(200)
+        elif path.endswith("/start"):
+            container_id = path.split("/")[1]
+            container = self.containers[container_id]
+            container.update(State="running", Status="Running", Ports=[
+                {"IP": "0.0.0.0", "PrivatePort": 80, "PublicPort": container.pop("_port"), "Type": "tcp"}
+            ])
+            self.emit("start", container_id, container["Names"][0][1:])
+            reply(204)
+        elif method == "DELETE":
+            container_id = self.find(path.split("/")[1])
+            if container_id is None:
+                reply(404, {"message": "No such container"})
+            else:
+                name = self.containers.pop(container_id)["Names"][0][1:]
+                self.emit("destroy", container_id, name)
+                reply(204)
+        else:
+            reply(404, {"message": "Unsupported"})
+        await writer.drain()
+        writer.close()
+
+    def serve(self):
+        """Run the fake engine on its own loop in a daemon thread"""
+        import threading
+
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def run():
+            await asyncio.start_unix_server(self.handle, path=self.path)
+            started.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=loop.run_until_complete, args=(run(),), daemon=True).start()
+        started.wait(5)
+
+def wait_for(condition, timeout=5):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.02)
+
+@pytest.mark.asyncio
+async def test_ride_containers_follow_the_docker_event_stream(tmp_path, monkeypatch):
+    import io
+    import tarfile
+    from docker_inventory import DockerInventory
+    from server import main as api
+
+    engine = FakeDockerEngine(str(tmp_path / "docker.sock"))
+    engine.add("ride-1", port=7001)
+    engine.add("postgres", port=5432)
+    engine.serve()
+    html = tmp_path / "index.html"
+    html.write_text("<h1>ride</h1>")
+
+    inventory = DockerInventory(engine.path)
+    monkeypatch.setattr(api, "container_inventory", inventory)
+    inventory.start()
+    try:
+        wait_for(lambda: inventory.synced)
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            listed = (await ac.get("/ride-containers")).json()
+
+            assert inventory.submit(inventory.create_ride_container(2, 7002, str(html))).result(5)
+            wait_for(lambda: any(c["name"] == "ride-2" and c["state"] == "running" for c in inventory.containers()))
+            assert inventory.submit(inventory.remove_ride_container(1)).result(5)
+            wait_for(lambda: all(c["name"] != "ride-1" for c in inventory.containers()))
+            after = (await ac.get("/ride-containers")).json()
+    finally:
+        inventory.stop()
+
+    assert listed["containers"] == [{"name": "ride-1", "ports": "0.0.0.0:7001->80/tcp", "status": "Running"}]
+    assert "error" not in listed
+    assert after["containers"] == [{"name": "ride-2", "ports": "0.0.0.0:7002->80/tcp", "status": "Running"}]
+    (archive,) = engine.archives.values()
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert tar.extractfile("index.html").read() == b"<h1>ride</h1>"
+
+@pytest.mark.asyncio
+async def test_cleanup_simulation_data_purges_in_batches():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/bulk-register-users", content=json.dumps(
+            {"name": "Temp", "email": f"temp-{uuid.uuid4().hex[:8]}@test.com"}))
+        response = await ac.post("/cleanup-simulation-data")
+        status = (await ac.get("/retention/status")).json()
+    assert response.json()["deleted_users"] >= 1
+    assert status["tables"]["users"]["running"] is False
+    assert status["tables"]["users"]["batches"] >= 1
+
+def test_retention_keeps_ride_history_unless_opted_in(monkeypatch):
+    import retention
+
+    monkeypatch.delenv("RETENTION_POLICIES", raising=False)
+    assert set(retention.load_policies()) == {"ride_requests"}
+    monkeypatch.setenv("RETENTION_POLICIES", json.dumps({
+        "ride_queue": {"statuses": ["completed"], "max_age_days": 30}, "ride_requests": None,
+    }))
+    assert retention.load_policies() == {"ride_queue": {"statuses": ["completed"], "max_age_days": 30}}
+
+@pytest.mark.asyncio
+async def test_captured_traffic_replays_with_remapped_ids(tmp_path, monkeypatch):
+    import random
+    from server import main as api
+    import replay_traffic
+    import traffic_capture
+
+    recorder = traffic_capture.TrafficRecorder(str(tmp_path), anonymize=True)
+    monkeypatch.setattr(api, "traffic_recorder", recorder)
+    lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        email = f"replay-{uuid.uuid4().hex[:8]}@example.com"
+        driver_id = (await ac.post(
+            f"/register-driver?name=Replay&email={email}&location=Quay&latitude={lat}&longitude={lng}"
+        )).json()["driver_id"]
+        await ac.post(f"/go-online?driver_id={driver_id}")
+        await ac.post("/book-ride", json={
+            "user_id": 1, "start": "Quay", "destination": "Ridge", "pickup_lat": lat, "pickup_lng": lng,
+        })
+        request_id = (await ac.get(f"/driver-ride-requests/{driver_id}")).json()[0]["request_id"]
+        accepted = (await ac.post(f"/accept-ride-request/{request_id}?driver_id={driver_id}")).json()
+        await ac.get("/healthz")
+        recorder.flush()
+        captured = "".join(open(path).read() for path in recorder.files())
+
+        monkeypatch.setattr(api, "traffic_recorder", None)
+        records = replay_traffic.load([str(tmp_path)])
+        results = await replay_traffic.replay(records, ac, speed=float("inf"))
+        report = replay_traffic.summarize(results)
+        await ac.post(f"/go-offline?driver_id={driver_id}")
+
+    assert "error" not in accepted
+    assert email not in captured and "%40anon.invalid" in captured  # query strings stay url-encoded
+    assert "Quay" not in captured and "Ridge" not in captured
+    listed = next(r for r in records if r["path"].startswith("/driver-ride-requests/"))
+    offer = json.loads(listed["response"])[0]
+    assert all(offer[key].startswith("anon-") for key in ("user_name", "pickup", "destination"))
+    assert [r["path"] for r in records][:2] == ["/register-driver", "/go-online"] and len(records) == 5
+    # The replayed driver is a new row, so every later id had to be rewritten
+    accept = results[-1]
+    assert accept["template"] == "POST /accept-ride-request/{request_id}"
+    assert accept["url"] != f"/accept-ride-request/{request_id}?driver_id={driver_id}"
+    assert [r["error"] for r in results] == [None] * 5
+    assert all(row["status_mismatches"] == 0 for row in report.values())
+
+@pytest.mark.asyncio
+async def test_coupon_zones_match_the_same_way_everywhere():
+    import zone_matcher
+
+    matcher = zone_matcher.ZoneMatcher([("he", 1), ("she", 2), ("hers", 3), ("His", 4)])
+    assert matcher.search("USHERS") == {1, 2, 3} and matcher.search("this") == {4} and matcher.search("") == set()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        created = {}
+        for zone in [f"Lakeview {tag}", f"View {tag}", f"Hillside {tag}"]:
+            created[zone] = (await ac.post("/create-coupon", json={
+                "code": f"Z-{zone}", "discount_type": "flat", "discount_value": 10,
+                "valid_until": "2999-01-01T00:00:00", "zone": zone,
+            })).json()["coupon_id"]
+        location = f"12 Pier Rd,  LAKEVIEW {tag.upper()}"
+        listed = (await ac.get("/user-coupons/1", params={"location": location})).json()
+        valid = {zone: (await ac.post("/validate-coupon", params={
+            "user_id": 1, "code": f"Z-{zone}", "fare": 100, "location": location,
+        })).json()["valid"] for zone in created}
+
+    zoned = {c["id"] for c in listed if c["zone"]}
+    assert zoned & set(created.values()) == {created[f"Lakeview {tag}"], created[f"View {tag}"]}
+    assert valid == {f"Lakeview {tag}": True, f"View {tag}": True, f"Hillside {tag}": False}
+
+@pytest.mark.asyncio
+async def test_merchant_offers_are_cached_per_destination_cell():
+    import random
+    import metrics
+    import offer_cache
+
+    lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+    _, lat, lng, _ = offer_cache.cell(lat, lng)  # the centre, so both destinations share a cell
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        tag = uuid.uuid4().hex[:8]
+        merchant_id = (await ac.post("/register-merchant", json={
+            "name": f"Mall {tag}", "email": f"mall-{tag}@example.com", "business_type": "mall",
+            "address": "Mall", "latitude": lat + 0.003, "longitude": lng,
+        })).json()["merchant_id"]
+        coupon_id = (await ac.post("/create-merchant-coupon", json={
+            "merchant_id": merchant_id, "code": f"MALL{tag}", "title": "Mall", "description": "Cached",
+            "discount_type": "flat", "discount_value": 10, "valid_until": "2099-01-01T00:00:00", "radius_km": 0.4,
+        })).json()["coupon_id"]
+
+        async def offers(dest_lat):
+            return (await ac.get(f"/nearby-merchant-coupons?user_id=1&dest_lat={dest_lat}&dest_lng={lng}")).json()
+
+        hits = metrics.get("offer_cache.hits")
+        first, closer, outside = await offers(lat), await offers(lat + 0.0008), await offers(lat - 0.0012)
+        cached = metrics.get("offer_cache.hits") - hits
+        await ac.post(f"/toggle-merchant-coupon/{coupon_id}?is_active=false")
+        toggled = await offers(lat)
+        await ac.delete(f"/delete-merchant/{merchant_id}")
+
+    assert [c["coupon_id"] for c in first] == [coupon_id]
+    # Same cell, different answers: distances are exact, not the cell centre's
+    assert first[0]["distance_km"] == pytest.approx(0.33, abs=0.01)
+    assert closer[0]["distance_km"] == pytest.approx(0.24, abs=0.01)
+    assert outside == [] and cached == 2
+    assert toggled == []
+
+@pytest.mark.asyncio
+async def test_user_stats_follow_completions_and_deletions():
+    import random
+    import db
+    import models
+    import retention
+    import user_stats
+
+    tag = uuid.uuid4().hex[:8]
+    lat, lng = -46 + random.random() * 4, 168 + random.random() * 4
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        driver_ids = (await ac.post("/bulk-register-drivers", content=json.dumps(
+            {"name": "Stats", "email": f"stats-{tag}@example.com", "status": "online"}))).json()["ids"]
+        user_id = (await ac.post("/bulk-register-users", content=json.dumps(
+            {"name": "Regular", "email": f"regular-{tag}@example.com"}))).json()["ids"][0]
+        ride_ids = (await ac.post("/simulate-rides-batch", json={
+            "driver_ids": driver_ids, "user_ids": [user_id], "rides": 3, "trip_seconds": 0.1
+        })).json()["ride_ids"]
+        for _ in range(50):
+            statuses = [(await ac.get(f"/ride/{ride_id}")).json()["status"] for ride_id in ride_ids]
+            if all(status == "completed" for status in statuses):
+                break
+            await asyncio.sleep(0.1)
+
+        merchant_id = (await ac.post("/register-merchant", json={
+            "name": f"Loyal {tag}", "email": f"loyal-{tag}@example.com", "business_type": "cafe",
+            "address": "Loyal", "latitude": lat, "longitude": lng,
+        })).json()["merchant_id"]
+        await ac.post("/create-merchant-coupon", json={
+            "merchant_id": merchant_id, "code": f"LOYAL{tag}", "title": "Regulars", "description": "Three rides",
+            "discount_type": "flat", "discount_value": 10, "valid_until": "2099-01-01T00:00:00",
+            "radius_km": 1, "min_rides_required": 3,
+        })
+
+        async def offered():
+            return [c["code"] for c in (await ac.get(
+                f"/nearby-merchant-coupons?user_id={user_id}&dest_lat={lat}&dest_lng={lng}")).json()]
+
+        before = await offered()
+        with db.SessionLocal() as session:
+            live = user_stats.get(session, user_id)
+            fares = sum(session.get(models.RideQueue, ride_id).final_fare for ride_id in ride_ids)
+        user_stats.backfill(db.engine)
+        with db.SessionLocal() as session:
+            rebuilt = user_stats.get(session, user_id)
+        retention.purge("ride_queue", models.RideQueue.id == ride_ids[0], pause=0)
+        with db.SessionLocal() as session:
+            purged = user_stats.get(session, user_id)
+        after = await offered()
+        await ac.delete(f"/delete-merchant/{merchant_id}")
+
+    assert live == rebuilt == (3, pytest.approx(fares))
+    assert purged[0] == 2
+    assert before == [f"LOYAL{tag}"] and after == []
+
+@pytest.mark.asyncio
+async def test_admin_stats_come_from_minute_rollups():
+    from datetime import datetime, timedelta
+    from server import main as api
+    import db
+    import models
+    import retention
+    import ride_rollups
+
+    tag = uuid.uuid4().hex[:8]
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        driver_ids = (await ac.post("/bulk-register-drivers", content="\n".join(json.dumps(
+            {"name": "Rollup", "email": f"rollup-{tag}-{i}@example.com", "status": "online"}) for i in range(2)
+        ))).json()["ids"]
+        user_ids = (await ac.post("/bulk-register-users", content=json.dumps(
+            {"name": "Rollup rider", "email": f"rollup-{tag}@example.com"}))).json()["ids"]
+
+        async def stats(**params):
+            await asyncio.to_thread(api.rollup_worker.run_once)
+            return (await ac.get("/admin/stats", params={"period": "hour", **params})).json()
+
+        before = await stats()
+        quick = (await ac.post("/simulate-rides-batch", json={
+            "driver_ids": driver_ids[:1], "user_ids": user_ids, "rides": 3, "trip_seconds": 0.1
+        })).json()["ride_ids"]
+        slow = (await ac.post("/simulate-rides-batch", json={
+            "driver_ids": driver_ids[1:], "user_ids": user_ids, "rides": 1, "trip_seconds": 600
+        })).json()["ride_ids"]
+        for _ in range(50):
+            statuses = [(await ac.get(f"/ride/{ride_id}")).json()["status"] for ride_id in quick]
+            if all(status == "completed" for status in statuses):
+                break
+            await asyncio.sleep(0.1)
+        during = await stats(by_zone="true")
+        retention.purge("ride_queue", models.RideQueue.id.in_(slow), pause=0)
+        after = await stats()
+        bad = (await ac.get("/admin/stats", params={"period": "fortnight"})).json()
+
+    assert during["booked"] - before["booked"] == 4
+    assert during["completed"] - before["completed"] == 3
+    assert during["revenue"] - before["revenue"] == pytest.approx(300)
+    assert during["active_rides"] - before["active_rides"] == 1
+    assert after["active_rides"] == before["active_rides"]
+    assert sum(z["booked"] for z in during["zones"].values()) == during["booked"]
+    assert "error" in bad
+
+    # Compacting into hours changes the resolution, never the totals
+    with db.SessionLocal() as session:
+        totals = ride_rollups.stats(session)
+        assert ride_rollups.compact(session, datetime.utcnow() + timedelta(days=3)) > 0
+        assert ride_rollups.stats(session) == totals
+        assert session.query(models.RideRollup).filter(models.RideRollup.span == 1).count() == 0
+        session.rollback()